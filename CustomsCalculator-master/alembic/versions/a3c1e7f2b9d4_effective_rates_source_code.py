@@ -0,0 +1,34 @@
+"""Effective rates: source_code and one rate per code
+
+Revision ID: a3c1e7f2b9d4
+Revises: 5d42a0c65360
+Create Date: 2026-10-18 10:12:31.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c1e7f2b9d4'
+down_revision: Union[str, Sequence[str], None] = '5d42a0c65360'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tariff_rates', sa.Column('source_code', sqlmodel.sql.sqltypes.AutoString(length=10), nullable=True))
+    # Импорт материализует ровно одну действующую ставку на код
+    op.drop_index(op.f('ix_tariff_rates_tn_ved_code_id'), table_name='tariff_rates')
+    op.create_index(op.f('ix_tariff_rates_tn_ved_code_id'), 'tariff_rates', ['tn_ved_code_id'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_tariff_rates_tn_ved_code_id'), table_name='tariff_rates')
+    op.create_index(op.f('ix_tariff_rates_tn_ved_code_id'), 'tariff_rates', ['tn_ved_code_id'], unique=False)
+    op.drop_column('tariff_rates', 'source_code')
@@ -0,0 +1,76 @@
+"""Tariff versions with active pointer
+
+Revision ID: a8d3f5c7e214
+Revises: f2b8d4e6a173
+Create Date: 2026-10-18 20:31:42.907715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3f5c7e214'
+down_revision: Union[str, Sequence[str], None] = 'f2b8d4e6a173'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('tariff_versions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.Enum('BUILDING', 'ACTIVE', 'RETIRED', name='tariffversionstatus'), nullable=False),
+    sa.Column('source', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('rate_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.Column('published_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Активной может быть только одна версия
+    op.create_index('uq_tariff_versions_active', 'tariff_versions', ['status'], unique=True,
+                    postgresql_where=sa.text("status = 'ACTIVE'"))
+
+    # Текущие ставки становятся первой (активной) версией
+    op.execute(
+        "INSERT INTO tariff_versions (id, status, source, rate_count, published_at) "
+        "SELECT 1, 'ACTIVE', 'migration', count(*), now() FROM tariff_rates"
+    )
+    op.execute("SELECT setval(pg_get_serial_sequence('tariff_versions', 'id'), 1)")
+
+    op.add_column('tariff_rates', sa.Column('version_id', sa.Integer(), nullable=True))
+    op.execute("UPDATE tariff_rates SET version_id = 1")
+    op.alter_column('tariff_rates', 'version_id', nullable=False)
+    op.create_foreign_key('tariff_rates_version_id_fkey', 'tariff_rates', 'tariff_versions', ['version_id'], ['id'])
+    op.create_index(op.f('ix_tariff_rates_version_id'), 'tariff_rates', ['version_id'], unique=False)
+
+    # Одна ставка на код - теперь в пределах версии
+    op.drop_index(op.f('ix_tariff_rates_tn_ved_code_id'), table_name='tariff_rates')
+    op.create_index(op.f('ix_tariff_rates_tn_ved_code_id'), 'tariff_rates', ['tn_ved_code_id'], unique=False)
+    op.create_unique_constraint('uq_tariff_rates_version_code', 'tariff_rates', ['version_id', 'tn_ved_code_id'])
+
+    op.add_column('tariff_sync_log', sa.Column('version_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('tariff_sync_log', 'version_id')
+
+    # Остаются только ставки активной версии
+    op.execute(
+        "DELETE FROM tariff_rates WHERE version_id NOT IN "
+        "(SELECT id FROM tariff_versions WHERE status = 'ACTIVE')"
+    )
+    op.drop_constraint('uq_tariff_rates_version_code', 'tariff_rates', type_='unique')
+    op.drop_index(op.f('ix_tariff_rates_tn_ved_code_id'), table_name='tariff_rates')
+    op.create_index(op.f('ix_tariff_rates_tn_ved_code_id'), 'tariff_rates', ['tn_ved_code_id'], unique=True)
+    op.drop_index(op.f('ix_tariff_rates_version_id'), table_name='tariff_rates')
+    op.drop_constraint('tariff_rates_version_id_fkey', 'tariff_rates', type_='foreignkey')
+    op.drop_column('tariff_rates', 'version_id')
+
+    op.drop_index('uq_tariff_versions_active', table_name='tariff_versions', postgresql_where=sa.text("status = 'ACTIVE'"))
+    op.drop_table('tariff_versions')
+    sa.Enum(name='tariffversionstatus').drop(op.get_bind(), checkfirst=True)
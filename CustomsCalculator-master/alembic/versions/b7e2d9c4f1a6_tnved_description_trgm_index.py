@@ -0,0 +1,33 @@
+"""Trigram GiST index on tn_ved_codes.description
+
+Revision ID: b7e2d9c4f1a6
+Revises: a3c1e7f2b9d4
+Create Date: 2026-10-18 14:05:47.305118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2d9c4f1a6'
+down_revision: Union[str, Sequence[str], None] = 'a3c1e7f2b9d4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # GiST (а не GIN): кроме фильтра % поддерживает KNN-сортировку по расстоянию <->
+    op.create_index(
+        'ix_tn_ved_codes_description_trgm', 'tn_ved_codes', ['description'],
+        postgresql_using='gist',
+        postgresql_ops={'description': 'gist_trgm_ops'},
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tn_ved_codes_description_trgm', table_name='tn_ved_codes')
@@ -0,0 +1,41 @@
+"""Full-text search: description_uz and tsvector with GIN index
+
+Revision ID: c4f8a2d6e913
+Revises: b7e2d9c4f1a6
+Create Date: 2026-10-18 15:21:09.644712
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4f8a2d6e913'
+down_revision: Union[str, Sequence[str], None] = 'b7e2d9c4f1a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tn_ved_codes', sa.Column('description_uz', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    # Русское описание - со стеммингом (вес A), узбекское - конфиг simple (вес B):
+    # узбекского стеммера в Postgres нет
+    op.execute("""
+        ALTER TABLE tn_ved_codes ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(description, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(description_uz, '')), 'B')
+        ) STORED
+    """)
+    op.create_index('ix_tn_ved_codes_search_vector', 'tn_ved_codes', ['search_vector'], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tn_ved_codes_search_vector', table_name='tn_ved_codes')
+    op.drop_column('tn_ved_codes', 'search_vector')
+    op.drop_column('tn_ved_codes', 'description_uz')
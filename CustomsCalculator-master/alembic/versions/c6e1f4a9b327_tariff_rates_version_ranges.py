@@ -0,0 +1,51 @@
+"""Tariff rates valid for a range of versions
+
+Revision ID: c6e1f4a9b327
+Revises: a8d3f5c7e214
+Create Date: 2026-10-18 23:12:05.318406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6e1f4a9b327'
+down_revision: Union[str, Sequence[str], None] = 'a8d3f5c7e214'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Строка действует в версиях [version_id, retired_version_id): версия хранит только изменения
+    op.add_column('tariff_rates', sa.Column('retired_version_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_tariff_rates_retired_version_id'), 'tariff_rates', ['retired_version_id'], unique=False)
+
+    # Прежние версии - полные копии, в новой схеме они дублировали бы активную: остается только активная
+    op.execute(
+        "DELETE FROM tariff_rates WHERE version_id NOT IN "
+        "(SELECT id FROM tariff_versions WHERE status = 'ACTIVE')"
+    )
+    op.execute("DELETE FROM tariff_versions WHERE status <> 'ACTIVE'")
+
+    # version_id - начало диапазона: версия, где строка появилась, может быть удалена очисткой
+    op.drop_constraint('tariff_rates_version_id_fkey', 'tariff_rates', type_='foreignkey')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Остаются только ставки активной версии, все - строками этой версии
+    op.execute(
+        "DELETE FROM tariff_rates WHERE NOT EXISTS ("
+        "SELECT 1 FROM tariff_versions v WHERE v.status = 'ACTIVE' AND tariff_rates.version_id <= v.id "
+        "AND (tariff_rates.retired_version_id IS NULL OR tariff_rates.retired_version_id > v.id))"
+    )
+    op.execute("UPDATE tariff_rates SET version_id = (SELECT id FROM tariff_versions WHERE status = 'ACTIVE')")
+    op.execute("DELETE FROM tariff_versions WHERE status <> 'ACTIVE'")
+    op.create_foreign_key('tariff_rates_version_id_fkey', 'tariff_rates', 'tariff_versions', ['version_id'], ['id'])
+
+    op.drop_index(op.f('ix_tariff_rates_retired_version_id'), table_name='tariff_rates')
+    op.drop_column('tariff_rates', 'retired_version_id')
@@ -0,0 +1,46 @@
+"""TN VED tree: materialized path, depth and subtree aggregates
+
+Revision ID: d91b3f6a2c58
+Revises: c4f8a2d6e913
+Create Date: 2026-10-18 16:40:12.873301
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd91b3f6a2c58'
+down_revision: Union[str, Sequence[str], None] = 'c4f8a2d6e913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('tn_ved_codes', sa.Column('path', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('tn_ved_codes', sa.Column('depth', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tn_ved_codes', sa.Column('descendant_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('tn_ved_codes', sa.Column('min_duty_rate', sa.Float(), nullable=True))
+    op.add_column('tn_ved_codes', sa.Column('max_duty_rate', sa.Float(), nullable=True))
+    # varchar_pattern_ops: LIKE 'путь.%' использует индекс при любой collation БД
+    op.create_index(
+        'ix_tn_ved_codes_path', 'tn_ved_codes', ['path'],
+        postgresql_ops={'path': 'varchar_pattern_ops'},
+    )
+    # Корни дерева и keyset-пагинация по коду
+    op.create_index('ix_tn_ved_codes_depth_code', 'tn_ved_codes', ['depth', 'code'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_tn_ved_codes_depth_code', table_name='tn_ved_codes')
+    op.drop_index('ix_tn_ved_codes_path', table_name='tn_ved_codes')
+    op.drop_column('tn_ved_codes', 'max_duty_rate')
+    op.drop_column('tn_ved_codes', 'min_duty_rate')
+    op.drop_column('tn_ved_codes', 'descendant_count')
+    op.drop_column('tn_ved_codes', 'depth')
+    op.drop_column('tn_ved_codes', 'path')
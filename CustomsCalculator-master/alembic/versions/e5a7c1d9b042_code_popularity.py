@@ -0,0 +1,35 @@
+"""Code popularity counters
+
+Revision ID: e5a7c1d9b042
+Revises: d91b3f6a2c58
+Create Date: 2026-10-18 18:02:55.190427
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c1d9b042'
+down_revision: Union[str, Sequence[str], None] = 'd91b3f6a2c58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('code_popularity',
+    sa.Column('code', sqlmodel.sql.sqltypes.AutoString(length=10), nullable=False),
+    sa.Column('selected_count', sa.Integer(), nullable=False),
+    sa.Column('calculated_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('code')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('code_popularity')
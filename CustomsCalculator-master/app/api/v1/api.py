@@ -1,8 +1,19 @@
+import logging
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, APIRouter
-from app.api.v1.endpoints import countries, tnved, calculator, currency, rates, excise
-from app.core.database import create_db_and_tables
+from app.api.v1.endpoints import countries, tnved, calculator, currency, rates, excise, metrics
+from sqlmodel import Session
+
+from app.core.database import create_db_and_tables, engine
+from app.services.currency_cache import currency_cache
+from app.core.config import settings
+from app.services.metrics import install_sql_counter
+from app.services.popularity import popularity, start_flusher
+from app.services.search import prewarm_search_cache
+from app.services.snapshot import refresh_snapshot
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 router.include_router(tnved.router, prefix="/api/v1", tags=["TNVED"])
@@ -11,12 +22,35 @@ router.include_router(countries.router, prefix="/api/v1", tags=["Countries"])
 router.include_router(currency.router, prefix="/api/v1", tags=["Currency"])
 router.include_router(rates.router, prefix="/api/v1", tags=["Rates & Duties"])
 router.include_router(excise.router, prefix="/api/v1", tags=["Excise"])
+router.include_router(metrics.router, prefix="/api/v1", tags=["Metrics"])
+
+# Число SQL-запросов на HTTP-запрос (заголовок Server-Timing и GET /metrics)
+install_sql_counter(engine)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 	# Событие при запуске
 	create_db_and_tables()
+	
+	# Загружаем кэш курсов и снимок тарифов один раз на процесс
+	try:
+		with Session(engine) as session:
+			currency_cache.load(session)
+			refresh_snapshot(session)
+	except Exception as e:
+		# Не валим старт: снимок догрузится при первом расчете
+		logger.error(f"❌ Не удалось загрузить снимок тарифов: {e}")
+	
+	# Популярность кодов и прогрев кэша поиска по самым популярным кодам
+	try:
+		with Session(engine) as session:
+			popularity.load(session)
+			warmed = prewarm_search_cache(session, popularity.hot)
+			logger.info(f"🔥 Кэш поиска прогрет: {warmed} запросов")
+	except Exception as e:
+		logger.error(f"❌ Не удалось прогреть кэш поиска: {e}")
+	stop_flusher = start_flusher(engine, settings.POPULARITY_FLUSH_SECONDS)
 	yield
-	# Здесь можно сделать действия при выключении, если нужно
-	# например закрытие соединений, очистка ресурсов и т.д.
+	# При выключении сбрасываем накопленные счетчики популярности
+	stop_flusher()
 
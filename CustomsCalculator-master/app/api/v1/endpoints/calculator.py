@@ -1,8 +1,14 @@
+import numpy as np
 from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session
 from app.core.database import get_session
 from app.services.calculator import DutyCalculator
-from app.schemas.calculation import CalculationRequest, CalculationResponse
+from app.services.popularity import popularity, CALCULATED
+from app.services.snapshot import get_snapshot
+from app.schemas.calculation import (CalculationRequest, CalculationResponse, DeclarationRequest, DeclarationResponse,
+                                     InverseRequest, InverseResponse, OriginComparisonResponse, SweepRequest,
+                                     SweepResponse)
+from app.services.bulk_engine import BulkDutyEngine
 
 router = APIRouter()
 
@@ -19,7 +25,8 @@ def calculate_duty(
 	3. НДС (12% от базы)
 	4. Таможенный сбор (0.2%)
 	"""
-	calculator = DutyCalculator(session)
+	# Справочники берутся из снимка в памяти, запросов в БД на расчет нет
+	calculator = DutyCalculator(session, snapshot=get_snapshot(session))
 	
 	# Передаем новые поля (manufacturing_year, power_hp) в сервис
 	result = calculator.calculate(
@@ -38,4 +45,95 @@ def calculate_duty(
 	if result.get("error"):
 		raise HTTPException(status_code=404, detail=result["error"])
 	
-	return result
\ No newline at end of file
+	# Популярность - по коду, чья ставка применена, а не по введенной строке
+	popularity.record(result["resolved_code"], CALCULATED)
+	return result
+
+
+@router.post("/calculate/batch", response_model=DeclarationResponse)
+def calculate_declaration(
+		request: DeclarationRequest,
+		session: Session = Depends(get_session)
+):
+	"""
+	Расчет декларации из многих товарных позиций за один запрос.
+	Таможенный сбор (ПКМ 55) начисляется один раз от общей таможенной стоимости.
+	Позиции с ненайденным кодом возвращаются с error и не входят в итоги.
+	"""
+	calculator = DutyCalculator(session, snapshot=get_snapshot(session))
+	result = calculator.calculate_declaration([line.model_dump() for line in request.lines])
+	for line in result["lines"]:
+		if not line.get("error"):
+			popularity.record(line["resolved_code"], CALCULATED)
+	return result
+
+
+@router.post("/calculate/origins", response_model=OriginComparisonResponse)
+def compare_origins(
+		request: CalculationRequest,
+		session: Session = Depends(get_session)
+):
+	"""
+	Платежи по одному товару для всех стран происхождения из справочника.
+	Расчет выполняется один раз на режим торговли (ЗСТ, РНБ, генеральный),
+	страны отсортированы по возрастанию платежей. origin_country_code игнорируется.
+	"""
+	calculator = DutyCalculator(session, snapshot=get_snapshot(session))
+	result = calculator.calculate_origins(**request.model_dump())
+	
+	if result.get("error"):
+		raise HTTPException(status_code=404, detail=result["error"])
+	
+	return result
+
+
+@router.post("/calculate/inverse", response_model=InverseResponse)
+def calculate_max_value(
+		request: InverseRequest,
+		session: Session = Depends(get_session)
+):
+	"""
+	Обратный расчет: максимальная таможенная стоимость, при которой все платежи
+	укладываются в budget_usd. Решается за один запрос, без перебора стоимости на клиенте.
+	"""
+	calculator = DutyCalculator(session, snapshot=get_snapshot(session))
+	result = calculator.calculate_max_value(**request.model_dump())
+	
+	if result.get("error"):
+		raise HTTPException(status_code=404, detail=result["error"])
+	
+	return result
+
+
+@router.post("/calculate/sweep", response_model=SweepResponse)
+def sweep_payments(
+		request: SweepRequest,
+		session: Session = Depends(get_session)
+):
+	"""
+	Платежи как функция одного или двух параметров (стоимость, вес, объем и т.д.).
+	Вся сетка считается за один запрос векторным движком.
+	"""
+	snapshot = get_snapshot(session)
+	base = request.base.model_dump()
+	if not snapshot.find_rate(base["tn_code"]):
+		raise HTTPException(status_code=404, detail="Код ТН ВЭД не найден")
+	
+	x_values = np.linspace(request.x.start, request.x.stop, request.x.points)
+	y_values = np.linspace(request.y.start, request.y.stop, request.y.points) if request.y else None
+	
+	engine = BulkDutyEngine(snapshot)
+	grid = engine.sweep(base, request.x.field, x_values,
+	                    request.y.field if request.y else None, y_values)
+	
+	return SweepResponse(
+		tn_code=base["tn_code"],
+		currency_rate=round(engine.usd_rate, 2),
+		currency_rate_date=snapshot.usd_rate_date,
+		x_field=request.x.field,
+		x_values=x_values.tolist(),
+		y_field=request.y.field if request.y else None,
+		y_values=y_values.tolist() if y_values is not None else None,
+		**{key: np.round(grid[key], 2).tolist()
+		   for key in ("duty_usd", "excise_usd", "vat_usd", "customs_fee_usd", "util_usd", "total_usd", "total_uzs")}
+	)
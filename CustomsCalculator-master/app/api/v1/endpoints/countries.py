@@ -5,6 +5,7 @@ from sqlmodel import Session, select
 from app.core.database import get_session
 from app.models.country import Country
 from app.services.parsers.parser_countries import sync_countries_from_lexuz
+from app.services.snapshot import refresh_snapshot
 
 router = APIRouter()
 
@@ -14,6 +15,8 @@ async def sync_countries(session: Session = Depends(get_session)):
     Запускает парсер Lex.uz.
     """
     result = await sync_countries_from_lexuz(session)
+    # Режимы стран входят в снимок тарифов
+    refresh_snapshot(session)
     return result
 
 @router.get("/countries", response_model=List[Country])
@@ -6,6 +6,8 @@ from app.core.database import get_session
 from app.services.parsers.parser_currency import CurrencyClient
 from app.schemas.currency import CurrencyRateResponse
 from app.models.currency import CurrencyRate
+from app.services.currency_cache import currency_cache
+from app.services.snapshot import refresh_usd_rate
 
 router = APIRouter()
 
@@ -15,7 +17,10 @@ async def refresh_currency_rates(session: Session = Depends(get_session)):
 	"""Обновляет курсы с сайта ЦБ"""
 	client = CurrencyClient()
 	try:
-		return await client.update_rates(session)
+		result = await client.update_rates(session)
+		# Курс USD входит в снимок тарифов
+		refresh_usd_rate(session)
+		return result
 	except Exception as e:
 		raise HTTPException(status_code=500, detail=str(e))
 
@@ -41,4 +46,10 @@ def get_latest_rates(session: Session = Depends(get_session)):
 			rate=r.rate,
 			date=r.date
 		))
-	return response
\ No newline at end of file
+	return response
+
+
+@router.get("/currency/cache")
+def get_currency_cache_stats():
+	"""Состояние кэша курсов: попадания/промахи, возраст кэша и курса USD"""
+	return currency_cache.stats()
@@ -6,7 +6,10 @@ from app.core.config import settings
 from app.core.database import get_session
 from app.schemas.rates import SyncStatus
 
+from app.services.calculator import carry_over_calculations
 from app.services.importers.import_excise import import_excise_data
+from app.services.search import carry_over_search
+from app.services.snapshot import current_snapshot, refresh_snapshot
 
 router = APIRouter()
 
@@ -15,13 +18,23 @@ router = APIRouter()
 def sync_excise(background_tasks: BackgroundTasks, db: Session = Depends(get_session)):
 	try:
 	
-		count_excise = import_excise_data(session=db)
+		# Коды, у которых акциз действительно изменился
+		changed_codes = import_excise_data(session=db)
 		db.commit()
+		count_excise = len(changed_codes)
+		if changed_codes:
+			previous = current_snapshot()
+			snapshot = refresh_snapshot(db)
+			# Как в /rates/sync: кэш расчетов сбрасывается только по затронутым кодам,
+			# описания не менялись - кэш поиска переносится целиком
+			carry_over_calculations(previous, snapshot, changed_codes)
+			carry_over_search(previous, snapshot)
 		return SyncStatus(
 			status="success",
-			message=f"База успешно обновлена. Акцизы наложены на {count_excise} позиций.",
+			message=f"База успешно обновлена. Акциз изменен у {count_excise} кодов.",
 			processed_files="excise_tnved_data.json",
-			total_rates=count_excise
+			total_rates=count_excise,
+			updated=count_excise
 		)
 	
 	except Exception as e:
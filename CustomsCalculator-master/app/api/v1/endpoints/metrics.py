@@ -0,0 +1,32 @@
+from fastapi import APIRouter
+
+from app.services.currency_cache import currency_cache
+from app.services.metrics import histograms
+from app.services.popularity import popularity
+from app.services.result_cache import calculation_cache, search_cache
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+def get_metrics():
+	"""
+	Гистограммы времени по стадиям расчета (lookup, regime, currency, duty, excise, vat, fee, util)
+	и числа SQL-запросов на HTTP-запрос с момента старта процесса, плюс состояние кэшей.
+	"""
+	return {
+		**histograms.stats(),
+		"currency_cache": currency_cache.stats(),
+		"result_cache": {
+			"search": search_cache.stats(),
+			"calculation": calculation_cache.stats(),
+		},
+		"popularity": popularity.stats(),
+	}
+
+
+@router.delete("/metrics")
+def reset_metrics():
+	"""Обнуляет гистограммы (например, перед нагрузочным тестом)"""
+	histograms.reset()
+	return {"status": "ok"}
@@ -1,12 +1,19 @@
 # app/api/v1/endpoints/rates.py
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlmodel import Session
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
+from sqlmodel import Session, select
 
 from app.core.database import get_session
 from app.schemas.rates import SyncStatus
 from app.services.parsers.parser_duties import run_duties_parser
-from app.services.importers.import_duties import import_csv_to_db
-from app.services.importers.import_excise import import_excise_data
+from app.models import TariffSyncLog, TariffVersion, TariffVersionStatus
+from app.services.importers.import_excise import load_excise_items
+from app.services.importers.sync_duties import sync_duties
+from app.services.calculator import carry_over_calculations
+from app.services.search import carry_over_search
+from app.services.snapshot import current_snapshot, refresh_snapshot
+from app.services.tariff_versions import activate_version
+from app.services.tnved_tree import rebuild_tnved_tree
 
 router = APIRouter()
 
@@ -19,30 +26,76 @@ def sync_rates_full(
 	"""
 	Запускает полный цикл обновления ставок:
 	1. Парсинг Lex.uz -> CSV
-	2. CSV -> Таблица TariffRates (очистка и вставка)
-	3. JSON -> Наложение акцизов
+	2. CSV + акцизы из JSON -> разница со ставками активной версии
+	3. Новая версия (только изменения относительно предыдущей) проверяется и становится активной,
+	   расчеты в других сессиях видят старую версию до коммита (журнал в tariff_sync_log)
 	"""
 	try:
 		# 1. Парсинг
 		csv_path = run_duties_parser()
 		
-		# 2. Импорт пошлин
+		# 2. Инкрементальный импорт пошлин с акцизами, наложенными в памяти
 		# Передаем путь строкой, так как pandas read_csv умеет работать с Path, но лучше str
-		count_duties = import_csv_to_db(session=db, csv_path=str(csv_path))
-		
-		# 3. Импорт акцизов
-		count_excise = import_excise_data(session=db)
+		log = sync_duties(session=db, csv_path=str(csv_path), excise_items=load_excise_items())
 		
 		# Подтверждаем транзакцию
 		db.commit()
 		
+		# Снимок (и ключи кэшей результатов по его версии) меняем только если что-то изменилось
+		if log.changed_codes or log.names_updated:
+			previous = current_snapshot()
+			snapshot = refresh_snapshot(db)
+			# Кэш сбрасывается только по затронутым кодам, остальное переносится на новую версию
+			carry_over_calculations(previous, snapshot, log.changed_codes)
+			if not log.names_updated:
+				carry_over_search(previous, snapshot)
+		
 		return SyncStatus(
 			status="success",
-			message=f"База успешно обновлена. Акцизы наложены на {count_excise} позиций.",
+			message=f"База успешно обновлена. Изменено ставок: {len(log.changed_codes)}.",
 			processed_files=csv_path.name,
-			total_rates=count_duties
+			total_rates=log.inserted + log.updated + log.unchanged,
+			inserted=log.inserted,
+			updated=log.updated,
+			deleted=log.deleted,
+			unchanged=log.unchanged
 		)
 	
 	except Exception as e:
 		db.rollback()  # Откат, если что-то упало посередине
-		raise HTTPException(status_code=500, detail=f"Ошибка синхронизации: {str(e)}")
\ No newline at end of file
+		raise HTTPException(status_code=500, detail=f"Ошибка синхронизации: {str(e)}")
+
+
+@router.get("/rates/sync/log", response_model=List[TariffSyncLog])
+def get_sync_log(limit: int = Query(20, ge=1, le=200), db: Session = Depends(get_session)):
+	"""Последние синхронизации ставок: счетчики и измененные коды"""
+	return db.exec(select(TariffSyncLog).order_by(TariffSyncLog.id.desc()).limit(limit)).all()
+
+
+@router.get("/rates/versions", response_model=List[TariffVersion])
+def get_versions(db: Session = Depends(get_session)):
+	"""Версии ставок: активная и сохраненные предыдущие (для отката)"""
+	return db.exec(select(TariffVersion).order_by(TariffVersion.id.desc())).all()
+
+
+@router.post("/rates/versions/{version_id}/activate", response_model=TariffVersion)
+def activate_rates_version(version_id: int, db: Session = Depends(get_session)):
+	"""
+	Мгновенный откат (или возврат) к сохраненной версии ставок:
+	меняется только указатель активной версии, ставки не копируются.
+	"""
+	version = db.get(TariffVersion, version_id)
+	if version is None or version.status == TariffVersionStatus.BUILDING:
+		raise HTTPException(status_code=404, detail="Version not found")
+	
+	try:
+		activate_version(db, version_id)
+		rebuild_tnved_tree(db)
+		db.commit()
+	except Exception as e:
+		db.rollback()
+		raise HTTPException(status_code=500, detail=f"Ошибка активации версии: {str(e)}")
+	
+	refresh_snapshot(db)
+	db.refresh(version)
+	return version
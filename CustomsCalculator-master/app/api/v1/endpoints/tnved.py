@@ -1,11 +1,18 @@
-from typing import List
-from fastapi import APIRouter, Depends, Query, HTTPException
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session, select
 
 from app.core.database import get_session
 from app.models import TnVedCode
-from app.services.search import search_tnved_smart
-from app.schemas.tnved import TnVedRichResponse
+from app.services.metrics import mark_streaming, stage_iter
+from app.services.popularity import popularity, SELECTED
+from app.services.search import (classify_lines, compact_entry, search_tnved_compact, search_tnved_semantic,
+                                 search_tnved_smart)
+from app.services.snapshot import get_snapshot
+from app.services.tnved_tree import tree_children
+from app.schemas.tnved import (TnVedRichResponse, TnVedCompactResponse, TnVedTreeNode, TnVedTreeResponse,
+                               ClassifyRequest, ClassifyCandidate, ClassifyLineResult)
 
 router = APIRouter()
 
@@ -23,24 +30,82 @@ def get_code_details(code: str, db: Session = Depends(get_session)):
 	if not item:
 		raise HTTPException(status_code=404, detail="Code not found")
 	
+	# Открытие карточки кода = выбор кода пользователем (для ранжирования поиска)
+	popularity.record(item.code, SELECTED)
 	return item
 
 
-@router.get("/tnved/search", response_model=List[TnVedRichResponse])
+@router.get("/tnved/tree", response_model=TnVedTreeResponse)
+def get_tree_children(
+		parent: Optional[str] = Query(None, description="Код узла (пусто - корни дерева)"),
+		after: Optional[str] = Query(None, description="Последний код предыдущей страницы"),
+		limit: int = Query(50, ge=1, le=500),
+		db: Session = Depends(get_session)
+):
+	"""
+	Ленивая загрузка дерева: дочерние узлы одного уровня, один индексный запрос.
+	Число потомков и диапазон ставок посчитаны заранее при импорте.
+	"""
+	children = tree_children(db, parent_code=parent, after=after, limit=limit)
+	if children is None:
+		raise HTTPException(status_code=404, detail="Code not found")
+	
+	items = [
+		TnVedTreeNode(
+			code=item.code,
+			description=item.description,
+			depth=item.depth,
+			descendant_count=item.descendant_count,
+			has_children=item.descendant_count > 0,
+			min_duty_rate=item.min_duty_rate,
+			max_duty_rate=item.max_duty_rate
+		)
+		for item in children
+	]
+	return TnVedTreeResponse(
+		parent_code=parent,
+		items=items,
+		next_after=items[-1].code if len(items) == limit else None
+	)
+
+
+@router.get("/tnved/search", response_model=List[TnVedRichResponse],
+            responses={200: {"model": List[TnVedRichResponse] | List[TnVedCompactResponse]}})
 def search_goods(
+		response: Response,
 		q: str = Query(..., min_length=2, description="Код или описание"),
 		limit: int = 20,
+		mode: Literal["smart", "semantic"] = Query("smart", description="smart - триграммы/полнотекст, semantic - TF-IDF"),
+		view: Literal["full", "compact"] = Query("full", description="compact - код, описание и ставка строкой"),
 		db: Session = Depends(get_session)
 ):
-	raw_results = search_tnved_smart(session=db, query=q, limit=limit)
+	headers = {}
+	if q.strip().isdigit():
+		# Сколько всего кодов под префиксом ("1 234 кода в 8703"), а не только на странице
+		headers["X-Total-Count"] = str(get_snapshot(db).count_prefix(q.strip()))
+	response.headers.update(headers)
 	
-	response = []
+	if mode == "semantic":
+		raw_results = search_tnved_semantic(get_snapshot(db), query=q, limit=limit)
+		if raw_results is None:
+			raise HTTPException(status_code=503, detail="Семантический индекс не собран (scripts/build_semantic_index.py)")
+	elif view == "compact":
+		# Готовые словари отдаются как есть, без валидации через response_model
+		return JSONResponse(search_tnved_compact(session=db, query=q, limit=limit), headers=headers)
+	else:
+		raw_results = search_tnved_smart(session=db, query=q, limit=limit)
+	
+	if view == "compact":
+		return JSONResponse([compact_entry(item, score) for item, score in raw_results], headers=headers)
+	
+	results = []
 	for item, score in raw_results:
 		# ВАЖНО: Добавляем маппинг новых полей
 		tnved_data = TnVedRichResponse(
 			id=item.id,
 			code=item.code,
 			description=item.description,
+			description_uz=item.description_uz,
 			unit=item.unit,
 			unit2=item.unit2,
 			# Прокидываем данные для утильсбора
@@ -50,6 +115,38 @@ def search_goods(
 			match_percentage=score,
 			rates=item.rates
 		)
-		response.append(tnved_data)
+		results.append(tnved_data)
+	
+	return results
+
+
+@router.post("/tnved/classify", response_class=StreamingResponse)
+def classify_invoice_lines(
+		request: ClassifyRequest,
+		db: Session = Depends(get_session)
+):
+	"""
+	Подбор кодов ТН ВЭД для многих строк инвойса за один запрос.
+	Поиск идет по снимку в памяти одним общим проходом, ответ - NDJSON
+	(одна JSON-строка на строку инвойса), строки отдаются по мере готовности.
+	"""
+	snapshot = get_snapshot(db)
+	# Стадии отработают уже после отправки заголовков
+	mark_streaming()
+	# Подбор идет по мере чтения генератора: замеряем каждую строку, а не создание генератора
+	results = stage_iter("classify", classify_lines(snapshot, request.lines, limit=request.limit))
+	
+	def stream():
+		for line_no, (query, found) in enumerate(zip(request.lines, results), start=1):
+			line = ClassifyLineResult(
+				line_no=line_no,
+				query=query,
+				candidates=[
+					ClassifyCandidate(code=item.code, description=item.description, unit=item.unit,
+					                  match_percentage=score)
+					for item, score in found
+				]
+			)
+			yield line.model_dump_json() + "\n"
 	
-	return response
\ No newline at end of file
+	return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -3,6 +3,7 @@
 from pydantic_settings import BaseSettings
 from pathlib import Path
 from functools import lru_cache
+from typing import Literal
 
 
 class Settings(BaseSettings):
@@ -19,6 +20,38 @@ class Settings(BaseSettings):
     # --- DATABASE ---
     DATABASE_URL: str | None = None
 
+    # --- SEARCH ---
+    # postgres - pg_trgm в БД; memory - триграммный индекс в памяти процесса (без расширений БД)
+    SEARCH_BACKEND: Literal["postgres", "memory"] = "postgres"
+    # Порог похожести pg_trgm для текстового поиска (оператор %), 0..1
+    SEARCH_SIMILARITY_THRESHOLD: float = 0.05
+    # Доля полнотекстового ранга (ts_rank_cd) в оценке для сортировки, остальное - similarity
+    # (match_percentage - чистая similarity, как у поиска в памяти)
+    SEARCH_FTS_WEIGHT: float = 0.5
+    # Сколько кандидатов берет каждый индекс (GiST по близости <->, GIN по @@), не меньше limit
+    SEARCH_CANDIDATES_PER_INDEX: int = 100
+
+    # --- RESULT CACHE ---
+    # Кэш результатов поиска и расчета (LRU + TTL, на процесс)
+    RESULT_CACHE_SIZE: int = 4096
+    RESULT_CACHE_TTL: float = 300.0
+
+    # --- POPULARITY ---
+    # Как часто счетчики выбора/расчета кодов сбрасываются в БД (секунды)
+    POPULARITY_FLUSH_SECONDS: float = 60.0
+    # Сколько самых популярных кодов поднимать в поиске по цифрам и прогревать при старте
+    POPULARITY_HOT_CODES: int = 200
+    # Максимальная надбавка к оценке сортировки за популярность (0 - выключено)
+    SEARCH_POPULARITY_BOOST: float = 10.0
+
+    # --- TARIFF VERSIONS ---
+    # Сколько версий ставок хранить (активная + предыдущие для быстрого отката)
+    TARIFF_VERSIONS_KEEP: int = 3
+    # Проверка перед публикацией: допустимая доля пропавших ставок относительно активной версии
+    TARIFF_MAX_SHRINK: float = 0.2
+    # Сколько кодов сверять выборочно с целевыми ставками
+    TARIFF_SPOT_CHECKS: int = 50
+
     # --- PATHS ---
     BASE_DIR: Path = Path(__file__).resolve().parent.parent.parent
     MEDIA_DIR: Path = BASE_DIR / "media"
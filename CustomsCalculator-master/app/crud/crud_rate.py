@@ -2,11 +2,12 @@
 from typing import Optional
 from sqlmodel import Session, select
 from app.models.rates import TariffRate
+from app.services.tariff_versions import active_version_filter
 
 
 class CRUDRate:
 	def get_by_tnved_id(self, db: Session, tnved_id: int) -> Optional[TariffRate]:
-		statement = select(TariffRate).where(TariffRate.tn_ved_code_id == tnved_id)
+		statement = select(TariffRate).where(TariffRate.tn_ved_code_id == tnved_id, active_version_filter())
 		return db.exec(statement).first()
 
 # Сюда можно добавить методы для создания/удаления, если нужно управлять ставками вручную через админку
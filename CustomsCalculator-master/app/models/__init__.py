@@ -1,9 +1,11 @@
 # app/models/__init__.py
 # Импорт моделей, чтобы они были зарегистрированы в реестре ORM
 from .tnved import TnVedCode
-from .rates import TariffRate, RateType, ExciseType
+from .rates import TariffRate, RateType, ExciseType, TariffVersion, TariffVersionStatus
 from .country import Country
+from .popularity import CodePopularity
+from .sync_log import TariffSyncLog
 
-__all__ = ["TnVedCode", "TariffRate", "RateType", "ExciseType", 'Country']
+__all__ = ["TnVedCode", "TariffRate", "RateType", "ExciseType", "TariffVersion", "TariffVersionStatus", 'Country', 'CodePopularity', 'TariffSyncLog']
 
 
@@ -0,0 +1,19 @@
+# app/models/popularity.py
+from typing import Optional
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, DateTime, func
+
+
+class CodePopularity(SQLModel, table=True):
+	"""Сколько раз код выбирали в поиске и считали в калькуляторе (для ранжирования)"""
+	__tablename__ = "code_popularity"
+	
+	code: str = Field(primary_key=True, max_length=10)
+	selected_count: int = Field(default=0)
+	calculated_count: int = Field(default=0)
+	
+	updated_at: Optional[datetime] = Field(
+		default=None,
+		sa_column=Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+	)
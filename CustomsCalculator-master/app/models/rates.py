@@ -1,5 +1,7 @@
 from typing import Optional
+from datetime import datetime
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Column, DateTime, Index, UniqueConstraint, func, text
 from enum import Enum
 
 
@@ -19,11 +21,58 @@ class ExciseType(str, Enum):
 	COMBINED = "combined"  # % + Сумма (например, Сигареты)
 
 
+# Статус версии тарифа
+class TariffVersionStatus(str, Enum):
+	BUILDING = "building"  # Собирается, читателям не видна
+	ACTIVE = "active"  # Действующая (ровно одна)
+	RETIRED = "retired"  # Была действующей, можно вернуть
+
+
+class TariffVersion(SQLModel, table=True):
+	"""
+	Версия набора ставок. Версия хранит только изменения: строки tariff_rates
+	действуют в диапазоне версий [version_id, retired_version_id), читатели берут
+	строки, действующие в активной версии. Публикация = смена активной версии
+	одним UPDATE (см. app/services/tariff_versions.py).
+	"""
+	__tablename__ = "tariff_versions"
+	__table_args__ = (
+		# Активной может быть только одна версия
+		Index(
+			"uq_tariff_versions_active", "status", unique=True,
+			postgresql_where=text("status = 'ACTIVE'"), sqlite_where=text("status = 'ACTIVE'")
+		),
+	)
+	
+	id: Optional[int] = Field(default=None, primary_key=True)
+	status: TariffVersionStatus = Field(default=TariffVersionStatus.BUILDING)
+	# Откуда собрана (CSV Lex.uz, полный импорт)
+	source: Optional[str] = Field(default=None)
+	rate_count: int = Field(default=0)
+	
+	created_at: Optional[datetime] = Field(
+		default=None,
+		sa_column=Column(DateTime(timezone=True), server_default=func.now())
+	)
+	published_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+
 class TariffRate(SQLModel, table=True):
 	__tablename__ = "tariff_rates"
+	__table_args__ = (
+		# Одна новая ставка на код в каждой версии (в т.ч. унаследованная от префикса)
+		UniqueConstraint("version_id", "tn_ved_code_id", name="uq_tariff_rates_version_code"),
+	)
 	
 	id: Optional[int] = Field(default=None, primary_key=True)
+	# Диапазон версий тарифа, в которых действует строка: [version_id, retired_version_id).
+	# Без внешнего ключа: версия, где строка появилась, может быть уже удалена при очистке
+	version_id: int = Field(index=True)
+	# Версия, в которой ставку заменили или удалили (None - действует до сих пор)
+	retired_version_id: Optional[int] = Field(default=None, index=True)
 	tn_ved_code_id: int = Field(foreign_key="tn_ved_codes.id", index=True)
+	# Код/префикс из таблицы Lex.uz, от которого получена ставка
+	source_code: Optional[str] = Field(default=None, max_length=10)
 	
 	# --- 1. ТАМОЖЕННАЯ ПОШЛИНА (Duty) ---
 	rate_type: RateType = Field(default=RateType.AD_VALOREM)
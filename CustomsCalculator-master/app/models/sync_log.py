@@ -0,0 +1,31 @@
+# app/models/sync_log.py
+from typing import Optional, List
+from datetime import datetime
+from sqlmodel import SQLModel, Field
+from sqlalchemy import Column, DateTime, JSON, func
+
+
+class TariffSyncLog(SQLModel, table=True):
+	"""Журнал синхронизаций ставок: что изменилось за один прогон"""
+	__tablename__ = "tariff_sync_log"
+	
+	id: Optional[int] = Field(default=None, primary_key=True)
+	# Исходный файл (CSV с Lex.uz)
+	source: Optional[str] = Field(default=None)
+	# Опубликованная версия тарифа (None - изменений не было, версия не создавалась)
+	version_id: Optional[int] = Field(default=None)
+	
+	inserted: int = Field(default=0)
+	updated: int = Field(default=0)
+	deleted: int = Field(default=0)
+	unchanged: int = Field(default=0)
+	# Коды с измененным узбекским описанием
+	names_updated: int = Field(default=0)
+	
+	# Коды, у которых появилась, изменилась или пропала ставка (для точечной инвалидации)
+	changed_codes: List[str] = Field(default=[], sa_column=Column(JSON))
+	
+	created_at: Optional[datetime] = Field(
+		default=None,
+		sa_column=Column(DateTime(timezone=True), server_default=func.now())
+	)
@@ -9,13 +9,28 @@ class TnVedCode(SQLModel, table=True):
 	
 	id: Optional[int] = Field(default=None, primary_key=True)
 	code: str = Field(index=True, unique=True, max_length=10)
+	# Триграммный GiST-индекс (поиск) создается миграцией: нужно расширение pg_trgm
 	description: str
+	# Наименование на узбекском (колонка "Товар номи" таблицы пошлин Lex.uz)
+	description_uz: Optional[str] = None
+	# Колонка search_vector (tsvector по обоим описаниям, GIN-индекс) генерируется
+	# в БД миграцией и в модель не входит
 	
 	unit: Optional[str] = None
 	unit2: Optional[str] = None
 	
 	parent_code: Optional[str] = Field(default=None, index=True)
 	
+	# --- ДЕРЕВО (считается при импорте, см. services/tnved_tree.py) ---
+	# Материализованный путь "8703.870323.8703231981"; индекс varchar_pattern_ops
+	# для LIKE 'путь.%' создается миграцией
+	path: Optional[str] = None
+	depth: int = Field(default=0)
+	# Число всех потомков и мин/макс адвалорная ставка пошлины по поддереву
+	descendant_count: int = Field(default=0)
+	min_duty_rate: Optional[float] = None
+	max_duty_rate: Optional[float] = None
+	
 	# --- НОВЫЕ ПОЛЯ ---
 	# Флаг: применяется ли утильсбор к этому коду
 	is_util_applicable: bool = Field(default=False, index=True)
@@ -1,7 +1,14 @@
-from .calculation import CalculationRequest, CalculationResponse, DutyComponent
+from .calculation import (CalculationRequest, CalculationResponse, DutyComponent, DeclarationRequest,
+                          DeclarationLineResult, DeclarationResponse, RegimeCalculation, OriginCost,
+                          OriginComparisonResponse, InverseRequest, InverseResponse, SweepAxis, SweepRequest,
+                          SweepResponse)
 from .currency import CurrencySchema, CurrencyRateResponse
-from .tnved import TnVedRichResponse, TnVedBase
+from .tnved import (TnVedRichResponse, TnVedBase, TnVedCompactResponse, TnVedTreeNode, TnVedTreeResponse,
+                    ClassifyRequest, ClassifyCandidate, ClassifyLineResult)
 from .rates import TariffRateRead, TariffRateBase
 
-__all__ = ["CalculationRequest", "CalculationResponse", "DutyComponent", 'CurrencySchema', 'CurrencyRateResponse',
-           'TnVedRichResponse', 'TnVedBase', 'TariffRateBase', 'TariffRateRead']
+__all__ = ["CalculationRequest", "CalculationResponse", "DutyComponent", "DeclarationRequest",
+           "DeclarationLineResult", "DeclarationResponse", "RegimeCalculation", "OriginCost",
+           "OriginComparisonResponse", "InverseRequest", "InverseResponse", "SweepAxis", "SweepRequest", "SweepResponse", 'CurrencySchema', 'CurrencyRateResponse',
+           'TnVedRichResponse', 'TnVedBase', 'TnVedCompactResponse', 'TnVedTreeNode', 'TnVedTreeResponse',
+           'ClassifyRequest', 'ClassifyCandidate', 'ClassifyLineResult', 'TariffRateBase', 'TariffRateRead']
@@ -1,5 +1,8 @@
-from typing import Optional, List
-from pydantic import BaseModel, Field
+from datetime import date
+from typing import Optional, List, Literal
+from pydantic import BaseModel, Field, model_validator
+
+from app.models.country import TradeRegimeType
 
 
 # --- Входные данные ---
@@ -28,10 +31,155 @@ class DutyComponent(BaseModel):
 
 class CalculationResponse(BaseModel):
 	tn_code: str
+	# Код ТН ВЭД, чья ставка применена (запрошенный или ближайший родитель со ставкой)
+	resolved_code: Optional[str] = None
 	currency_rate: float
+	# Дата курса ЦБ (None - курса нет в БД, использован курс по умолчанию)
+	currency_rate_date: Optional[date] = None
 	# Добавляем БРВ, чтобы было прозрачно для пользователя
 	brv_rate: Optional[float] = None
 	total_payments_usd: float
 	total_payments_uzs: float
 	details: List[DutyComponent]
-	error: Optional[str] = None
\ No newline at end of file
+	error: Optional[str] = None
+
+# --- Декларация из многих товарных позиций ---
+class DeclarationRequest(BaseModel):
+	lines: List[CalculationRequest] = Field(..., min_length=1, max_length=1000)
+
+
+class DeclarationLineResult(BaseModel):
+	line_no: int
+	tn_code: str
+	resolved_code: Optional[str] = None
+	customs_value: float
+	total_payments_usd: float
+	total_payments_uzs: float
+	details: List[DutyComponent]
+	error: Optional[str] = None
+
+
+class DeclarationResponse(BaseModel):
+	currency_rate: float
+	currency_rate_date: Optional[date] = None
+	brv_rate: Optional[float] = None
+	total_customs_value_usd: float
+	total_payments_usd: float
+	total_payments_uzs: float
+	# Суммы по видам платежей + таможенный сбор на всю декларацию
+	totals: List[DutyComponent]
+	lines: List[DeclarationLineResult]
+
+
+# --- Сравнение стран происхождения ---
+class RegimeCalculation(BaseModel):
+	trade_regime: TradeRegimeType
+	duty_usd: float
+	total_payments_usd: float
+	total_payments_uzs: float
+	details: List[DutyComponent]
+
+
+class OriginCost(BaseModel):
+	iso_code: str
+	name_ru: str
+	trade_regime: TradeRegimeType
+	duty_usd: float
+	total_payments_usd: float
+	total_payments_uzs: float
+	# Стоимость товара + все платежи
+	landed_cost_usd: float
+
+
+class OriginComparisonResponse(BaseModel):
+	tn_code: str
+	currency_rate: float
+	currency_rate_date: Optional[date] = None
+	brv_rate: Optional[float] = None
+	customs_value: float
+	regimes: List[RegimeCalculation]
+	# Отсортировано по возрастанию платежей
+	origins: List[OriginCost]
+	error: Optional[str] = None
+
+
+# --- Обратный расчет: стоимость под бюджет платежей ---
+class InverseRequest(BaseModel):
+	tn_code: str
+	# Сколько импортер готов заплатить (все платежи, USD)
+	budget_usd: float = Field(..., gt=0)
+	weight_kg: float
+	quantity_pcs: Optional[float] = 0.0
+	volume_cm3: Optional[float] = 0.0
+	liter_qty: Optional[float] = 0.0
+	origin_country_code: Optional[str] = Field(default=None, max_length=2)
+	manufacturing_year: Optional[int] = None
+	power_hp: Optional[float] = 0.0
+
+
+class InverseResponse(BaseModel):
+	tn_code: str
+	currency_rate: float
+	currency_rate_date: Optional[date] = None
+	brv_rate: Optional[float] = None
+	budget_usd: float
+	# None - бюджет меньше минимальных платежей или платежи не растут со стоимостью
+	max_customs_value: Optional[float] = None
+	# budget - упирается в бюджет; customs_fee - выше начинается следующая ступень сбора ПКМ 55;
+	# infeasible - бюджета не хватает даже при нулевой стоимости; unbounded - ограничения нет
+	limited_by: Optional[Literal["budget", "customs_fee", "infeasible", "unbounded"]] = None
+	# Платежи при нулевой стоимости (утильсбор, специфические ставки, минимальный сбор)
+	min_payments_usd: Optional[float] = None
+	# Расчет при max_customs_value
+	total_payments_usd: float
+	total_payments_uzs: float
+	details: List[DutyComponent]
+	error: Optional[str] = None
+
+
+# --- Чувствительность платежей к параметрам ---
+SweepField = Literal["customs_value", "weight_kg", "quantity_pcs", "volume_cm3", "liter_qty",
+                     "manufacturing_year", "power_hp"]
+
+# Ограничение размера сетки (x * y точек) на один запрос
+MAX_SWEEP_POINTS = 40_000
+
+
+class SweepAxis(BaseModel):
+	field: SweepField
+	start: float
+	stop: float
+	points: int = Field(default=50, ge=2, le=1000)
+
+
+class SweepRequest(BaseModel):
+	# Значения параметров, которые не меняются по осям
+	base: CalculationRequest
+	x: SweepAxis
+	y: Optional[SweepAxis] = None
+	
+	@model_validator(mode="after")
+	def check_grid(self):
+		if self.y and self.y.field == self.x.field:
+			raise ValueError("Оси x и y должны менять разные параметры")
+		if self.x.points * (self.y.points if self.y else 1) > MAX_SWEEP_POINTS:
+			raise ValueError(f"Сетка больше {MAX_SWEEP_POINTS} точек")
+		return self
+
+
+class SweepResponse(BaseModel):
+	tn_code: str
+	currency_rate: float
+	currency_rate_date: Optional[date] = None
+	x_field: str
+	x_values: List[float]
+	y_field: Optional[str] = None
+	y_values: Optional[List[float]] = None
+	# Матрицы [y][x] (для одной оси - одна строка)
+	duty_usd: List[List[float]]
+	excise_usd: List[List[float]]
+	vat_usd: List[List[float]]
+	customs_fee_usd: List[List[float]]
+	util_usd: List[List[float]]
+	total_usd: List[List[float]]
+	total_uzs: List[List[float]]
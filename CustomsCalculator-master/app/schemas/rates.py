@@ -17,6 +17,9 @@ class TariffRateBase(BaseModel):
 	excise_currency: str = "UZS"
 	
 	vat_rate: float
+	
+	# Префикс из исходной таблицы, от которого унаследована ставка
+	source_code: Optional[str] = None
 
 
 class TariffRateRead(TariffRateBase):
@@ -32,4 +35,9 @@ class SyncStatus(BaseModel):
 	status: str
 	message: str
 	processed_files: Optional[str] = None
-	total_rates: Optional[int] = None
\ No newline at end of file
+	total_rates: Optional[int] = None
+	# Инкрементальная синхронизация: сколько ставок реально изменилось
+	inserted: Optional[int] = None
+	updated: Optional[int] = None
+	deleted: Optional[int] = None
+	unchanged: Optional[int] = None
\ No newline at end of file
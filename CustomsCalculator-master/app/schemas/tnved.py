@@ -1,6 +1,6 @@
 # app/schemas/tnved.py
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from app.schemas.rates import TariffRateRead
 
 
@@ -8,6 +8,7 @@ from app.schemas.rates import TariffRateRead
 class TnVedBase(BaseModel):
 	code: str
 	description: str
+	description_uz: Optional[str] = None
 	unit: Optional[str] = None
 	unit2: Optional[str] = None
 	
@@ -24,4 +25,54 @@ class TnVedRichResponse(TnVedBase):
 	rates: List[TariffRateRead] = []
 	
 	class Config:
-		from_attributes = True
\ No newline at end of file
+		from_attributes = True
+
+
+# Компактная выдача поиска (view=compact): только то, что показывает список подсказок
+class TnVedCompactResponse(BaseModel):
+	code: str
+	description: str
+	unit: Optional[str] = None
+	match_percentage: float
+	# Основная ставка пошлины строкой ("15%", "20%, но не менее 1 $/cm3")
+	duty_rate: Optional[str] = None
+
+
+# --- Дерево ТН ВЭД ---
+class TnVedTreeNode(BaseModel):
+	code: str
+	description: str
+	depth: int
+	descendant_count: int
+	has_children: bool
+	# Мин/макс адвалорная ставка пошлины по всему поддереву
+	min_duty_rate: Optional[float] = None
+	max_duty_rate: Optional[float] = None
+
+
+class TnVedTreeResponse(BaseModel):
+	parent_code: Optional[str] = None
+	items: List[TnVedTreeNode]
+	# Передать как after, чтобы получить следующую страницу (None - страниц больше нет)
+	next_after: Optional[str] = None
+
+
+# --- Подбор кодов для строк инвойса ---
+class ClassifyRequest(BaseModel):
+	# Свободные описания товаров (или цифры кода)
+	lines: List[str] = Field(..., min_length=1, max_length=5000)
+	limit: int = Field(default=5, ge=1, le=50)
+
+
+class ClassifyCandidate(BaseModel):
+	code: str
+	description: str
+	unit: Optional[str] = None
+	match_percentage: float
+
+
+# Одна строка NDJSON-ответа
+class ClassifyLineResult(BaseModel):
+	line_no: int
+	query: str
+	candidates: List[ClassifyCandidate]
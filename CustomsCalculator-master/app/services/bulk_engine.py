@@ -0,0 +1,267 @@
+# app/services/bulk_engine.py
+"""
+Векторный (NumPy) расчет платежей для больших массивов позиций.
+
+Повторяет логику DutyCalculator (_calc_complex_rate, _calc_customs_fee,
+_calc_utilization_fee) поколоночно: ставки разрешаются один раз на уникальный
+код, дальше все считается операциями над массивами.
+"""
+from datetime import datetime
+from typing import Sequence
+
+import numpy as np
+
+from app.models.country import TradeRegimeType
+from app.services.rate_plan import (RatePlan, MODE_NONE, MODE_AD_VALOREM, MODE_SPECIFIC, MODE_COMBINED,
+                                    MODE_MIXED)
+from app.services.snapshot import TariffSnapshot
+from app.services.units import VOLUME_M3
+
+# Колонки с количеством, из которых берется база специфической ставки
+FIELD_NONE, FIELD_WEIGHT, FIELD_QTY, FIELD_LITERS, FIELD_VOLUME, FIELD_VOLUME_M3 = range(6)
+_FIELDS = {
+	None: FIELD_NONE,
+	"weight": FIELD_WEIGHT,
+	"qty": FIELD_QTY,
+	"liters": FIELD_LITERS,
+	"volume": FIELD_VOLUME,
+	VOLUME_M3: FIELD_VOLUME_M3,
+}
+
+# Шкала ПКМ 55: порог -> коэффициент БРВ
+FEE_THRESHOLDS = np.array([10_000, 20_000, 40_000, 60_000, 100_000, 200_000, 500_000, 1_000_000], dtype=float)
+FEE_MULTIPLIERS = np.array([1.0, 1.5, 2.5, 4.0, 7.0, 10.0, 15.0, 20.0, 25.0])
+
+# Утильсбор: границы и ставки БРВ (новый, старше 3 лет)
+UTIL_NONE, UTIL_TIRE, UTIL_M1, UTIL_N, UTIL_TRACTOR, UTIL_SPECIAL, UTIL_OTHER = range(7)
+_UTIL_KINDS = {"tire": UTIL_TIRE, "M1": UTIL_M1, "N": UTIL_N, "tractor": UTIL_TRACTOR, "special": UTIL_SPECIAL}
+
+M1_VOLUME_THRESHOLDS = np.array([1000, 2000, 3000, 3500], dtype=float)  # vol < X
+M1_BRV = np.array([[30, 90], [120, 210], [180, 330], [180, 390], [300, 480]], dtype=float)
+N_TON_THRESHOLDS = np.array([2.5, 3.5, 5, 8, 12, 20, 50], dtype=float)  # t <= X
+N_BRV = np.array([[100, 150], [210, 300], [210, 300], [210, 300], [300, 810], [330, 1200], [690, 1410], [0, 0]],
+                 dtype=float)
+TRACTOR_HP_THRESHOLDS = np.array([25, 51, 102, 177], dtype=float)  # hp <= X
+TRACTOR_BRV = np.array([[0, 120], [0, 240], [0, 360], [0, 480], [0, 600]], dtype=float)
+
+_REGIME_DUTY_FACTOR = {
+	TradeRegimeType.FREE_TRADE: 0.0,
+	TradeRegimeType.MOST_FAVORED: 1.0,
+	TradeRegimeType.GENERAL: 2.0,
+}
+
+
+class _RateColumns:
+	"""Параметры ставок, разложенные по массивам (по одному элементу на уникальный код)"""
+
+	def __init__(self, size: int):
+		self.found = np.zeros(size, dtype=bool)
+		self.vat_rate = np.zeros(size)
+		self.util_kind = np.full(size, UTIL_NONE, dtype=np.int8)
+		self.util_electric = np.zeros(size, dtype=bool)
+		self.sedelny = np.zeros(size, dtype=bool)
+		# [0] - пошлина, [1] - акциз
+		self.mode = np.full((2, size), MODE_NONE, dtype=np.int8)
+		self.ad_valorem = np.zeros((2, size))
+		self.specific = np.zeros((2, size))
+		self.uzs = np.zeros((2, size), dtype=bool)
+		self.field = np.full((2, size), FIELD_NONE, dtype=np.int8)
+		self.mult = np.ones((2, size))
+		self.div = np.ones((2, size))
+
+	def set_part(self, part: int, i: int, plan: RatePlan):
+		self.mode[part, i] = plan.mode
+		self.ad_valorem[part, i] = plan.ad_valorem_pct
+		self.specific[part, i] = plan.specific_rate
+		self.uzs[part, i] = plan.is_uzs
+		self.field[part, i] = _FIELDS[plan.field]
+		self.mult[part, i] = plan.mult
+		self.div[part, i] = plan.div
+
+
+class BulkDutyEngine:
+	"""
+	Расчет пошлины, акциза, НДС, таможенного и утилизационного сбора
+	по массивам позиций. Результат совпадает со скалярным DutyCalculator.
+	"""
+
+	def __init__(self, snapshot: TariffSnapshot, brv: float = 412000.0):
+		self.snapshot = snapshot
+		self.usd_rate = snapshot.usd_rate
+		self.brv = brv
+
+	def _resolve_codes(self, unique_codes: np.ndarray) -> _RateColumns:
+		cols = _RateColumns(len(unique_codes))
+		for i, code in enumerate(unique_codes):
+			found = self.snapshot.find_rate(str(code))
+			if not found:
+				continue
+			rate, code_obj = found
+			cols.found[i] = True
+			cols.vat_rate[i] = rate.vat_rate
+			cols.set_part(0, i, rate.duty_plan)
+			cols.set_part(1, i, rate.excise_plan)
+
+			metadata = code_obj.calc_metadata
+			if code_obj.is_util_applicable and metadata:
+				cols.util_kind[i] = _UTIL_KINDS.get(metadata.get("type"), UTIL_OTHER)
+				cols.util_electric[i] = metadata.get("engine_type") == "electric"
+			# Седельные тягачи определяются по введенному коду, а не по найденному
+			cols.sedelny[i] = str(code).startswith('87012')
+		return cols
+
+	def _complex_rate(self, cols: _RateColumns, part: int, idx: np.ndarray, base_value: np.ndarray,
+	                  quantities: np.ndarray) -> np.ndarray:
+		mode = cols.mode[part][idx]
+		ad_valorem_amt = base_value * (cols.ad_valorem[part][idx] / 100)
+
+		field = cols.field[part][idx]
+		raw_qty = np.choose(field, quantities)
+		qty = raw_qty * cols.mult[part][idx] / cols.div[part][idx]
+		# м3: объем вводится в см3, но маленькие значения считаются уже кубометрами
+		volume = quantities[FIELD_VOLUME]
+		qty = np.where(field == FIELD_VOLUME_M3, np.where(volume > 100, volume / 1_000_000, volume), qty)
+
+		rate = cols.specific[part][idx]
+		rate_in_usd = np.where(cols.uzs[part][idx], rate / self.usd_rate, rate)
+		specific_amt = qty * rate_in_usd
+
+		return np.select(
+			[mode == MODE_AD_VALOREM, mode == MODE_SPECIFIC, mode == MODE_COMBINED, mode == MODE_MIXED],
+			[ad_valorem_amt, specific_amt, ad_valorem_amt + specific_amt, np.maximum(ad_valorem_amt, specific_amt)],
+			default=0.0
+		)
+
+	def customs_fee_uzs(self, customs_values: np.ndarray) -> np.ndarray:
+		"""Шкала ПКМ 55 (граница включается в следующий диапазон)"""
+		multipliers = FEE_MULTIPLIERS[np.searchsorted(FEE_THRESHOLDS, customs_values, side='right')]
+		return self.brv * multipliers
+
+	def utilization_fee_uzs(self, kind: np.ndarray, electric: np.ndarray, sedelny: np.ndarray,
+	                        weights: np.ndarray, volumes: np.ndarray, years: np.ndarray,
+	                        power_hp: np.ndarray) -> np.ndarray:
+		current_year = datetime.now().year
+		years = np.where(years > 0, years, current_year)
+		old = (current_year - years > 3).astype(np.intp)
+
+		m1 = M1_BRV[np.searchsorted(M1_VOLUME_THRESHOLDS, volumes, side='right'), old]
+		m1 = np.where(electric, np.where(old, 90.0, 30.0), m1)
+
+		n = N_BRV[np.searchsorted(N_TON_THRESHOLDS, weights / 1000.0, side='left'), old]
+		n = np.where(electric, np.where(old, 150.0, 120.0), n)
+
+		tractor = TRACTOR_BRV[np.searchsorted(TRACTOR_HP_THRESHOLDS, power_hp, side='left'), old]
+		tractor = np.where(sedelny, np.where(old, 1360.0, 670.0), tractor)
+
+		special = np.where(old, np.select([power_hp > 250, power_hp > 170], [480.0, 360.0], default=240.0), 0.0)
+
+		rate_brv = np.select(
+			[kind == UTIL_M1, kind == UTIL_N, kind == UTIL_TRACTOR, kind == UTIL_SPECIAL],
+			[m1, n, tractor, special],
+			default=0.0
+		)
+		fee_uzs = rate_brv * self.brv
+		tire_uzs = np.where(weights > 0, weights * (self.brv * 0.003), 0.0)
+		return np.where(kind == UTIL_TIRE, tire_uzs, fee_uzs)
+
+	def calculate(self, codes: Sequence[str] | str, customs_values, weights,
+	              quantities=None, volumes=None, liters=None, years=None, power_hp=None,
+	              origins: Sequence[str | None] | str | None = None) -> dict[str, np.ndarray]:
+		"""
+		Принимает колонки одинаковой длины, возвращает словарь массивов
+		(суммы в USD без округления, итог также в UZS).
+		Вместо колонки можно передать одно значение - оно применяется ко всем строкам.
+		Для ненайденных кодов found=False и все суммы 0.
+		"""
+		n = max(np.size(v) for v in (codes, customs_values, weights, quantities, volumes, liters, years, power_hp)
+		        if v is not None and not isinstance(v, str))
+
+		def column(values) -> np.ndarray:
+			if values is None:
+				return np.zeros(n)
+			return np.broadcast_to(np.nan_to_num(np.asarray(values, dtype=float)), (n,))
+
+		values = column(customs_values)
+		weights = column(weights)
+		volumes = column(volumes)
+		years = column(years)
+		power_hp = column(power_hp)
+		# Порядок совпадает с FIELD_* (FIELD_VOLUME_M3 пересчитывается отдельно)
+		quantities = (np.zeros(n), weights, column(quantities), column(liters), volumes, volumes)
+
+		# 1. Ставки - один раз на уникальный код
+		if isinstance(codes, str):
+			unique_codes, idx = np.array([codes]), np.zeros(n, dtype=np.intp)
+		else:
+			unique_codes, idx = np.unique(np.asarray(codes, dtype=str), return_inverse=True)
+		cols = self._resolve_codes(unique_codes)
+		found = cols.found[idx]
+
+		# 2. Режим торговли - один раз на уникальную страну
+		if origins is None or isinstance(origins, str):
+			unique_origins, origin_idx = np.array([(origins or "").upper()]), np.zeros(n, dtype=np.intp)
+		else:
+			origins = np.asarray([(o or "").upper() for o in origins], dtype=str)
+			unique_origins, origin_idx = np.unique(origins, return_inverse=True)
+		factors = np.array([_REGIME_DUTY_FACTOR[self.snapshot.trade_regime(o or None)] for o in unique_origins])
+
+		# 3. Платежи
+		duty = self._complex_rate(cols, 0, idx, values, quantities) * factors[origin_idx]
+		excise = self._complex_rate(cols, 1, idx, values, quantities)
+		vat = (values + duty + excise) * (cols.vat_rate[idx] / 100)
+		fee = self.customs_fee_uzs(values) / self.usd_rate
+		util = self.utilization_fee_uzs(
+			cols.util_kind[idx], cols.util_electric[idx], cols.sedelny[idx],
+			weights, volumes, years, power_hp
+		) / self.usd_rate
+
+		total = duty + excise + vat + fee + util
+		result = {
+			"found": found,
+			"duty_usd": duty,
+			"excise_usd": excise,
+			"vat_usd": vat,
+			"customs_fee_usd": fee,
+			"util_usd": util,
+			"total_usd": total,
+		}
+		for key in result:
+			if key != "found":
+				result[key] = np.where(found, result[key], 0.0)
+		result["total_uzs"] = result["total_usd"] * self.usd_rate
+		return result
+
+	def sweep(self, base: dict, x_field: str, x_values: np.ndarray,
+	          y_field: str | None = None, y_values: np.ndarray | None = None) -> dict[str, np.ndarray]:
+		"""
+		Платежи на сетке значений одного или двух параметров CalculationRequest.
+		Ставка и режим торговли разрешаются один раз, сетка считается целиком массивами.
+		Результат - массивы формы (len(y_values), len(x_values)), для одной оси - (1, len(x_values)).
+		"""
+		x_values = np.asarray(x_values, dtype=float)
+		y_values = np.asarray(y_values if y_field else [0.0], dtype=float)
+		grid_y, grid_x = np.meshgrid(y_values, x_values, indexing="ij")
+
+		inputs = {name: base.get(name) or 0.0 for name in SWEEP_FIELDS}
+		inputs[x_field] = grid_x.ravel()
+		if y_field:
+			inputs[y_field] = grid_y.ravel()
+
+		result = self.calculate(
+			codes=base["tn_code"],
+			origins=base.get("origin_country_code"),
+			**{SWEEP_FIELDS[name]: value for name, value in inputs.items()}
+		)
+		return {key: value.reshape(grid_x.shape) for key, value in result.items()}
+
+
+# Поле CalculationRequest -> аргумент BulkDutyEngine.calculate
+SWEEP_FIELDS = {
+	"customs_value": "customs_values",
+	"weight_kg": "weights",
+	"quantity_pcs": "quantities",
+	"volume_cm3": "volumes",
+	"liter_qty": "liters",
+	"manufacturing_year": "years",
+	"power_hp": "power_hp",
+}
@@ -1,48 +1,78 @@
+import copy
+import logging
+import math
 from datetime import datetime
-from sqlmodel import Session, select
+from sqlmodel import Session, select, func
 from app.models import TariffRate, TnVedCode
-from app.models.currency import CurrencyRate, Currency
+from app.services.currency_cache import currency_cache
 from app.models.country import Country, TradeRegimeType
+from app.services.rate_plan import RatePlan, compile_rate_plan
+from app.services.snapshot import TariffSnapshot, RateEntry, DEFAULT_USD_RATE
+from app.services.bulk_engine import FEE_THRESHOLDS
+from app.services.metrics import stage
+from app.services.result_cache import calculation_cache
+from app.services.tariff_versions import active_version_filter
 
+logger = logging.getLogger(__name__)
 
 class DutyCalculator:
-	def __init__(self, session: Session):
+	def __init__(self, session: Session | None = None, snapshot: TariffSnapshot | None = None):
+		"""
+		Если передан snapshot, все справочные данные берутся из памяти
+		и расчет не делает запросов в БД.
+		"""
 		self.session = session
-		self.usd_rate = self._get_usd_rate()
+		self.snapshot = snapshot
+		# Дата курса, по которому идет расчет (None - курс по умолчанию)
+		self.usd_rate_date = None
+		with stage("currency"):
+			self.usd_rate = self._get_usd_rate()
 		self.brv = 412000.0
 	
 	def _get_usd_rate(self) -> float:
-		statement = (
-			select(CurrencyRate.rate)
-			.join(Currency)
-			.where(Currency.char_code == "USD")
-			.order_by(CurrencyRate.date.desc())
-		)
-		rate = self.session.exec(statement).first()
-		return rate if rate else 12850.0
+		if self.snapshot is not None:
+			self.usd_rate_date = self.snapshot.usd_rate_date
+			return self.snapshot.usd_rate
+		
+		rate, self.usd_rate_date = currency_cache.latest("USD", self.session) or (None, None)
+		if not rate:
+			# Курса USD нет в БД: считаем по курсу по умолчанию, но не молча
+			currency_cache.record_fallback()
+			logger.warning(f"⚠️ Курс USD не найден, используется курс по умолчанию {DEFAULT_USD_RATE}")
+			return DEFAULT_USD_RATE
+		return rate
 	
 	def get_rate_and_code_recursive(self, tn_code_str: str) -> tuple[TariffRate, TnVedCode] | None:
 		"""
 		Ищет ставку и сам объект кода ТН ВЭД (чтобы достать метаданные).
 		"""
-		code_to_search = tn_code_str.strip()
-		while len(code_to_search) >= 4:
-			tn_obj = self.session.exec(
-				select(TnVedCode).where(TnVedCode.code == code_to_search)
-			).first()
-			if tn_obj:
-				rate = self.session.exec(
-					select(TariffRate).where(TariffRate.tn_ved_code_id == tn_obj.id)
-				).first()
-				if rate:
-					return rate, tn_obj
-			code_to_search = code_to_search[:-2]
-		return None
+		if self.snapshot is not None:
+			return self.snapshot.find_rate(tn_code_str)
+		
+		# Импорт материализует действующую ставку для каждого кода (с учетом наследования),
+		# поэтому достаточно одного запроса по уникальному индексу кода.
+		# Префиксы нужны только для кодов, которых нет в справочнике.
+		code = tn_code_str.strip()
+		candidates = [code[:n] for n in range(len(code), 3, -2)]
+		if not candidates:
+			return None
+		
+		row = self.session.exec(
+			select(TariffRate, TnVedCode)
+			.join(TnVedCode, TariffRate.tn_ved_code_id == TnVedCode.id)
+			.where(TnVedCode.code.in_(candidates), active_version_filter())
+			.order_by(func.length(TnVedCode.code).desc())
+			.limit(1)
+		).first()
+		return (row[0], row[1]) if row else None
 	
 	def _get_trade_regime(self, country_code: str | None) -> TradeRegimeType:
 		if not country_code:
 			return TradeRegimeType.GENERAL
 		
+		if self.snapshot is not None:
+			return self.snapshot.trade_regime(country_code)
+		
 		country = self.session.exec(
 			select(Country).where(Country.iso_code == country_code.upper())
 		).first()
@@ -52,87 +82,24 @@ class DutyCalculator:
 	def _calc_complex_rate(self, type_enum: str, ad_valorem_pct: float,
 	                       specific_rate: float | None, specific_currency: str,
 	                       specific_unit: str | None, base_value_usd: float, inputs: dict) -> tuple[float, str]:
-		# ... (Код функции без изменений, как в твоем исходнике) ...
-		# Для экономии места не дублирую логику специфических ставок,
-		# предполагается, что она осталась такой же, как в твоем вопросе.
-		
-		# 1. Адвалорная часть
-		ad_valorem_amt = base_value_usd * (ad_valorem_pct / 100)
-		
-		# 2. Специфическая часть
-		specific_amt = 0.0
-		u = specific_unit
-		
-		if specific_rate:
-			qty = 0.0
-			# --- ГРУППА 1: ВЕС ---
-			if u in ['kg', 'кг', 'kg_90_dry', 'kg_h2o2', 'kg_k2o', 'kg_n', 'kg_naoh', 'kg_p2o5', 'kg_u', 'kg_koh',
-			         'g_di']:
-				qty = inputs['weight']
-				if u in ['g', 'г', 'g_di']:
-					qty = inputs['weight'] * 1000
-				elif u in ['t', 'т']:
-					qty = inputs['weight'] / 1000
-			
-			# --- ГРУППА 2: ШТУКИ ---
-			elif u in ['pcs', 'шт', 'pair', 'пар']:
-				qty = inputs['qty']
-			elif u in ['100_pcs', '100 шт']:
-				qty = inputs['qty'] / 100
-			elif u in ['1000_pcs', '1000 шт']:
-				qty = inputs['qty'] / 1000
-			
-			# --- ГРУППА 3: ЛИТРЫ ---
-			elif u in ['l', 'л', 'литр', 'l_alc_100', 'л100% сп.']:
-				qty = inputs['liters']
-			elif u in ['ml']:
-				qty = inputs['liters'] * 1000
-			elif u in ['1000_l', '1000 л.']:
-				qty = inputs['liters'] / 1000
-			
-			# --- ГРУППА 4: ОБЪЕМ (Двигатель/Кубы) ---
-			elif u in ['m3', 'м3', 'cm3', 'см3']:
-				# В inputs['volume'] лежит значение в см3 (обычно объем двигателя)
-				if u in ['cm3', 'см3']:
-					qty = inputs['volume']
-				elif u in ['m3', 'м3']:
-					# Если ставка за кубометр (лес, газ), а ввод в см3, конвертируем
-					# Но чаще volume используется для авто. Оставим простую логику:
-					qty = inputs['volume'] / 1_000_000 if inputs['volume'] > 100 else inputs['volume']
-			
-			# --- ГРУППА 5: ПРОЧЕЕ ---
-			elif u in ['m2', 'м2', 'm', 'м', 'carat', 'кар', 'ci', 'кюри']:
-				qty = inputs['qty']  # Фронт должен мапить это
-			elif u in ['1000_m2', '1000 м2', '1000_kwh', '1000 кВтч']:
-				qty = inputs['qty'] / 1000
-			
-			# Расчет денег
-			rate_in_usd = specific_rate
-			if specific_currency == "UZS":
-				rate_in_usd = specific_rate / self.usd_rate
-			specific_amt = qty * rate_in_usd
-		
-		# 3. Итог
-		final_amt = 0.0
-		method_desc = ""
-		
-		if type_enum == "ad_valorem":
-			final_amt = ad_valorem_amt
-			method_desc = f"{ad_valorem_pct}%"
-		elif type_enum == "specific":
-			final_amt = specific_amt
-			curr = "сум" if specific_currency == "UZS" else "$"
-			method_desc = f"{specific_rate} {curr}/{u}"
-		elif type_enum == "combined":
-			final_amt = ad_valorem_amt + specific_amt
-			curr = "сум" if specific_currency == "UZS" else "$"
-			method_desc = f"{ad_valorem_pct}% + {specific_rate} {curr}/{u}"
-		elif type_enum in ["mixed", "mixed_min"]:
-			final_amt = max(ad_valorem_amt, specific_amt)
-			curr = "сум" if specific_currency == "UZS" else "$"
-			method_desc = f"{ad_valorem_pct}%, но не менее {specific_rate} {curr}/{u}"
-		
-		return final_amt, method_desc
+		"""
+		Адвалорная/специфическая/комбинированная/смешанная ставка.
+		Разбор единиц и валюты вынесен в RatePlan (план кэшируется по параметрам ставки).
+		"""
+		plan = compile_rate_plan(type_enum, ad_valorem_pct, specific_rate, specific_currency, specific_unit)
+		return plan.evaluate(base_value_usd, inputs, self.usd_rate)
+	
+	@staticmethod
+	def _rate_plans(rate) -> tuple[RatePlan, RatePlan]:
+		"""Планы пошлины и акциза: у ставок из снимка они уже скомпилированы"""
+		if isinstance(rate, RateEntry):
+			return rate.duty_plan, rate.excise_plan
+		return (
+			compile_rate_plan(rate.rate_type, rate.ad_valorem_rate, rate.specific_rate,
+			                  rate.specific_currency, rate.specific_unit),
+			compile_rate_plan(rate.excise_type, rate.excise_ad_valorem_rate, rate.excise_specific_rate,
+			                  rate.excise_currency, rate.excise_unit),
+		)
 	
 	def _calc_customs_fee(self, customs_value_usd: float) -> tuple[float, float, str]:
 		# Логика ПКМ 55 (без изменений)
@@ -314,10 +281,29 @@ class DutyCalculator:
 		"""
 		Основной метод расчета.
 		Добавлены manufacturing_year и power_hp.
-		"""
 		
+		При расчете по снимку результат кэшируется по входным данным и версии снимка
+		(смена тарифов или курса = новая версия). Ключ нормализован: код без пробелов,
+		страна в верхнем регистре, числа - float (10 и 10.0 - один расчет).
+		Вызывающему отдается копия: правки результата не попадают в кэш.
+		"""
+		tn_code = tn_code.strip()
+		origin_country_code = (origin_country_code or "").strip().upper() or None
+		args = (tn_code, customs_value, weight_kg, quantity_pcs, volume_cm3, liter_qty,
+		        manufacturing_year, power_hp, origin_country_code)
+		if self.snapshot is None:
+			return self._calculate(*args)
+		numbers = tuple(None if v is None else float(v) for v in args[1:-1])
+		key = (self.snapshot.version, self.brv, tn_code, *numbers, origin_country_code)
+		return copy.deepcopy(calculation_cache.get_or_compute(key, lambda: self._calculate(*args)))
+	
+	def _calculate(self, tn_code: str, customs_value: float, weight_kg: float,
+	               quantity_pcs: float = 0, volume_cm3: float = 0, liter_qty: float = 0,
+	               manufacturing_year: int = None, power_hp: float = 0,
+	               origin_country_code: str | None = None):
 		# 1. Поиск ставки и кода (для метаданных)
-		result = self.get_rate_and_code_recursive(tn_code)
+		with stage("lookup"):
+			result = self.get_rate_and_code_recursive(tn_code)
 		
 		if not result:
 			return {
@@ -329,6 +315,40 @@ class DutyCalculator:
 		
 		rate, tn_code_obj = result
 		
+		# 2. Определение режима торговли
+		with stage("regime"):
+			regime = self._get_trade_regime(origin_country_code)
+		
+		details, total_usd = self._calculate_line(
+			rate, tn_code_obj, regime,
+			tn_code=tn_code, customs_value=customs_value, weight_kg=weight_kg,
+			quantity_pcs=quantity_pcs, volume_cm3=volume_cm3, liter_qty=liter_qty,
+			manufacturing_year=manufacturing_year, power_hp=power_hp,
+			origin_country_code=origin_country_code
+		)
+		
+		return {
+			"tn_code": tn_code,
+			"resolved_code": tn_code_obj.code,
+			"currency_rate": round(self.usd_rate, 2),
+			"currency_rate_date": self.usd_rate_date,
+			"brv_rate": self.brv,  # Полезно вернуть БРВ на фронт
+			"total_payments_usd": round(total_usd, 2),
+			"total_payments_uzs": round(total_usd * self.usd_rate, 2),
+			"details": details,
+			"error": None
+		}
+	
+	def _calculate_line(self, rate, tn_code_obj, regime: TradeRegimeType, tn_code: str,
+	                    customs_value: float, weight_kg: float,
+	                    quantity_pcs: float = 0, volume_cm3: float = 0, liter_qty: float = 0,
+	                    manufacturing_year: int = None, power_hp: float = 0,
+	                    origin_country_code: str | None = None,
+	                    with_customs_fee: bool = True) -> tuple[list[dict], float]:
+		"""
+		Расчет одной товарной позиции по уже найденной ставке и режиму.
+		Возвращает (детали, итого USD).
+		"""
 		inputs = {
 			"weight": weight_kg,
 			"qty": quantity_pcs if quantity_pcs else 0,
@@ -338,91 +358,386 @@ class DutyCalculator:
 			"power_hp": power_hp,
 			"tn_code": tn_code
 		}
-		
-		# 2. Определение режима торговли
-		regime = self._get_trade_regime(origin_country_code)
 		details = []
+		duty_plan, excise_plan = self._rate_plans(rate)
 		
 		# --- ИМПОРТНАЯ ПОШЛИНА ---
-		base_duty_usd, base_duty_desc = self._calc_complex_rate(
-			rate.rate_type, rate.ad_valorem_rate, rate.specific_rate,
-			rate.specific_currency, rate.specific_unit, customs_value, inputs
-		)
-		
-		final_duty_usd = base_duty_usd
-		final_duty_desc = base_duty_desc
-		
-		if regime == TradeRegimeType.FREE_TRADE:
-			final_duty_usd = 0.0
-			final_duty_desc = f"0% (Зона свободной торговли: {origin_country_code})"
-		elif regime == TradeRegimeType.GENERAL:
-			# Генеральный режим (х2)
-			final_duty_usd = base_duty_usd * 2
-			final_duty_desc = f"{base_duty_desc} x 2 (Двойная ставка)"
-		
-		details.append({
-			"name": "Импортная пошлина",
-			"rate_source": final_duty_desc,
-			"amount_usd": round(final_duty_usd, 2),
-			"amount_uzs": round(final_duty_usd * self.usd_rate, 2)
-		})
-		
-		# --- АКЦИЗ ---
-		excise_usd, excise_desc = self._calc_complex_rate(
-			rate.excise_type, rate.excise_ad_valorem_rate, rate.excise_specific_rate,
-			rate.excise_currency, rate.excise_unit, customs_value, inputs
-		)
-		if excise_usd > 0.01 or rate.excise_ad_valorem_rate > 0:
+		with stage("duty"):
+			base_duty_usd, base_duty_desc = duty_plan.evaluate(customs_value, inputs, self.usd_rate)
+			
+			final_duty_usd = base_duty_usd
+			final_duty_desc = base_duty_desc
+			
+			if regime == TradeRegimeType.FREE_TRADE:
+				final_duty_usd = 0.0
+				final_duty_desc = (f"0% (Зона свободной торговли: {origin_country_code})"
+				                   if origin_country_code else "0% (Зона свободной торговли)")
+			elif regime == TradeRegimeType.GENERAL:
+				# Генеральный режим (х2)
+				final_duty_usd = base_duty_usd * 2
+				final_duty_desc = f"{base_duty_desc} x 2 (Двойная ставка)"
+			
 			details.append({
-				"name": "Акцизный налог",
-				"rate_source": excise_desc,
-				"amount_usd": round(excise_usd, 2),
-				"amount_uzs": round(excise_usd * self.usd_rate, 2)
+				"name": "Импортная пошлина",
+				"rate_source": final_duty_desc,
+				"amount_usd": round(final_duty_usd, 2),
+				"amount_uzs": round(final_duty_usd * self.usd_rate, 2)
 			})
 		
+		# --- АКЦИЗ ---
+		with stage("excise"):
+			excise_usd, excise_desc = excise_plan.evaluate(customs_value, inputs, self.usd_rate)
+			if excise_usd > 0.01 or rate.excise_ad_valorem_rate > 0:
+				details.append({
+					"name": "Акцизный налог",
+					"rate_source": excise_desc,
+					"amount_usd": round(excise_usd, 2),
+					"amount_uzs": round(excise_usd * self.usd_rate, 2)
+				})
+		
 		# --- НДС ---
-		vat_base = customs_value + final_duty_usd + excise_usd
-		vat_usd = vat_base * (rate.vat_rate / 100)
-		details.append({
-			"name": f"НДС ({rate.vat_rate}%)",
-			"rate_source": "12% от (Стоимость + Пошлина + Акциз)",
-			"amount_usd": round(vat_usd, 2),
-			"amount_uzs": round(vat_usd * self.usd_rate, 2)
-		})
+		with stage("vat"):
+			vat_base = customs_value + final_duty_usd + excise_usd
+			vat_usd = vat_base * (rate.vat_rate / 100)
+			details.append({
+				"name": f"НДС ({rate.vat_rate}%)",
+				"rate_source": "12% от (Стоимость + Пошлина + Акциз)",
+				"amount_usd": round(vat_usd, 2),
+				"amount_uzs": round(vat_usd * self.usd_rate, 2)
+			})
 		
 		# --- ТАМОЖЕННЫЙ СБОР (ПКМ 55) ---
-		fee_usd, fee_uzs, fee_desc = self._calc_customs_fee(customs_value)
-		details.append({
-			"name": "Таможенный сбор",
-			"rate_source": fee_desc,
-			"amount_usd": round(fee_usd, 2),
-			"amount_uzs": round(fee_uzs, 2)
-		})
+		# Для декларации сбор считается один раз от общей стоимости (см. calculate_declaration)
+		fee_usd = 0.0
+		if with_customs_fee:
+			with stage("fee"):
+				fee_usd, fee_uzs, fee_desc = self._calc_customs_fee(customs_value)
+				details.append({
+					"name": "Таможенный сбор",
+					"rate_source": fee_desc,
+					"amount_usd": round(fee_usd, 2),
+					"amount_uzs": round(fee_uzs, 2)
+				})
 		
 		# --- [NEW] УТИЛИЗАЦИОННЫЙ СБОР ---
 		# Проверяем флаг в базе или наличие метаданных
 		if tn_code_obj.is_util_applicable:
-			util_usd, util_uzs, util_desc = self._calc_utilization_fee(tn_code_obj.calc_metadata, inputs)
-			if util_usd > 0:
-				details.append({
-					"name": "Утилизационный сбор",
-					"rate_source": util_desc,
-					"amount_usd": round(util_usd, 2),
-					"amount_uzs": round(util_uzs, 2)
-				})
+			with stage("util"):
+				util_usd, util_uzs, util_desc = self._calc_utilization_fee(tn_code_obj.calc_metadata, inputs)
+				if util_usd > 0:
+					details.append({
+						"name": "Утилизационный сбор",
+						"rate_source": util_desc,
+						"amount_usd": round(util_usd, 2),
+						"amount_uzs": round(util_uzs, 2)
+					})
 			# Утильсбор НЕ входит в базу НДС, он платится отдельно
 		else:
 			util_usd = 0.0
 		
 		# Итоговая сумма
 		total_usd = final_duty_usd + excise_usd + vat_usd + fee_usd + util_usd
+		return details, total_usd
+	
+	def calculate_origins(self, tn_code: str, customs_value: float, weight_kg: float,
+	                      quantity_pcs: float = 0, volume_cm3: float = 0, liter_qty: float = 0,
+	                      manufacturing_year: int = None, power_hp: float = 0, **_ignored):
+		"""
+		Сравнение стран происхождения.
+		Платежи зависят от страны только через режим торговли, поэтому расчет
+		делается один раз на режим и раскладывается на все страны из справочника.
+		"""
+		result = self.get_rate_and_code_recursive(tn_code)
+		if not result:
+			return {
+				"tn_code": tn_code,
+				"error": "Код ТН ВЭД не найден",
+				"customs_value": customs_value,
+				"regimes": [], "origins": [],
+				"currency_rate": self.usd_rate
+			}
+		
+		rate, tn_code_obj = result
+		line = dict(
+			tn_code=tn_code, customs_value=customs_value, weight_kg=weight_kg,
+			quantity_pcs=quantity_pcs, volume_cm3=volume_cm3, liter_qty=liter_qty,
+			manufacturing_year=manufacturing_year, power_hp=power_hp
+		)
+		
+		regimes = {}
+		for regime in TradeRegimeType:
+			details, total_usd = self._calculate_line(rate, tn_code_obj, regime, **line)
+			regimes[regime] = {
+				"trade_regime": regime,
+				"duty_usd": details[0]["amount_usd"],
+				"total_payments_usd": round(total_usd, 2),
+				"total_payments_uzs": round(total_usd * self.usd_rate, 2),
+				"details": details
+			}
+		
+		if self.snapshot is not None:
+			countries = list(self.snapshot.countries.values())
+		else:
+			countries = self.session.exec(select(Country).order_by(Country.id)).all()
+		
+		origins = {}
+		for country in countries:
+			iso = country.iso_code.upper()
+			if iso in origins:
+				continue
+			calc = regimes[country.trade_regime]
+			origins[iso] = {
+				"iso_code": iso,
+				"name_ru": country.name_ru,
+				"trade_regime": country.trade_regime,
+				"duty_usd": calc["duty_usd"],
+				"total_payments_usd": calc["total_payments_usd"],
+				"total_payments_uzs": calc["total_payments_uzs"],
+				"landed_cost_usd": round(customs_value + calc["total_payments_usd"], 2)
+			}
 		
 		return {
 			"tn_code": tn_code,
 			"currency_rate": round(self.usd_rate, 2),
-			"brv_rate": self.brv,  # Полезно вернуть БРВ на фронт
+			"currency_rate_date": self.usd_rate_date,
+			"brv_rate": self.brv,
+			"customs_value": customs_value,
+			# Страны вне справочника считаются по генеральному режиму
+			"regimes": list(regimes.values()),
+			"origins": sorted(origins.values(), key=lambda o: (o["total_payments_usd"], o["iso_code"])),
+			"error": None
+		}
+	
+	def calculate_max_value(self, tn_code: str, budget_usd: float, weight_kg: float,
+	                        quantity_pcs: float = 0, volume_cm3: float = 0, liter_qty: float = 0,
+	                        manufacturing_year: int = None, power_hp: float = 0,
+	                        origin_country_code: str | None = None):
+		"""
+		Обратный расчет: максимальная таможенная стоимость, при которой платежи не превышают бюджет.
+		
+		Платежи без таможенного сбора - непрерывная кусочно-линейная неубывающая функция стоимости
+		(изломы только там, где у смешанной ставки меняется ветка max()). Сбор ПКМ 55 постоянен
+		внутри своей ступени, поэтому решение ищется аналитически по ступеням шкалы сбора.
+		"""
+		result = self.get_rate_and_code_recursive(tn_code)
+		if not result:
+			return {
+				"tn_code": tn_code,
+				"error": "Код ТН ВЭД не найден",
+				"budget_usd": budget_usd,
+				"max_customs_value": None, "limited_by": None,
+				"total_payments_usd": 0, "total_payments_uzs": 0, "details": [],
+				"currency_rate": self.usd_rate
+			}
+		
+		rate, tn_code_obj = result
+		regime = self._get_trade_regime(origin_country_code)
+		line = dict(
+			tn_code=tn_code, weight_kg=weight_kg,
+			quantity_pcs=quantity_pcs, volume_cm3=volume_cm3, liter_qty=liter_qty,
+			manufacturing_year=manufacturing_year, power_hp=power_hp,
+			origin_country_code=origin_country_code
+		)
+		
+		def payments_without_fee(value: float) -> float:
+			return self._calculate_line(rate, tn_code_obj, regime, customs_value=value,
+			                            with_customs_fee=False, **line)[1]
+		
+		# Узлы кусочно-линейной функции: 0 и точки излома смешанных ставок
+		inputs = {
+			"weight": weight_kg,
+			"qty": quantity_pcs if quantity_pcs else 0,
+			"volume": volume_cm3 if volume_cm3 else 0,
+			"liters": liter_qty if liter_qty else 0,
+		}
+		crossovers = (plan.crossover(inputs, self.usd_rate) for plan in self._rate_plans(rate))
+		knots = sorted({0.0, *(x for x in crossovers if x)})
+		values = [payments_without_fee(k) for k in knots]
+		# За последним узлом функция линейна
+		tail_step = 1_000_000.0
+		tail_slope = (payments_without_fee(knots[-1] + tail_step) - values[-1]) / tail_step
+		
+		def solve(target: float) -> float | None:
+			"""Наибольшая стоимость с платежами без сбора <= target (None - недостижимо)"""
+			if values[0] > target:
+				return None
+			for i in range(1, len(knots)):
+				if values[i] > target:
+					return knots[i - 1] + (target - values[i - 1]) * (knots[i] - knots[i - 1]) / (values[i] - values[i - 1])
+			if tail_slope <= 1e-12:
+				return math.inf
+			return knots[-1] + (target - values[-1]) / tail_slope
+		
+		# Ступени ПКМ 55: [нижняя граница, верхняя граница)
+		lows = [0.0, *FEE_THRESHOLDS.tolist()]
+		highs = [*FEE_THRESHOLDS.tolist(), math.inf]
+		max_value = None
+		limited_by = "infeasible"
+		for low, high in zip(lows, highs):
+			fee_usd = self._calc_customs_fee(low)[0]
+			value = solve(budget_usd - fee_usd)
+			# Сбор и платежи растут со стоимостью: на следующих ступенях бюджет тоже не сойдется
+			if value is None or value < low:
+				break
+			# Платежи без сбора перестали расти: ограничивает только ступень сбора
+			if math.isinf(value) and math.isinf(high):
+				max_value, limited_by = None, "unbounded"
+				break
+			if value < high:
+				max_value, limited_by = value, "budget"
+				break
+			# Бюджет позволяет больше, но на границе ступени сбор скачком растет
+			max_value, limited_by = high - 0.01, "customs_fee"
+		
+		min_payments_usd = values[0] + self._calc_customs_fee(0.0)[0]
+		calculation = {"total_payments_usd": 0, "total_payments_uzs": 0, "details": []}
+		if max_value is not None:
+			max_value = math.floor(max_value * 100) / 100
+			calculation = self.calculate(customs_value=max_value, **line)
+			# Ответ округлен до цента: защищаемся от превышения бюджета из-за округления
+			if calculation["total_payments_usd"] > budget_usd and max_value >= 0.01:
+				max_value = round(max_value - 0.01, 2)
+				calculation = self.calculate(customs_value=max_value, **line)
+		
+		return {
+			"tn_code": tn_code,
+			"currency_rate": round(self.usd_rate, 2),
+			"currency_rate_date": self.usd_rate_date,
+			"brv_rate": self.brv,
+			"budget_usd": budget_usd,
+			"max_customs_value": max_value,
+			"limited_by": limited_by,
+			"min_payments_usd": round(min_payments_usd, 2),
+			"total_payments_usd": calculation["total_payments_usd"],
+			"total_payments_uzs": calculation["total_payments_uzs"],
+			"details": calculation["details"],
+			"error": None
+		}
+	
+	def _resolve_bulk(self, tn_codes: list[str], country_codes: list[str]) -> TariffSnapshot:
+		"""
+		Справочные данные для пачки позиций.
+		Без снимка - по одному запросу на таблицу, результат собирается во временный снимок.
+		"""
+		if self.snapshot is not None:
+			return self.snapshot
+		
+		# Все префиксы, по которым get_rate_and_code_recursive искал бы ставку
+		candidates = set()
+		for code in tn_codes:
+			code = code.strip()
+			while len(code) >= 4:
+				candidates.add(code)
+				code = code[:-2]
+		
+		codes = self.session.exec(select(TnVedCode).where(TnVedCode.code.in_(candidates))).all() if candidates else []
+		code_ids = [c.id for c in codes]
+		rates = self.session.exec(
+			select(TariffRate)
+			.where(TariffRate.tn_ved_code_id.in_(code_ids), active_version_filter())
+			.order_by(TariffRate.id)
+		).all() if code_ids else []
+		isos = {c.upper() for c in country_codes if c}
+		countries = self.session.exec(
+			select(Country).where(Country.iso_code.in_(isos)).order_by(Country.id)
+		).all() if isos else []
+		
+		return TariffSnapshot.build(codes, rates, countries, self.usd_rate)
+	
+	def calculate_declaration(self, lines: list[dict]) -> dict:
+		"""
+		Расчет декларации из многих товарных позиций.
+		Пошлина, акциз, НДС и утильсбор считаются по каждой позиции,
+		таможенный сбор (ПКМ 55) - один раз от суммарной таможенной стоимости.
+		"""
+		with stage("lookup"):
+			reference = self._resolve_bulk(
+				[line["tn_code"] for line in lines],
+				[line.get("origin_country_code") for line in lines]
+			)
+		
+		line_results = []
+		totals: dict[str, float] = {}
+		total_value = 0.0
+		total_usd = 0.0
+		
+		for line_no, line in enumerate(lines, start=1):
+			found = reference.find_rate(line["tn_code"])
+			if not found:
+				line_results.append({
+					"line_no": line_no,
+					"tn_code": line["tn_code"],
+					"customs_value": line["customs_value"],
+					"total_payments_usd": 0, "total_payments_uzs": 0, "details": [],
+					"error": "Код ТН ВЭД не найден"
+				})
+				continue
+			
+			rate, tn_code_obj = found
+			regime = reference.trade_regime(line.get("origin_country_code"))
+			details, line_usd = self._calculate_line(rate, tn_code_obj, regime, with_customs_fee=False, **line)
+			
+			for item in details:
+				totals[item["name"]] = totals.get(item["name"], 0.0) + item["amount_usd"]
+			total_value += line["customs_value"]
+			total_usd += line_usd
+			
+			line_results.append({
+				"line_no": line_no,
+				"tn_code": line["tn_code"],
+				"resolved_code": tn_code_obj.code,
+				"customs_value": line["customs_value"],
+				"total_payments_usd": round(line_usd, 2),
+				"total_payments_uzs": round(line_usd * self.usd_rate, 2),
+				"details": details,
+				"error": None
+			})
+		
+		# --- ТАМОЖЕННЫЙ СБОР (ПКМ 55) на всю декларацию ---
+		fee_usd, fee_uzs, fee_desc = self._calc_customs_fee(total_value)
+		total_usd += fee_usd
+		
+		total_details = [
+			{
+				"name": name,
+				"rate_source": "Сумма по позициям декларации",
+				"amount_usd": round(amount, 2),
+				"amount_uzs": round(amount * self.usd_rate, 2)
+			}
+			for name, amount in totals.items()
+		]
+		total_details.append({
+			"name": "Таможенный сбор",
+			"rate_source": fee_desc,
+			"amount_usd": round(fee_usd, 2),
+			"amount_uzs": round(fee_uzs, 2)
+		})
+		
+		return {
+			"currency_rate": round(self.usd_rate, 2),
+			"currency_rate_date": self.usd_rate_date,
+			"brv_rate": self.brv,
+			"total_customs_value_usd": round(total_value, 2),
 			"total_payments_usd": round(total_usd, 2),
 			"total_payments_uzs": round(total_usd * self.usd_rate, 2),
-			"details": details,
-			"error": None
-		}
\ No newline at end of file
+			"totals": total_details,
+			"lines": line_results
+		}
+
+
+def carry_over_calculations(old: TariffSnapshot | None, new: TariffSnapshot, changed_codes) -> int:
+	"""
+	Переносит кэш расчетов на новый снимок для кодов, которых не коснулась синхронизация.
+	Расчет зависит от ставки кода или ближайшего родителя, поэтому запись сбрасывается,
+	если какой-либо префикс кода есть среди измененных. Курс и режимы стран должны совпадать.
+	Возвращает число перенесенных расчетов.
+	"""
+	if old is None or old.usd_rate != new.usd_rate or old.countries != new.countries:
+		return 0
+	changed = set(changed_codes)
+	
+	def keep(key: tuple) -> bool:
+		tn_code = key[2]
+		return not any(tn_code[:n] in changed for n in range(1, len(tn_code) + 1))
+	
+	return calculation_cache.carry_over(old.version, new.version, keep)
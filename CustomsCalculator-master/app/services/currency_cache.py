@@ -0,0 +1,157 @@
+# app/services/currency_cache.py
+"""
+Кэш курсов валют на процесс.
+
+Заполняется одним запросом при старте: только последний курс каждой валюты.
+Курсы на прошлую дату (расчет на дату декларации) читаются из БД по запросу
+и запоминаются до сброса. После обновления курсов (POST /refresh-currency,
+CurrencyClient.update_rates) кэш сбрасывается и перечитывается при следующем
+обращении с сессией.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.models.currency import Currency, CurrencyRate
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class _CacheState:
+	# char_code -> (курс, дата) последнего курса
+	latest: Mapping[str, tuple[float, date]]
+	# (char_code, дата) -> (курс, дата курса) для дат раньше последнего курса
+	by_date: dict[tuple[str, date], Optional[tuple[float, date]]]
+	loaded_at: datetime
+	loaded_monotonic: float
+
+
+class CurrencyCache:
+	def __init__(self):
+		self._state: _CacheState | None = None
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.fallbacks = 0
+
+	def load(self, session: Session) -> None:
+		"""Читает последний курс каждой валюты и атомарно подменяет состояние кэша"""
+		rows = session.exec(_latest_rates_statement(session.get_bind().dialect.name)).all()
+		latest = {char_code: (rate, rate_date) for char_code, rate, rate_date in rows}
+
+		self._state = _CacheState(
+			latest=MappingProxyType(latest),
+			by_date={},
+			loaded_at=datetime.now(),
+			loaded_monotonic=time.monotonic(),
+		)
+		logger.info(f"💱 Кэш курсов загружен: {len(latest)} валют")
+
+	def invalidate(self) -> None:
+		"""Сбрасывает кэш после обновления курсов: следующий запрос с сессией перечитает БД"""
+		self._state = None
+
+	def _get_state(self, session: Session | None) -> _CacheState | None:
+		state = self._state
+		if state is None and session is not None:
+			with self._lock:
+				if self._state is None:
+					self.load(session)
+				state = self._state
+		return state
+
+	def latest(self, char_code: str, session: Session | None = None) -> Optional[tuple[float, date]]:
+		"""Последний курс валюты: (курс, дата) или None"""
+		state = self._get_state(session)
+		found = state.latest.get(char_code) if state else None
+		if found is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+		return found
+
+	def rate_on(self, char_code: str, on_date: date, session: Session | None = None) -> Optional[tuple[float, date]]:
+		"""Курс валюты, действовавший на дату: последний курс не позже on_date - (курс, дата) или None"""
+		state = self._get_state(session)
+		if state is None:
+			self.misses += 1
+			return None
+		latest = state.latest.get(char_code)
+		if latest is not None and latest[1] <= on_date:
+			self.hits += 1
+			return latest
+
+		key = (char_code, on_date)
+		if key in state.by_date:
+			self.hits += 1
+			return state.by_date[key]
+		self.misses += 1
+		if session is None:
+			return None
+		found = session.exec(
+			select(CurrencyRate.rate, CurrencyRate.date)
+			.join(Currency)
+			.where(Currency.char_code == char_code, CurrencyRate.date <= on_date)
+			.order_by(CurrencyRate.date.desc())
+			.limit(1)
+		).first()
+		state.by_date[key] = tuple(found) if found else None
+		return state.by_date[key]
+
+	def record_fallback(self) -> None:
+		"""Учитывает расчет по курсу по умолчанию (курса USD нет в БД)"""
+		self.fallbacks += 1
+
+	def stats(self) -> dict:
+		state = self._state
+		total = self.hits + self.misses
+		usd = state.latest.get("USD") if state else None
+		return {
+			"loaded": state is not None,
+			"loaded_at": state.loaded_at if state else None,
+			"age_seconds": round(time.monotonic() - state.loaded_monotonic, 1) if state else None,
+			"currencies": len(state.latest) if state else 0,
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_ratio": round(self.hits / total, 4) if total else None,
+			# Сколько раз расчет ушел на курс по умолчанию (нет курса USD в БД)
+			"fallbacks": self.fallbacks,
+			"usd_rate": usd[0] if usd else None,
+			"usd_rate_date": usd[1] if usd else None,
+			# Возраст курса в днях: большой возраст = курсы давно не обновлялись
+			"usd_rate_age_days": (date.today() - usd[1]).days if usd else None,
+		}
+
+
+def _latest_rates_statement(dialect_name: str):
+	"""Последний курс каждой валюты: (char_code, курс, дата)"""
+	columns = (Currency.char_code, CurrencyRate.rate, CurrencyRate.date)
+	if dialect_name == "postgresql":
+		return (
+			select(*columns)
+			.join(Currency)
+			.distinct(CurrencyRate.currency_id)
+			.order_by(CurrencyRate.currency_id, CurrencyRate.date.desc())
+		)
+	# Без DISTINCT ON (SQLite в тестах): строка с максимальной датой по валюте
+	last = (
+		select(CurrencyRate.currency_id, func.max(CurrencyRate.date).label("date"))
+		.group_by(CurrencyRate.currency_id)
+		.subquery()
+	)
+	return (
+		select(*columns)
+		.join(Currency)
+		.join(last, (last.c.currency_id == CurrencyRate.currency_id) & (last.c.date == CurrencyRate.date))
+	)
+
+
+currency_cache = CurrencyCache()
@@ -0,0 +1,101 @@
+"""
+Массовая загрузка строк в таблицы справочников.
+
+PostgreSQL (psycopg2): строки потоком идут через COPY FROM STDIN во временную
+staging-таблицу, затем одним INSERT ... SELECT переносятся в целевую таблицу.
+ORM-объекты не создаются, в памяти - только текст текущего куска COPY.
+Остальные БД (SQLite в тестах): executemany через Core insert().
+"""
+import json
+from enum import Enum
+from typing import Any, Callable, Iterable, Iterator
+
+from sqlalchemy import Enum as SAEnum, JSON, insert
+from sqlmodel import Session, SQLModel
+
+# Экранирование текстового формата COPY
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+_COPY_NULL = "\\N"
+
+
+def _copy_converter(column) -> Callable[[Any], str]:
+	"""Значение Python -> поле текстового формата COPY для колонки"""
+	if isinstance(column.type, SAEnum) and column.type.enum_class is not None:
+		enum_class = column.type.enum_class
+		# SQLAlchemy хранит Enum по имени члена (AD_VALOREM), а не по значению
+		return lambda v: (v if isinstance(v, Enum) else enum_class(v)).name
+	if isinstance(column.type, JSON):
+		return lambda v: json.dumps(v, ensure_ascii=False).translate(_COPY_ESCAPES)
+	return lambda v: ("t" if v else "f") if isinstance(v, bool) else str(v).translate(_COPY_ESCAPES)
+
+
+class _CopyStream:
+	"""Файлоподобный поток строк COPY: copy_expert читает его кусками через read()"""
+
+	def __init__(self, lines: Iterator[str]):
+		self._lines = lines
+		self._buffer = ""
+
+	def read(self, size: int = -1) -> str:
+		while size < 0 or len(self._buffer) < size:
+			line = next(self._lines, None)
+			if line is None:
+				break
+			self._buffer += line
+		if size < 0:
+			size = len(self._buffer)
+		chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+		return chunk
+
+
+def supports_copy(session: Session) -> bool:
+	dialect = session.get_bind().dialect
+	return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def bulk_insert(session: Session, model: type[SQLModel], rows: Iterable[dict]) -> int:
+	"""
+	Вставляет строки (словари колонка -> значение) в таблицу модели.
+	Пропущенные колонки получают значения по умолчанию из модели, первичный ключ - из БД.
+	Коммит делает вызывающий. Возвращает число вставленных строк.
+	"""
+	table = model.__table__
+	columns = [c for c in table.columns if not c.primary_key]
+	defaults = {
+		c.name: c.default.arg
+		for c in columns if c.default is not None and c.default.is_scalar
+	}
+
+	if not supports_copy(session):
+		rows = [{**defaults, **row} for row in rows]
+		if not rows:
+			return 0
+		session.execute(insert(table), rows)
+		return len(rows)
+
+	converters = [(c.name, _copy_converter(c)) for c in columns]
+
+	def lines() -> Iterator[str]:
+		for row in rows:
+			fields = []
+			for name, convert in converters:
+				value = row.get(name, defaults.get(name))
+				fields.append(_COPY_NULL if value is None else convert(value))
+			yield "\t".join(fields) + "\n"
+
+	names = ", ".join(f'"{c.name}"' for c in columns)
+	staging = f"staging_{table.name}"
+	# Курсор того же соединения и той же транзакции, что и у сессии
+	cursor = session.connection().connection.cursor()
+	try:
+		cursor.execute(f'DROP TABLE IF EXISTS "{staging}"')
+		cursor.execute(
+			f'CREATE TEMP TABLE "{staging}" ON COMMIT DROP AS SELECT {names} FROM "{table.name}" WITH NO DATA'
+		)
+		cursor.copy_expert(f'COPY "{staging}" ({names}) FROM STDIN', _CopyStream(lines()))
+		cursor.execute(
+			f'INSERT INTO "{table.name}" ({names}) SELECT {names} FROM "{staging}"'
+		)
+		return cursor.rowcount
+	finally:
+		cursor.close()
@@ -1,38 +1,16 @@
 import re
+from bisect import bisect_left
+
 import pandas as pd
 from fastapi import Depends
-from sqlmodel import Session, select, delete
+from sqlmodel import Session, select
 
 from app.core.database import get_session
-from app.models.rates import TariffRate, RateType
+from app.models.rates import RateType, ExciseType
 from app.models.tnved import TnVedCode
-
-
-def normalize_unit(unit_str):
-	if not unit_str: return None
-	u = str(unit_str).lower()
-	
-	# Сначала проверяем особый случай с 1000
-	if '1000' in u: return '1000_pcs'
-	
-	# Словарь соответствий: {Код: [список корней на рус и узб]}
-	# 'кило' ловит 'килограмм', 'килограмми'
-	# 'дон' ловит 'дона', 'донаси' (шт)
-	# 'жуфт' ловит 'жуфти' (пара)
-	mappings = {
-		'kg': ['кило', 'кг'],
-		'l': ['литр'],
-		'pcs': ['штук', 'шт', 'дон'],
-		'pair': ['пар', 'жуфт'],
-		'cm3': ['куб', 'см'],
-		'm2': ['м2']
-	}
-	
-	for code, keywords in mappings.items():
-		if any(k in u for k in keywords):
-			return code
-	
-	return u.strip()
+from app.services.units import normalize_unit_text
+from app.services.tariff_versions import publish_rates
+from app.services.tnved_tree import rebuild_tnved_tree
 
 
 def parse_rate_string(rate_str):
@@ -67,7 +45,7 @@ def parse_rate_string(rate_str):
 	specific_rate = float(spec_match.group(1)) if spec_match else 0.0
 	
 	# 4. Извлекаем единицу измерения (передаем всю строку, функция сама найдет ключевое слово)
-	specific_unit = normalize_unit(clean_str)
+	specific_unit = normalize_unit_text(clean_str)
 	
 	return {
 		"rate_type": rate_type,
@@ -77,71 +55,114 @@ def parse_rate_string(rate_str):
 	}
 
 
-def import_csv_to_db(session: Session, csv_path: str):
+def prefix_range(sorted_codes: list[str], prefix: str) -> tuple[int, int]:
+	"""Границы [lo, hi) кодов с заданным префиксом в отсортированном списке (бинарный поиск)"""
+	lo = bisect_left(sorted_codes, prefix)
+	hi = bisect_left(sorted_codes, prefix + "\uffff", lo)
+	return lo, hi
+
+
+def parse_duties_csv(session: Session, csv_path: str) -> tuple[dict[str, dict], dict[str, str]]:
 	"""
-	Импортирует CSV в БД используя переданную сессию.
+	Разбирает CSV пошлин в целевое состояние таблицы ставок, ничего не меняя в БД.
+	Возвращает (код -> строка TariffRate словарем, код -> узбекское наименование).
 	"""
-	print(f"🚀 Начинаем импорт из {csv_path}")
-	
-	# 1. Очистка
-	session.exec(delete(TariffRate))
-	
-	# 2. Загрузка кодов (словарь code -> id для скорости)
+	# Загрузка кодов: отсортированный список для поиска по префиксу бинарным поиском
 	raw_codes = session.exec(select(TnVedCode.code, TnVedCode.id)).all()
-	db_codes_list = [(code, pid) for code, pid in raw_codes]
+	code_to_id = dict(raw_codes)
+	sorted_codes = sorted(code_to_id)
 	
-	# 3. Чтение CSV
+	# Чтение CSV
 	df = pd.read_csv(csv_path, sep=';', dtype={'tn_code': str})
 	df['tn_code'] = df['tn_code'].astype(str).str.split(',')
-	df = df.explode('tn_code')
+	df = df.explode('tn_code', ignore_index=True)
 	df['tn_code'] = df['tn_code'].str.strip()
 	
-	rates_buffer = {}
-	
-	# 4. Логика
-	for index, row in df.iterrows():
-		source_code = str(row['tn_code']).strip()
-		source_len = len(source_code)
-		
-		target_ids = [pid for code, pid in db_codes_list if code.startswith(source_code)]
-		
-		if not target_ids: continue
-		
-		rate_data = parse_rate_string(row['rate'])
-		
-		for tn_id in target_ids:
-			if tn_id in rates_buffer:
-				existing_entry = rates_buffer[tn_id]
-				if source_len < existing_entry['source_len']:
-					continue
-			
-			tariff = TariffRate(
-				tn_ved_code_id=tn_id,
-				rate_type=RateType(rate_data['rate_type']),
-				ad_valorem_rate=rate_data['ad_valorem_rate'],
-				specific_rate=rate_data.get('specific_rate'),
-				specific_unit=rate_data.get('specific_unit'),
-				specific_currency="USD",
-				excise_type="ad_valorem",
-				excise_ad_valorem_rate=0.0,
-				vat_rate=12.0
-			)
-			rates_buffer[tn_id] = {
-				"rate_obj": tariff,
-				"source_len": source_len
-			}
-	
-	# 5. Сохранение
-	final_rates_list = [entry['rate_obj'] for entry in rates_buffer.values()]
-	
-	# Batch save
-	batch_size = 2000
-	for i in range(0, len(final_rates_list), batch_size):
-		batch = final_rates_list[i: i + batch_size]
-		session.add_all(batch)
-		# Flush нужен, чтобы не забивать память, но commit сделаем в конце в роутере
-		session.flush()
-	
-	print(f"✅ Импортировано ставок: {len(final_rates_list)}")
-	return len(final_rates_list)
+	# Узбекские наименования ("Товар номи") для кодов, которые есть в справочнике
+	names_uz = {}
+	if 'name' in df.columns:
+		named = df[df['tn_code'].isin(code_to_id) & df['name'].map(lambda v: isinstance(v, str))]
+		named = named.assign(name=named['name'].str.strip())
+		named = named[named['name'] != '']
+		# При повторе кода побеждает последняя строка
+		names_uz = dict(zip(named['tn_code'], named['name']))
+	
+	# Разбор ставок: одна строка ставки разбирается один раз (строк много, различных ставок мало)
+	parsed_rates = {rate: parse_rate_string(rate) for rate in df['rate'].dropna().unique()}
+	empty_rate = parse_rate_string(None)
+	
+	# Самый длинный исходный префикс побеждает: строки идут от коротких кодов к длинным
+	# (при равной длине - в порядке файла), более поздняя строка перезаписывает код.
+	# Каждый исходный код - один бинарный поиск по отсортированным кодам вместо перебора всех.
+	df['source_len'] = df['tn_code'].str.len()
+	ordered = df.sort_values('source_len', kind='stable')
+	
+	winners: dict[str, tuple[str, object]] = {}
+	ranges: dict[str, tuple[int, int]] = {}
+	for source_code, rate in zip(ordered['tn_code'], ordered['rate']):
+		bounds = ranges.get(source_code)
+		if bounds is None:
+			bounds = ranges[source_code] = prefix_range(sorted_codes, source_code)
+		lo, hi = bounds
+		for code in sorted_codes[lo:hi]:
+			winners[code] = (source_code, rate)
+	
+	rows = {}
+	for code, (source_code, rate) in winners.items():
+		rate_data = empty_rate if pd.isna(rate) else parsed_rates[rate]
+		rows[code] = {
+			"tn_ved_code_id": code_to_id[code],
+			"source_code": source_code,
+			"rate_type": RateType(rate_data['rate_type']),
+			"ad_valorem_rate": rate_data['ad_valorem_rate'],
+			"specific_rate": rate_data.get('specific_rate'),
+			"specific_unit": rate_data.get('specific_unit'),
+			"specific_currency": "USD",
+			"excise_type": ExciseType.AD_VALOREM,
+			"excise_ad_valorem_rate": 0.0,
+			"excise_specific_rate": None,
+			"excise_currency": "UZS",
+			"excise_unit": None,
+			"vat_rate": 12.0
+		}
+	return rows, names_uz
 
+
+def update_names_uz(session: Session, names_uz: dict[str, str]) -> None:
+	"""Узбекские описания (одним пакетным UPDATE по первичному ключу)"""
+	if not names_uz:
+		return
+	code_to_id = dict(session.exec(
+		select(TnVedCode.code, TnVedCode.id).where(TnVedCode.code.in_(list(names_uz)))
+	).all())
+	session.bulk_update_mappings(TnVedCode, [
+		{"id": code_to_id[code], "description_uz": name} for code, name in names_uz.items() if code in code_to_id
+	])
+	session.flush()
+
+
+def import_csv_to_db(session: Session, csv_path: str):
+	"""
+	Импортирует CSV в БД используя переданную сессию: ставки CSV публикуются новой
+	версией (на пустой базе - все строки через COPY, иначе только отличия от последней
+	версии), после проверок она становится активной. Регулярная синхронизация
+	с журналом - sync_duties.
+	"""
+	print(f"🚀 Начинаем импорт из {csv_path}")
+	
+	# 1. Разбор CSV в целевые строки
+	rows, names_uz = parse_duties_csv(session, csv_path)
+	
+	# 2. Публикация версии: старые ставки не трогаем, читатели видят их до коммита
+	# commit сделаем в конце в роутере
+	version, changes = publish_rates(session, rows, source=str(csv_path))
+	
+	# 3. Узбекские описания
+	update_names_uz(session, names_uz)
+	
+	# 4. Мин/макс ставки по поддеревьям зависят от ставок
+	if version is not None:
+		rebuild_tnved_tree(session)
+	
+	print(f"✅ Импортировано ставок: {len(rows)} (изменено {len(changes.changed_codes)})")
+	return len(rows)
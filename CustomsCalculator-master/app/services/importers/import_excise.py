@@ -1,51 +1,96 @@
 import json
-from sqlmodel import Session, select
-from app.models.rates import TariffRate, ExciseType
-from app.models.tnved import TnVedCode
+import logging
+from typing import Optional
+
+from sqlmodel import Session
+from app.models.rates import ExciseType
 from app.core.config import settings
+from app.services.importers.import_duties import prefix_range
+from app.services.tariff_versions import get_active_version, publish_rates, version_rates
 
+logger = logging.getLogger(__name__)
 
-def import_excise_data(session: Session):
-	print("🚀 Накладываем акцизы...")
-	
+
+def load_excise_items() -> Optional[list[dict]]:
+	"""Позиции акцизов из JSON (None - файла нет)"""
 	file_path = settings.EXCISE_DIR / "excise_tnved_data.json"
 	
 	if not file_path.exists():
-		print(f"❌ Файл {file_path} не найден!")
-		return 0
+		logger.error(f"❌ Файл {file_path} не найден!")
+		return None
 	
 	with open(file_path, "r", encoding="utf-8") as f:
-		data = json.load(f)
+		return json.load(f)
+
+
+def excise_fields(item: dict) -> dict:
+	"""Поля акциза TariffRate для одной позиции JSON"""
+	ex_spec_amount = float(item.get("excise_specific_amount", 0.0))
+	return {
+		"excise_type": ExciseType(item.get("excise_type", "ad_valorem")),
+		"excise_ad_valorem_rate": float(item.get("excise_percent", 0.0)),
+		"excise_specific_rate": ex_spec_amount if ex_spec_amount > 0 else None,
+		"excise_currency": item.get("excise_currency", "UZS"),
+		"excise_unit": item.get("excise_unit"),
+	}
+
+
+def compile_excise_rules(items: list[dict]) -> list[tuple[str, dict]]:
+	"""
+	Позиции JSON -> правила (префикс, поля акциза) в порядке применения.
+	Пересечения решаются явно: более длинный (точный) префикс важнее короткого,
+	при одинаковой длине - более поздняя позиция файла. Правила идут от слабых
+	к сильным, поэтому при наложении по порядку побеждает последнее.
+	"""
+	rules = []
+	for position, item in enumerate(items):
+		fields = excise_fields(item)
+		for code_prefix in item.get("approx_codes", []):
+			code_prefix = str(code_prefix).strip()
+			if code_prefix:
+				rules.append((len(code_prefix), position, code_prefix, fields))
+	rules.sort(key=lambda rule: rule[:2])
+	return [(code_prefix, fields) for _, _, code_prefix, fields in rules]
+
+
+def excise_overlay(codes: list[str], items: list[dict]) -> dict[str, dict]:
+	"""
+	Акцизы по кодам без запросов в БД: код -> поля акциза.
+	Каждый префикс - бинарный поиск по отсортированным кодам (см. compile_excise_rules).
+	"""
+	sorted_codes = sorted(codes)
+	overlay = {}
+	for code_prefix, fields in compile_excise_rules(items):
+		lo, hi = prefix_range(sorted_codes, code_prefix)
+		for code in sorted_codes[lo:hi]:
+			overlay[code] = fields
+	return overlay
+
+
+def import_excise_data(session: Session) -> list[str]:
+	"""
+	Накладывает акцизы на ставки активной версии и публикует результат новой версией
+	(только изменившиеся строки, с проверками перед активацией). Разрешение префиксов -
+	в памяти. Коммит делает вызывающий.
+	Возвращает коды, у которых акциз изменился (для точечного сброса кэшей расчета).
+	"""
+	logger.info("🚀 Накладываем акцизы...")
+	
+	data = load_excise_items()
+	if data is None:
+		return []
+	
+	active = get_active_version(session)
+	if active is None:
+		logger.error("❌ Нет активной версии ставок, акцизы накладывать не на что")
+		return []
 	
-	updated_count = 0
+	# Целевое состояние = ставки активной версии + акцизы
+	target = {code: values for code, (_, values) in version_rates(session, active.id).items()}
+	for code, fields in excise_overlay(list(target), data).items():
+		target[code].update(fields)
 	
-	for item in data:
-		target_codes = item.get("approx_codes", [])
-		
-		ex_type = item.get("excise_type", "ad_valorem")
-		ex_percent = float(item.get("excise_percent", 0.0))
-		ex_spec_amount = float(item.get("excise_specific_amount", 0.0))
-		ex_currency = item.get("excise_currency", "UZS")
-		ex_unit = item.get("excise_unit")
-		
-		# Оптимизация: ищем сразу все Rate, у которых коды начинаются с префикса
-		# Но так как связь Code -> Rate, придется делать join
-		for code_prefix in target_codes:
-			statement = (
-				select(TariffRate)
-				.join(TnVedCode)
-				.where(TnVedCode.code.startswith(code_prefix))
-			)
-			rates = session.exec(statement).all()
-			
-			for rate in rates:
-				rate.excise_type = ExciseType(ex_type)
-				rate.excise_ad_valorem_rate = ex_percent
-				rate.excise_specific_rate = ex_spec_amount if ex_spec_amount > 0 else None
-				rate.excise_currency = ex_currency
-				rate.excise_unit = ex_unit
-				session.add(rate)
-				updated_count += 1
+	_, changes = publish_rates(session, target, source=str(settings.EXCISE_DIR / "excise_tnved_data.json"))
 	
-	print(f"✅ Акцизы обновлены: {updated_count}")
-	return updated_count
+	logger.info(f"✅ Акцизы обновлены: {len(changes.changed_codes)}")
+	return changes.changed_codes
@@ -6,6 +6,10 @@ from sqlmodel import Session, select, SQLModel
 from app.core.database import engine
 from app.models import TnVedCode
 from app.core.config import settings
+from app.services.importers.bulk_load import bulk_insert
+from app.services.semantic_index import reset_semantic_index
+from app.services.units import normalize_unit_label
+from app.services.tnved_tree import rebuild_tnved_tree
 
 def parse_calc_metadata(code: str, description: str) -> dict:
 	"""
@@ -92,45 +96,6 @@ def parse_calc_metadata(code: str, description: str) -> dict:
 	return metadata
 
 
-# Словарь для маппинга единиц
-UNIT_MAPPING = {
-	'кг': 'kg',
-	'г': 'g',
-	'т': 't',
-	'шт': 'pcs',
-	'100 шт': '100_pcs',
-	'1000 шт': '1000_pcs',
-	'пар': 'pair',
-	'л': 'l',
-	'мл': 'ml',
-	'1000 л.': '1000_l',
-	'л100% сп.': 'l_alc_100',
-	'м': 'm',
-	'м2': 'm2',
-	'1000 м2': '1000_m2',
-	'м3': 'm3',
-	'1000 кВтч': '1000_kwh',
-	'кюри': 'ci',
-	'кар': 'carat',
-	'кг 90% с/в': 'kg_90_dry',
-	'кг H2O2': 'kg_h2o2',
-	'кг K2O': 'kg_k2o',
-	'кг N': 'kg_n',
-	'кг NаОH': 'kg_naoh',
-	'кг P2O5': 'kg_p2o5',
-	'кг U': 'kg_u',
-	'кг КОH': 'kg_koh',
-	'г Д/И': 'g_di'
-}
-
-
-def normalize_unit(value):
-	if pd.isna(value) or value == "" or str(value).lower() == 'nan':
-		return None
-	val_str = str(value).strip()
-	return UNIT_MAPPING.get(val_str, val_str)
-
-
 def import_tnved_codes(csv_file_path):
 	print("🚀 Начинаем процесс импорта с парсингом метаданных...")
 	
@@ -148,55 +113,55 @@ def import_tnved_codes(csv_file_path):
 		print("⏳ Проверка существующих кодов...")
 		existing_codes = set(session.exec(select(TnVedCode.code)).all())
 		
-		batch = []
-		count = 0
+		# Необязательные колонки (как row.get раньше): отсутствующая = пустые значения
+		missing = pd.Series(None, index=df.index, dtype=object)
+		
+		def code_rows():
+			for code_val, parent_val, desc_val, unit, unit2 in zip(
+					df['code'], df.get('parent_code', missing), df['description'],
+					df.get('unit', missing), df.get('unit2', missing)
+			):
+				code_val = str(code_val).strip()
+				
+				if code_val in existing_codes:
+					continue
+				# Повтор кода внутри файла - берем первую строку
+				existing_codes.add(code_val)
+				
+				# Очистка полей
+				if pd.isna(parent_val) or str(parent_val).lower() in ['nan', '0', '']:
+					parent_val = None
+				else:
+					parent_val = str(parent_val).strip()
+				
+				desc_val = str(desc_val).strip()
+				
+				# --- ПАРСИНГ МЕТАДАННЫХ ---
+				# Генерируем JSON для логики утильсбора
+				calc_meta = parse_calc_metadata(code_val, desc_val)
+				
+				yield {
+					"code": code_val,
+					"description": desc_val,
+					"unit": normalize_unit_label(unit),
+					"unit2": normalize_unit_label(unit2),
+					"parent_code": parent_val,
+					# Если calc_meta не пустой, значит товар подлежит утильсбору (или проверке)
+					"is_util_applicable": bool(calc_meta),
+					"calc_metadata": calc_meta
+				}
 		
-		for index, row in df.iterrows():
-			code_val = str(row['code']).strip()
-			
-			if code_val in existing_codes:
-				continue
-			
-			# Очистка полей
-			parent_val = row.get('parent_code')
-			if pd.isna(parent_val) or str(parent_val).lower() in ['nan', '0', '']:
-				parent_val = None
-			else:
-				parent_val = str(parent_val).strip()
-			
-			desc_val = str(row['description']).strip()
-			
-			# --- ПАРСИНГ МЕТАДАННЫХ ---
-			# Генерируем JSON для логики утильсбора
-			calc_meta = parse_calc_metadata(code_val, desc_val)
-			
-			# Если calc_meta не пустой, значит товар подлежит утильсбору (или проверке)
-			is_applicable = bool(calc_meta)
-			
-			tn_obj = TnVedCode(
-				code=code_val,
-				description=desc_val,
-				unit=normalize_unit(row.get('unit')),
-				unit2=normalize_unit(row.get('unit2')),
-				parent_code=parent_val,
-				# Новые поля
-				is_util_applicable=is_applicable,
-				calc_metadata=calc_meta
-			)
-			
-			batch.append(tn_obj)
-			count += 1
-			
-			if len(batch) >= 1000:
-				session.add_all(batch)
-				session.commit()
-				batch = []
-				print(f"📥 Обработано {count} записей...")
+		# Одна транзакция на весь файл: в PostgreSQL строки идут через COPY, без ORM-объектов
+		count = bulk_insert(session, TnVedCode, code_rows())
+		session.commit()
 		
-		if batch:
-			session.add_all(batch)
-			session.commit()
+		# Пути и агрегаты дерева по всему справочнику
+		nodes = rebuild_tnved_tree(session)
+		session.commit()
+		print(f"🌳 Дерево пересчитано: {nodes} узлов")
 		
+		# Открытый в процессе индекс построен по старому справочнику
+		reset_semantic_index()
 		print(f"\n🏁 Импорт завершен! Добавлено: {count}")
 
 
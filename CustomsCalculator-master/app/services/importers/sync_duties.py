@@ -0,0 +1,69 @@
+"""
+Инкрементальная синхронизация ставок с CSV Lex.uz.
+
+Вместо удаления всех ставок и повторной вставки считается разница между
+целевым состоянием (CSV + акцизы, наложенные в памяти) и ставками последней
+версии по коду ТН ВЭД. Если разница есть, публикуется новая версия только из
+изменений (app/services/tariff_versions.py). Итог пишется в журнал tariff_sync_log.
+"""
+import logging
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from app.models.sync_log import TariffSyncLog
+from app.models.tnved import TnVedCode
+from app.services.importers.import_duties import parse_duties_csv
+from app.services.importers.import_excise import excise_overlay
+from app.services.tariff_versions import publish_rates
+from app.services.tnved_tree import rebuild_tnved_tree
+
+logger = logging.getLogger(__name__)
+
+
+def sync_duties(session: Session, csv_path: str, excise_items: Optional[list[dict]] = None) -> TariffSyncLog:
+	"""
+	Применяет к tariff_rates только отличия от CSV (и акцизов из excise_items).
+	Коммит делает вызывающий. Возвращает запись журнала (уже добавленную в сессию).
+	"""
+	target, names_uz = parse_duties_csv(session, csv_path)
+	if excise_items:
+		for code, fields in excise_overlay(list(target), excise_items).items():
+			target[code].update(fields)
+	
+	# Новая версия = только изменения; читатели видят активную до коммита
+	version, changes = publish_rates(session, target, source=str(csv_path))
+	
+	# Узбекские описания - тоже только изменившиеся
+	name_updates = []
+	if names_uz:
+		for code_id, code, name in session.exec(
+			select(TnVedCode.id, TnVedCode.code, TnVedCode.description_uz).where(TnVedCode.code.in_(list(names_uz)))
+		):
+			if names_uz[code] != name:
+				name_updates.append({"id": code_id, "description_uz": names_uz[code]})
+		if name_updates:
+			session.bulk_update_mappings(TnVedCode, name_updates)
+	session.flush()
+	
+	# Мин/макс ставки по поддеревьям зависят от ставок (уже новой активной версии)
+	if version is not None:
+		rebuild_tnved_tree(session)
+	
+	log = TariffSyncLog(
+		source=str(csv_path),
+		version_id=version.id if version is not None else None,
+		inserted=len(changes.inserted),
+		updated=len(changes.updated),
+		deleted=len(changes.deleted),
+		unchanged=changes.unchanged,
+		names_updated=len(name_updates),
+		changed_codes=changes.changed_codes,
+	)
+	session.add(log)
+	session.flush()
+	logger.info(
+		f"✅ Синхронизация ставок: +{log.inserted} ~{log.updated} -{log.deleted}, без изменений {log.unchanged}, "
+		f"описаний uz {log.names_updated}, версия {log.version_id}"
+	)
+	return log
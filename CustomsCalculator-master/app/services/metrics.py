@@ -0,0 +1,205 @@
+# app/services/metrics.py
+"""
+Замеры времени по стадиям расчета и счетчик SQL-запросов на HTTP-запрос.
+
+- stage("duty"): замер стадии, суммируется в тайминги текущего запроса
+- stage_iter("classify", items): то же для генератора - замеряется каждый next()
+- track(): открывает тайминги запроса (middleware делает это на каждый запрос)
+- histograms: гистограммы по стадиям за время жизни процесса (GET /metrics)
+
+Потоковые ответы (mark_streaming()) отдают заголовки раньше, чем отработают
+стадии, поэтому их тайминги пишутся в лог после последнего куска, без заголовка.
+
+Вне track() (скрипты, тесты) stage() ничего не замеряет.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, Sequence, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Границы корзин: время в мс и число SQL-запросов на HTTP-запрос
+TIME_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+SQL_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestTimings:
+	"""Тайминги одного запроса: стадия -> суммарное время (мс) и число SQL-запросов"""
+	__slots__ = ("stages", "sql_count", "started", "streaming")
+
+	def __init__(self):
+		self.stages: dict[str, float] = {}
+		self.sql_count = 0
+		self.started = time.perf_counter()
+		self.streaming = False
+
+	def add(self, name: str, ms: float) -> None:
+		self.stages[name] = self.stages.get(name, 0.0) + ms
+
+	def total_ms(self) -> float:
+		return (time.perf_counter() - self.started) * 1000
+
+	def server_timing(self) -> str:
+		"""Значение заголовка Server-Timing"""
+		parts = [f"{name};dur={ms:.3f}" for name, ms in self.stages.items()]
+		parts.append(f'sql;desc="{self.sql_count} statements"')
+		parts.append(f"total;dur={self.total_ms():.3f}")
+		return ", ".join(parts)
+
+
+class Histogram:
+	"""Гистограмма с фиксированными корзинами (значение <= границы)"""
+
+	def __init__(self, buckets: Sequence[float]):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value: float) -> None:
+		self.counts[bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def stats(self) -> dict:
+		return {
+			"count": self.count,
+			"sum": round(self.sum, 3),
+			"avg": round(self.sum / self.count, 3) if self.count else None,
+			"buckets": {
+				**{f"le_{b}": c for b, c in zip(self.buckets, self.counts)},
+				"le_inf": self.counts[-1],
+			},
+		}
+
+
+class StageHistograms:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.stages: dict[str, Histogram] = {}
+		self.sql = Histogram(SQL_BUCKETS)
+
+	def observe_request(self, timings: RequestTimings) -> None:
+		with self._lock:
+			for name, ms in timings.stages.items():
+				hist = self.stages.get(name)
+				if hist is None:
+					hist = self.stages[name] = Histogram(TIME_BUCKETS_MS)
+				hist.observe(ms)
+			self.stages.setdefault("request", Histogram(TIME_BUCKETS_MS)).observe(timings.total_ms())
+			self.sql.observe(timings.sql_count)
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"stages_ms": {name: hist.stats() for name, hist in self.stages.items()},
+				"sql_statements_per_request": self.sql.stats(),
+			}
+
+	def reset(self) -> None:
+		with self._lock:
+			self.stages = {}
+			self.sql = Histogram(SQL_BUCKETS)
+
+
+histograms = StageHistograms()
+
+_current: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def track() -> Iterator[RequestTimings]:
+	"""Открывает тайминги запроса; вложенные stage() и SQL-запросы пишутся в них"""
+	timings = RequestTimings()
+	token = _current.set(timings)
+	try:
+		yield timings
+	finally:
+		_current.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+	timings = _current.get()
+	if timings is None:
+		yield
+		return
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+def stage_iter(name: str, items: Iterable[T]) -> Iterator[T]:
+	"""
+	Замер стадии, которая работает по мере чтения генератора (потоковый ответ):
+	время каждого next() суммируется в тайминги запроса, открытого при вызове.
+	"""
+	timings = _current.get()
+	iterator = iter(items)
+	if timings is None:
+		return iterator
+	
+	def measured() -> Iterator[T]:
+		while True:
+			started = time.perf_counter()
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+			finally:
+				timings.add(name, (time.perf_counter() - started) * 1000)
+			yield item
+	
+	return measured()
+
+
+def mark_streaming() -> None:
+	"""Ответ текущего запроса отдается потоком: тайминги - в лог по окончании, не в заголовок"""
+	timings = _current.get()
+	if timings is not None:
+		timings.streaming = True
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+	timings = _current.get()
+	if timings is not None:
+		timings.sql_count += 1
+
+
+def install_sql_counter(engine: Engine) -> None:
+	"""Считает SQL-запросы движка в таймингах текущего запроса"""
+	if not event.contains(engine, "before_cursor_execute", _count_statement):
+		event.listen(engine, "before_cursor_execute", _count_statement)
+
+
+async def server_timing_middleware(request, call_next):
+	"""HTTP middleware: тайминги на каждый запрос + заголовок Server-Timing"""
+	with track() as timings:
+		response = await call_next(request)
+		if timings.streaming:
+			response.body_iterator = _observe_after_stream(response.body_iterator, request.url.path, timings)
+			return response
+		response.headers["Server-Timing"] = timings.server_timing()
+		histograms.observe_request(timings)
+	return response
+
+
+async def _observe_after_stream(body, path: str, timings: RequestTimings):
+	"""Отдает куски потокового ответа, а после последнего пишет тайминги в лог и гистограммы"""
+	try:
+		async for chunk in body:
+			yield chunk
+	finally:
+		histograms.observe_request(timings)
+		logger.info(f"⏱️ {path}: {timings.server_timing()}")
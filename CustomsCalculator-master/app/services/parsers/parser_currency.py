@@ -4,6 +4,7 @@ from sqlmodel import Session, select
 
 from app.models.currency import Currency, CurrencyRate
 from app.schemas.currency import CurrencySchema
+from app.services.currency_cache import currency_cache
 
 CBU_URL = "https://cbu.uz/uz/arkhiv-kursov-valyut/json/"
 
@@ -66,4 +67,7 @@ class CurrencyClient:
 				updated_count += 1
 		
 		session.commit()
+		
+		# Кэш курсов перечитается целиком уже после коммита
+		currency_cache.invalidate()
 		return {"status": "success", "new_rates_added": updated_count}
\ No newline at end of file
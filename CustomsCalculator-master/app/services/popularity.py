@@ -0,0 +1,171 @@
+# app/services/popularity.py
+"""
+Популярность кодов: сколько раз код выбирали в поиске и считали в калькуляторе.
+
+Счетчики копятся в памяти процесса и периодически сбрасываются в таблицу
+code_popularity одним пакетным UPSERT (фоновый поток, см. start_flusher).
+Итоговые значения используются для ранжирования поиска и прогрева кэша.
+Список самых популярных кодов (hot) пересчитывается при загрузке и сбросе,
+а не на каждый запрос.
+"""
+import heapq
+import logging
+import math
+import threading
+from typing import Callable
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.models.popularity import CodePopularity
+
+logger = logging.getLogger(__name__)
+
+SELECTED = "selected"
+CALCULATED = "calculated"
+
+_UPSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
+
+
+class PopularityCounter:
+	def __init__(self):
+		self._lock = threading.Lock()
+		# Еще не сброшенные в БД приращения: код -> [выбран, посчитан]
+		self._pending: dict[str, list[int]] = {}
+		# Итог (БД + pending) по коду
+		self._totals: dict[str, int] = {}
+		self._max_total = 0
+		# Самые популярные коды по убыванию (см. _refresh_hot)
+		self.hot: tuple[str, ...] = ()
+		self.flushed_rows = 0
+
+	def record(self, code: str, kind: str = SELECTED) -> None:
+		if not code:
+			return
+		with self._lock:
+			pending = self._pending.get(code)
+			if pending is None:
+				pending = self._pending[code] = [0, 0]
+			pending[0 if kind == SELECTED else 1] += 1
+			total = self._totals.get(code, 0) + 1
+			self._totals[code] = total
+			if total > self._max_total:
+				self._max_total = total
+
+	def load(self, session: Session) -> None:
+		"""Читает накопленные счетчики из БД (при старте)"""
+		rows = session.exec(
+			select(CodePopularity.code, CodePopularity.selected_count + CodePopularity.calculated_count)
+		).all()
+		with self._lock:
+			totals = {code: total for code, total in rows}
+			# Приращения, накопленные до загрузки, не теряем
+			for code, (selected, calculated) in self._pending.items():
+				totals[code] = totals.get(code, 0) + selected + calculated
+			self._totals = totals
+			self._max_total = max(totals.values(), default=0)
+		self._refresh_hot()
+		logger.info(f"🔥 Популярность кодов загружена: {len(rows)} кодов")
+
+	def flush(self, session: Session) -> int:
+		"""Сбрасывает накопленные приращения в БД одним пакетом, возвращает число кодов"""
+		with self._lock:
+			pending, self._pending = self._pending, {}
+		if not pending:
+			return 0
+		self._refresh_hot()
+
+		rows = [{"code": code, "selected_count": s, "calculated_count": c} for code, (s, c) in pending.items()]
+		try:
+			upsert = _UPSERTS.get(session.get_bind().dialect.name)
+			if upsert is not None:
+				stmt = upsert(CodePopularity).values(rows)
+				stmt = stmt.on_conflict_do_update(
+					index_elements=[CodePopularity.code],
+					set_={
+						"selected_count": CodePopularity.selected_count + stmt.excluded.selected_count,
+						"calculated_count": CodePopularity.calculated_count + stmt.excluded.calculated_count,
+						"updated_at": func.now(),
+					}
+				)
+				session.exec(stmt)
+			else:
+				for row in rows:
+					item = session.get(CodePopularity, row["code"]) or CodePopularity(code=row["code"])
+					item.selected_count = (item.selected_count or 0) + row["selected_count"]
+					item.calculated_count = (item.calculated_count or 0) + row["calculated_count"]
+					session.add(item)
+			session.commit()
+		except Exception:
+			session.rollback()
+			# Возвращаем приращения, чтобы не потерять их до следующей попытки
+			with self._lock:
+				for code, (s, c) in pending.items():
+					current = self._pending.setdefault(code, [0, 0])
+					current[0] += s
+					current[1] += c
+			raise
+		self.flushed_rows += len(rows)
+		return len(rows)
+
+	def count(self, code: str) -> int:
+		return self._totals.get(code, 0)
+
+	def boost(self, code: str, weight: float) -> float:
+		"""Надбавка к оценке (0..weight) по логарифму популярности относительно самого популярного"""
+		total = self._totals.get(code)
+		if not total or self._max_total <= 0:
+			return 0.0
+		return weight * math.log1p(total) / math.log1p(self._max_total)
+
+	def hottest(self, n: int) -> list[str]:
+		with self._lock:
+			items = list(self._totals.items())
+		return [code for code, _ in heapq.nlargest(n, items, key=lambda item: item[1])]
+
+	def _refresh_hot(self) -> None:
+		self.hot = tuple(self.hottest(settings.POPULARITY_HOT_CODES))
+
+	def stats(self) -> dict:
+		with self._lock:
+			return {
+				"codes": len(self._totals),
+				"pending_codes": len(self._pending),
+				"flushed_rows": self.flushed_rows,
+				"max_total": self._max_total,
+			}
+
+
+popularity = PopularityCounter()
+
+
+def start_flusher(engine: Engine, interval: float) -> Callable[[], None]:
+	"""
+	Фоновый сброс счетчиков раз в interval секунд.
+	Возвращает функцию остановки: она делает финальный сброс и ждет поток.
+	"""
+	stop_event = threading.Event()
+
+	def run():
+		while True:
+			stopped = stop_event.wait(interval)
+			try:
+				with Session(engine) as session:
+					popularity.flush(session)
+			except Exception as e:
+				logger.error(f"❌ Не удалось сохранить популярность кодов: {e}")
+			if stopped:
+				return
+
+	thread = threading.Thread(target=run, name="popularity-flusher", daemon=True)
+	thread.start()
+
+	def stop(timeout: float = 10.0) -> None:
+		stop_event.set()
+		thread.join(timeout)
+
+	return stop
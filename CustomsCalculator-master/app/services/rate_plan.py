@@ -0,0 +1,111 @@
+# app/services/rate_plan.py
+"""
+Скомпилированный план расчета ставки (пошлины или акциза).
+
+Разбор единицы измерения, валюты и вида ставки делается один раз
+(при сборке снимка), а расчет сводится к нескольким умножениям.
+"""
+from functools import lru_cache
+from typing import Optional
+
+from app.services.units import VOLUME_M3, unit_quantity
+
+MODE_NONE, MODE_AD_VALOREM, MODE_SPECIFIC, MODE_COMBINED, MODE_MIXED = range(5)
+_MODES = {
+	"ad_valorem": MODE_AD_VALOREM,
+	"specific": MODE_SPECIFIC,
+	"combined": MODE_COMBINED,
+	"mixed": MODE_MIXED,
+	"mixed_min": MODE_MIXED,
+}
+
+
+class RatePlan:
+	__slots__ = ("mode", "ad_valorem_pct", "specific_rate", "is_uzs", "field", "mult", "div", "description")
+
+	def __init__(self, mode: int, ad_valorem_pct: float, specific_rate: float, is_uzs: bool,
+	             field: Optional[str], mult: float, div: float, description: str):
+		self.mode = mode
+		self.ad_valorem_pct = ad_valorem_pct
+		# 0.0 - специфической части нет
+		self.specific_rate = specific_rate
+		self.is_uzs = is_uzs
+		# None - единица не поддерживается, количество = 0
+		self.field = field
+		self.mult = mult
+		self.div = div
+		self.description = description
+
+	def quantity(self, inputs: dict) -> float:
+		if self.field is None:
+			return 0.0
+		if self.field == VOLUME_M3:
+			# Если ставка за кубометр (лес, газ), а ввод в см3, конвертируем
+			volume = inputs['volume']
+			return volume / 1_000_000 if volume > 100 else volume
+		return inputs[self.field] * self.mult / self.div
+
+	def evaluate(self, base_value_usd: float, inputs: dict, usd_rate: float) -> tuple[float, str]:
+		# 1. Адвалорная часть
+		ad_valorem_amt = base_value_usd * (self.ad_valorem_pct / 100)
+
+		# 2. Специфическая часть
+		specific_amt = 0.0
+		if self.specific_rate:
+			rate_in_usd = self.specific_rate / usd_rate if self.is_uzs else self.specific_rate
+			specific_amt = self.quantity(inputs) * rate_in_usd
+
+		# 3. Итог
+		mode = self.mode
+		if mode == MODE_AD_VALOREM:
+			return ad_valorem_amt, self.description
+		if mode == MODE_SPECIFIC:
+			return specific_amt, self.description
+		if mode == MODE_COMBINED:
+			return ad_valorem_amt + specific_amt, self.description
+		if mode == MODE_MIXED:
+			return max(ad_valorem_amt, specific_amt), self.description
+		return 0.0, self.description
+
+	def crossover(self, inputs: dict, usd_rate: float) -> Optional[float]:
+		"""
+		Стоимость, на которой у смешанной ставки адвалорная часть догоняет специфическую
+		(точка излома max()). None - излома нет.
+		"""
+		if self.mode != MODE_MIXED or not self.specific_rate or self.ad_valorem_pct <= 0:
+			return None
+		rate_in_usd = self.specific_rate / usd_rate if self.is_uzs else self.specific_rate
+		specific_amt = self.quantity(inputs) * rate_in_usd
+		return specific_amt * 100 / self.ad_valorem_pct if specific_amt > 0 else None
+
+
+@lru_cache(maxsize=4096, typed=True)
+def compile_rate_plan(type_enum, ad_valorem_pct: float, specific_rate: float | None,
+                      specific_currency: str, specific_unit: str | None) -> RatePlan:
+	"""Компилирует параметры ставки в план (одинаковые ставки делят один план)"""
+	mode = _MODES.get(getattr(type_enum, "value", type_enum), MODE_NONE)
+	u = specific_unit
+	curr = "сум" if specific_currency == "UZS" else "$"
+
+	if mode == MODE_AD_VALOREM:
+		description = f"{ad_valorem_pct}%"
+	elif mode == MODE_SPECIFIC:
+		description = f"{specific_rate} {curr}/{u}"
+	elif mode == MODE_COMBINED:
+		description = f"{ad_valorem_pct}% + {specific_rate} {curr}/{u}"
+	elif mode == MODE_MIXED:
+		description = f"{ad_valorem_pct}%, но не менее {specific_rate} {curr}/{u}"
+	else:
+		description = ""
+
+	quantity = unit_quantity(u) if specific_rate else None
+	return RatePlan(
+		mode=mode,
+		ad_valorem_pct=ad_valorem_pct,
+		specific_rate=specific_rate if specific_rate else 0.0,
+		is_uzs=specific_currency == "UZS",
+		field=quantity.field if quantity else None,
+		mult=quantity.mult if quantity else 1,
+		div=quantity.div if quantity else 1,
+		description=description,
+	)
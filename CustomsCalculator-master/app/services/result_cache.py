@@ -0,0 +1,125 @@
+# app/services/result_cache.py
+"""
+Кэш результатов горячих запросов (поиск, расчет) на процесс.
+
+- LRU + TTL: не больше maxsize записей, каждая живет ttl секунд
+- single-flight: одновременные одинаковые запросы ждут одно вычисление,
+  а не считают каждый сам
+- ключи включают версию снимка тарифов, поэтому после синхронизации
+  старые записи просто перестают находиться и вытесняются LRU; записи,
+  которых изменения не касаются, переносятся на новую версию (carry_over)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+from app.core.config import settings
+
+
+class _Flight:
+	__slots__ = ("event", "value", "error")
+
+	def __init__(self):
+		self.event = threading.Event()
+		self.value = None
+		self.error: BaseException | None = None
+
+
+class ResultCache:
+	def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300.0,
+	             clock: Callable[[], float] = time.monotonic):
+		self.name = name
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._clock = clock
+		self._lock = threading.Lock()
+		# key -> (истекает в, значение)
+		self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+		self._inflight: dict[Hashable, _Flight] = {}
+		self.hits = 0
+		self.misses = 0
+		self.coalesced = 0
+
+	def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+		"""
+		Значение из кэша или результат compute().
+		Значение отдается всем вызывающим как есть: менять его нельзя.
+		Исключения не кэшируются (ожидающие получают то же исключение).
+		"""
+		with self._lock:
+			entry = self._data.get(key)
+			if entry is not None and entry[0] > self._clock():
+				self._data.move_to_end(key)
+				self.hits += 1
+				return entry[1]
+			flight = self._inflight.get(key)
+			leader = flight is None
+			if leader:
+				flight = self._inflight[key] = _Flight()
+				self.misses += 1
+			else:
+				self.coalesced += 1
+
+		if not leader:
+			flight.event.wait()
+			if flight.error is not None:
+				raise flight.error
+			return flight.value
+
+		try:
+			flight.value = compute()
+		except BaseException as e:
+			flight.error = e
+			raise
+		else:
+			with self._lock:
+				self._data[key] = (self._clock() + self.ttl, flight.value)
+				self._data.move_to_end(key)
+				while len(self._data) > self.maxsize:
+					self._data.popitem(last=False)
+			return flight.value
+		finally:
+			with self._lock:
+				self._inflight.pop(key, None)
+			flight.event.set()
+
+	def carry_over(self, old_version: int, new_version: int, keep: Callable[[tuple], bool]) -> int:
+		"""
+		Переносит живые записи версии снимка old_version на new_version (ключ - кортеж
+		с версией первым элементом), если keep(ключ) истинно. Срок жизни не продлевается.
+		Возвращает число перенесенных записей.
+		"""
+		now = self._clock()
+		with self._lock:
+			moved = [
+				((new_version, *key[1:]), entry) for key, entry in self._data.items()
+				if isinstance(key, tuple) and key and key[0] == old_version and entry[0] > now and keep(key)
+			]
+			for key, entry in moved:
+				self._data.setdefault(key, entry)
+			while len(self._data) > self.maxsize:
+				self._data.popitem(last=False)
+		return len(moved)
+
+	def clear(self) -> None:
+		with self._lock:
+			self._data.clear()
+
+	def stats(self) -> dict:
+		with self._lock:
+			total = self.hits + self.misses + self.coalesced
+			return {
+				"size": len(self._data),
+				"maxsize": self.maxsize,
+				"ttl_seconds": self.ttl,
+				"hits": self.hits,
+				"misses": self.misses,
+				# Запросы, дождавшиеся чужого вычисления (тоже без собственного расчета)
+				"coalesced": self.coalesced,
+				"hit_ratio": round((self.hits + self.coalesced) / total, 4) if total else None,
+			}
+
+
+search_cache = ResultCache("search", maxsize=settings.RESULT_CACHE_SIZE, ttl=settings.RESULT_CACHE_TTL)
+calculation_cache = ResultCache("calculation", maxsize=settings.RESULT_CACHE_SIZE, ttl=settings.RESULT_CACHE_TTL)
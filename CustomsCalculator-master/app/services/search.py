@@ -1,34 +1,115 @@
 # app/services/search.py
 
-from sqlalchemy import func, desc
+from typing import Iterable, Iterator
+
+from sqlalchemy import column, desc, func, text, union
 from sqlmodel import Session, select
-from sqlalchemy.orm import selectinload
 
+from app.core.config import settings
+from app.models.rates import TariffRate
 from app.models.tnved import TnVedCode
+from app.services.popularity import popularity
+from app.services.rate_plan import compile_rate_plan
+from app.services.result_cache import search_cache
+from app.services.snapshot import CodeEntry, TariffSnapshot, get_snapshot
+from app.services.tariff_versions import active_version_filter
+from app.services.semantic_index import get_semantic_index
 
 
 def search_tnved_smart(session: Session, query: str, limit: int = 20):
+	"""
+	Поиск с кэшем результатов: в кэше лежат пары (код, оценка) под ключом
+	(версия снимка, бэкенд, нормализованный запрос, limit), объекты кодов
+	берутся из текущего снимка. Одинаковые одновременные запросы считаются один раз.
+	
+	Популярные коды поднимаются поверх кэша (см. rank_by_popularity), поэтому
+	для текста в кэше лежит запас кандидатов (limit * 2). Для Postgres рядом с
+	процентом совпадения хранится смешанная оценка, по которой идет сортировка.
+	
+	Возвращает список кортежей: (CodeEntry, similarity_score)
+	"""
+	snapshot = get_snapshot(session)
+	# Регистр и лишние пробелы на результат не влияют (pg_trgm и tsvector их игнорируют)
+	normalized = " ".join(query.lower().split())
+	fetch = limit if normalized.isdigit() or settings.SEARCH_POPULARITY_BOOST <= 0 else limit * 2
+	key = (snapshot.version, settings.SEARCH_BACKEND, normalized, fetch)
+	
+	found = search_cache.get_or_compute(
+		key, lambda: tuple((item.code, *scores) for item, *scores in _search_tnved(session, normalized, fetch))
+	)
+	found = rank_by_popularity(snapshot, normalized, found, limit)
+	return [(snapshot.codes[code], score) for code, score, *_ in found if code in snapshot.codes]
+
+
+def rank_by_popularity(snapshot: TariffSnapshot, query: str,
+                       found: Iterable[tuple], limit: int) -> list[tuple]:
+	"""
+	Учитывает популярность кодов (сколько раз их выбирали и считали).
+	Элементы: (код, процент совпадения) или (код, процент, оценка для сортировки).
+	- цифры: популярные коды под префиксом идут первыми (по убыванию популярности),
+	  затем остальные по порядку кода
+	- текст: сортировка по оценке (последний элемент) + надбавка (до SEARCH_POPULARITY_BOOST),
+	  в ответе остается исходный процент совпадения
+	"""
+	found = list(found)
+	weight = float(settings.SEARCH_POPULARITY_BOOST)
+	if weight <= 0 or not found:
+		return found[:limit]
+	
+	if query.isdigit():
+		hot = [(code, 100.0) for code in popularity.hot if code.startswith(query) and code in snapshot.codes]
+		if not hot:
+			return found[:limit]
+		seen = {code for code, _ in hot}
+		return (hot + [item for item in found if item[0] not in seen])[:limit]
+	
+	found.sort(key=lambda item: item[-1] + popularity.boost(item[0], weight), reverse=True)
+	return found[:limit]
+
+
+def carry_over_search(old: TariffSnapshot | None, new: TariffSnapshot) -> int:
+	"""
+	Переносит кэш поиска на новый снимок, если изменились только ставки: в кэше лежат
+	пары (код, оценка), а коды со ставками берутся из текущего снимка при чтении.
+	Вызывать только когда описания (в т.ч. узбекские - они в полнотекстовом индексе) не менялись.
+	"""
+	if old is None:
+		return 0
+	return search_cache.carry_over(old.version, new.version, lambda key: True)
+
+
+def prewarm_search_cache(session: Session, codes: Iterable[str], limit: int = 20) -> int:
+	"""
+	Прогрев кэша поиска при старте: запросы по группе (4 знака) и субпозиции (6 знаков)
+	самых популярных кодов. Возвращает число выполненных запросов.
+	"""
+	prefixes = dict.fromkeys(code[:length] for code in codes for length in (4, 6) if len(code) >= length)
+	for prefix in prefixes:
+		search_tnved_smart(session, prefix, limit)
+	return len(prefixes)
+
+
+def _search_tnved(session: Session, query: str, limit: int = 20):
 	"""
 	Выполняет поиск:
 	1. Если query - цифры: ищет по началу кода (точное совпадение = 100%).
-	2. Если query - текст: ищет по схожести описания (Trigram Similarity).
+	2. Если query - текст: ищет по полнотекстовому индексу (русский стемминг + узбекское
+	   описание) и по схожести описания (Trigram Similarity), ранжирует по смеси оценок.
 
-	Возвращает список кортежей: (TnVedCode, similarity_score)
+	Возвращает список кортежей: (CodeEntry из снимка, similarity_score),
+	для текста в Postgres - (CodeEntry, similarity_score, смешанная оценка в процентах)
 	"""
 	query = query.strip()
 	
-	# Жадная загрузка ставок (чтобы не делать N+1 запросов)
-	# selectinload эффективен для отношений one-to-many
-	stmt = select(TnVedCode).options(selectinload(TnVedCode.rates))
+	if settings.SEARCH_BACKEND == "memory":
+		return search_tnved_memory(get_snapshot(session), query, limit)
 	
 	if query.isdigit():
 		# --- ЛОГИКА ДЛЯ КОДОВ ---
-		# Ищем коды, которые начинаются с введенных цифр
-		stmt = stmt.where(TnVedCode.code.startswith(query))
-		stmt = stmt.order_by(TnVedCode.code)
-		stmt = stmt.limit(limit)
-		
-		results = session.exec(stmt).all()
+		# Ищем коды, которые начинаются с введенных цифр, по отсортированному
+		# массиву кодов в снимке (бинарный поиск, без LIKE и запросов в БД).
+		# Ставки берутся из того же снимка.
+		results = get_snapshot(session).codes_by_prefix(query, limit)
 		
 		# Для кодов "схожесть" считаем условно:
 		# Если совпал полностью - 1.0, иначе просто 1.0 (так как мы нашли по startswith)
@@ -36,23 +117,177 @@ def search_tnved_smart(session: Session, query: str, limit: int = 20):
 		return [(item, 100.0) for item in results]
 	
 	else:
-		# --- ЛОГИКА ДЛЯ ТЕКСТА (Fuzzy Search) ---
-		# Используем функцию similarity из pg_trgm
-		# similarity возвращает число от 0 до 1
-		similarity_score = func.similarity(TnVedCode.description, query).label("score")
-		
-		stmt = select(TnVedCode, similarity_score)
-		
-		# Фильтруем совсем плохие совпадения (например, меньше 10%)
-		# Можно настроить порог под себя (0.1, 0.2, 0.3)
-		stmt = stmt.where(similarity_score > 0.05)
-		
-		# Сортируем: сначала самые похожие
-		stmt = stmt.order_by(desc(similarity_score))
-		stmt = stmt.limit(limit)
-		
-		results = session.exec(stmt).all()
+		# --- ЛОГИКА ДЛЯ ТЕКСТА (полнотекстовый + Fuzzy Search) ---
+		# Из БД нужны только коды и оценки: описания и ставки берутся из снимка
+		snapshot = get_snapshot(session)
+		results = session.exec(_text_search_statement(session, query, limit, TnVedCode.code)).all()
 		
-		# results будет списком кортежей [(TnVedCode, 0.85), (TnVedCode, 0.42), ...]
+		# results будет списком кортежей [("8703231981", 0.85, 0.6), ("0402", 0.42, 0.3), ...]
 		# Преобразуем 0.85 -> 85.0 для удобства
-		return [(item, round(score * 100, 1)) for item, score in results]
\ No newline at end of file
+		return [
+			(snapshot.codes[code], _percent(score), _percent(rank))
+			for code, score, rank in results if code in snapshot.codes
+		]
+
+
+def _text_search_statement(session: Session, query: str, limit: int, *columns):
+	"""
+	SELECT columns + score + rank для текстового поиска: top-limit по rank.
+	score - similarity описания (match_percentage, как у поиска в памяти),
+	rank - смесь ts_rank_cd и similarity (только для сортировки).
+	Кандидаты - два ограниченных набора, каждый в порядке своего индекса:
+	- GiST по триграммам: ближайшие по description <-> query (KNN, без сортировки всех совпадений)
+	- GIN по search_vector: совпадения @@ с наибольшим ts_rank_cd
+	Смешанная оценка считается только по их объединению.
+	"""
+	# Полнотекстовый запрос: русский со стеммингом ИЛИ слова как есть (узбекское описание)
+	ts_query = func.plainto_tsquery("russian", query).op("||")(func.plainto_tsquery("simple", query))
+	search_vector = column("search_vector")
+	# ts_rank_cd с нормализацией 32 (rank / (rank + 1)) лежит в 0..1, как и similarity
+	fts_rank = func.ts_rank_cd(search_vector, ts_query, 32)
+	
+	# Используем функцию similarity из pg_trgm
+	# similarity возвращает число от 0 до 1
+	similarity_score = func.similarity(TnVedCode.description, query)
+	
+	fts_weight = float(settings.SEARCH_FTS_WEIGHT)
+	rank = (fts_weight * fts_rank + (1 - fts_weight) * similarity_score).label("rank")
+	
+	# Порог для оператора % (вместо similarity > X: оператор умеет ходить в GiST-индекс).
+	# SET LOCAL действует только до конца текущей транзакции
+	threshold = float(settings.SEARCH_SIMILARITY_THRESHOLD)
+	session.exec(text(f"SET LOCAL pg_trgm.similarity_threshold = {threshold}"))
+	
+	per_index = max(limit, int(settings.SEARCH_CANDIDATES_PER_INDEX))
+	nearest = (
+		select(TnVedCode.id)
+		.where(TnVedCode.description.op("%")(query))
+		.order_by(TnVedCode.description.op("<->")(query))
+		.limit(per_index)
+	)
+	matched = (
+		select(TnVedCode.id)
+		.where(search_vector.op("@@")(ts_query))
+		.order_by(desc(fts_rank))
+		.limit(per_index)
+	)
+	candidates = union(nearest, matched).subquery("candidates")
+	
+	stmt = select(*columns, similarity_score.label("score"), rank).join(candidates, candidates.c.id == TnVedCode.id)
+	
+	# Сортируем по смешанной оценке: сначала самые похожие
+	return stmt.order_by(desc(rank)).limit(limit)
+
+
+def _percent(score: float) -> float:
+	"""Оценка 0..1 из БД -> проценты с одним знаком"""
+	return round(min(score, 1.0) * 100, 1)
+
+
+def compact_entry(entry: CodeEntry, score: float) -> dict:
+	"""Строка компактной выдачи из снимка (код, описание, основная ставка)"""
+	rate = entry.rates[0] if entry.rates else None
+	return {
+		"code": entry.code,
+		"description": entry.description,
+		"unit": entry.unit,
+		"match_percentage": score,
+		"duty_rate": rate.duty_plan.description if rate else None,
+	}
+
+
+def search_tnved_compact(session: Session, query: str, limit: int = 20) -> list[dict]:
+	"""
+	Компактная выдача для подсказок (view=compact): код, описание, единица, процент
+	совпадения и основная ставка пошлины строкой.
+	В БД выбираются только нужные колонки кортежами - без ORM-объектов и без подгрузки ставок.
+	"""
+	query = query.strip()
+	
+	if settings.SEARCH_BACKEND == "memory" or query.isdigit():
+		# Снимок в памяти - ORM-объектов там и так нет
+		return [compact_entry(item, score) for item, score in search_tnved_smart(session, query, limit)]
+	
+	# Запас кандидатов под надбавку за популярность (как в search_tnved_smart)
+	weight = float(settings.SEARCH_POPULARITY_BOOST)
+	stmt = _text_search_statement(
+		session, query, limit * 2 if weight > 0 else limit,
+		TnVedCode.code, TnVedCode.description, TnVedCode.unit,
+		TariffRate.rate_type, TariffRate.ad_valorem_rate, TariffRate.specific_rate,
+		TariffRate.specific_currency, TariffRate.specific_unit,
+	).outerjoin(TariffRate, (TariffRate.tn_ved_code_id == TnVedCode.id) & active_version_filter())
+	
+	results = []
+	ranks = {}
+	for code, description, unit, rate_type, ad_valorem, specific, currency, specific_unit, score, rank in session.exec(stmt):
+		ranks[code] = _percent(rank)
+		results.append({
+			"code": code,
+			"description": description,
+			"unit": unit,
+			"match_percentage": _percent(score),
+			# План кэшируется по параметрам ставки, описание строится один раз
+			"duty_rate": compile_rate_plan(rate_type, ad_valorem, specific, currency, specific_unit).description
+			if rate_type is not None else None,
+		})
+	if weight > 0:
+		results.sort(key=lambda row: ranks[row["code"]] + popularity.boost(row["code"], weight), reverse=True)
+	return results[:limit]
+
+
+def search_tnved_memory(snapshot: TariffSnapshot, query: str, limit: int = 20):
+	"""
+	Тот же поиск по снимку в памяти: без запросов в БД и без pg_trgm.
+	Возвращает список кортежей: (CodeEntry, similarity_score)
+	"""
+	query = query.strip()
+	
+	if query.isdigit():
+		return [(item, 100.0) for item in snapshot.codes_by_prefix(query, limit)]
+	
+	index = snapshot.search_index
+	
+	results = index.search(query, limit=limit, threshold=settings.SEARCH_SIMILARITY_THRESHOLD)
+	return [(snapshot.codes[code], round(score * 100, 1)) for code, score in results]
+
+
+def classify_lines(snapshot: TariffSnapshot, queries: Iterable[str],
+                   limit: int = 5) -> Iterator[list[tuple[CodeEntry, float]]]:
+	"""
+	Подбор кодов для пачки описаний (строки инвойса): по списку кандидатов на строку,
+	в порядке строк. Текстовые строки проходят через один общий проход по индексу
+	(search_many), строки из цифр ищутся по префиксу кода.
+	Результаты отдаются по мере готовности (генератор).
+	"""
+	index = snapshot.search_index
+	
+	queries = [q.strip() for q in queries]
+	text_results = index.search_many(
+		(q for q in queries if not q.isdigit()),
+		limit=limit, threshold=settings.SEARCH_SIMILARITY_THRESHOLD
+	)
+	for query in queries:
+		if query.isdigit():
+			yield [(item, 100.0) for item in snapshot.codes_by_prefix(query, limit)]
+		else:
+			yield [(snapshot.codes[code], round(score * 100, 1)) for code, score in next(text_results)]
+
+
+def search_tnved_semantic(snapshot: TariffSnapshot, query: str, limit: int = 20):
+	"""
+	Поиск по TF-IDF индексу символьных n-грамм (mode=semantic): находит описания
+	с другими формами слов и другим порядком слов. Коды берутся из снимка.
+	Возвращает список кортежей: (CodeEntry, similarity_score) или None, если индекс не собран.
+	"""
+	query = query.strip()
+	
+	if query.isdigit():
+		return [(item, 100.0) for item in snapshot.codes_by_prefix(query, limit)]
+	
+	index = get_semantic_index()
+	if index is None:
+		return None
+	
+	results = index.search(query, limit=limit, min_score=settings.SEARCH_SIMILARITY_THRESHOLD)
+	# Коды, которых уже нет в справочнике (индекс старше снимка), пропускаем
+	return [(snapshot.codes[code], round(score * 100, 1)) for code, score in results if code in snapshot.codes]
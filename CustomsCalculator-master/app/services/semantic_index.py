@@ -0,0 +1,166 @@
+# app/services/semantic_index.py
+"""
+TF-IDF по хешированным символьным n-граммам описаний ТН ВЭД (режим mode=semantic).
+
+Индекс строится офлайн (scripts/build_semantic_index.py) и хранится набором .npy
+в settings.TNVED_DIR / "semantic". Матрица лежит по столбцам (как scipy CSC):
+для каждого признака - список документов с весами, поэтому запрос читает
+только столбцы своих n-грамм. Файлы открываются через mmap и не копируются в память.
+
+Символьные n-граммы внутри слов ловят разные формы слова и перестановку слов,
+чего не дает сравнение описаний целиком.
+"""
+import json
+import logging
+import math
+import re
+import threading
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+N_FEATURES = 1 << 18
+NGRAM_RANGE = (3, 5)
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_FILES = ("indptr", "indices", "data", "idf", "codes")
+
+
+def default_index_dir() -> Path:
+	return settings.TNVED_DIR / "semantic"
+
+
+def ngram_features(text: str) -> dict[int, int]:
+	"""Хешированные символьные n-граммы слов (" слово "): признак -> число вхождений"""
+	counts: dict[int, int] = {}
+	low, high = NGRAM_RANGE
+	for word in _WORD_RE.findall(text.lower()):
+		padded = f" {word} "
+		for n in range(low, high + 1):
+			for i in range(len(padded) - n + 1):
+				# crc32 стабилен между процессами (в отличие от hash())
+				feature = zlib.crc32(padded[i:i + n].encode()) % N_FEATURES
+				counts[feature] = counts.get(feature, 0) + 1
+	return counts
+
+
+def _weights(counts: dict[int, int], idf: np.ndarray) -> dict[int, float]:
+	"""Сублинейный tf * idf с L2-нормировкой"""
+	weights = {f: (1 + math.log(tf)) * float(idf[f]) for f, tf in counts.items()}
+	norm = math.sqrt(sum(w * w for w in weights.values()))
+	return {f: w / norm for f, w in weights.items()} if norm else {}
+
+
+def build_semantic_index(docs: Iterable[tuple[str, str]], out_dir: Path | None = None) -> Path:
+	"""Строит матрицу TF-IDF по (код, описание) и сохраняет ее в out_dir"""
+	out_dir = Path(out_dir or default_index_dir())
+	out_dir.mkdir(parents=True, exist_ok=True)
+
+	codes: list[str] = []
+	doc_counts: list[dict[int, int]] = []
+	df = np.zeros(N_FEATURES, dtype=np.int32)
+	for code, text in docs:
+		counts = ngram_features(text or "")
+		codes.append(code)
+		doc_counts.append(counts)
+		if counts:
+			df[np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))] += 1
+
+	n_docs = len(codes)
+	idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+
+	# Тройки (признак, документ, вес) -> сортировка по признаку = CSC
+	features, doc_ids, data = [], [], []
+	for doc_id, counts in enumerate(doc_counts):
+		for feature, weight in _weights(counts, idf).items():
+			features.append(feature)
+			doc_ids.append(doc_id)
+			data.append(weight)
+	features = np.asarray(features, dtype=np.int64)
+	order = np.argsort(features, kind="stable")
+	indptr = np.zeros(N_FEATURES + 1, dtype=np.int64)
+	np.cumsum(np.bincount(features, minlength=N_FEATURES), out=indptr[1:])
+
+	np.save(out_dir / "indptr.npy", indptr)
+	np.save(out_dir / "indices.npy", np.asarray(doc_ids, dtype=np.int32)[order])
+	np.save(out_dir / "data.npy", np.asarray(data, dtype=np.float32)[order])
+	np.save(out_dir / "idf.npy", idf)
+	np.save(out_dir / "codes.npy", np.asarray(codes, dtype="U10"))
+	(out_dir / "meta.json").write_text(json.dumps({
+		"built_at": datetime.now().isoformat(timespec="seconds"),
+		"documents": n_docs,
+		"n_features": N_FEATURES,
+		"ngram_range": list(NGRAM_RANGE),
+		"nnz": int(len(order)),
+	}))
+	logger.info(f"🧭 Семантический индекс: {n_docs} описаний, {len(order)} весов -> {out_dir}")
+	return out_dir
+
+
+class SemanticIndex:
+	def __init__(self, index_dir: Path):
+		meta = json.loads((index_dir / "meta.json").read_text())
+		if meta["n_features"] != N_FEATURES or tuple(meta["ngram_range"]) != NGRAM_RANGE:
+			raise ValueError(f"Индекс {index_dir} собран с другими параметрами, пересоберите его")
+		self.meta = meta
+		arrays = {name: np.load(index_dir / f"{name}.npy", mmap_mode="r") for name in _FILES}
+		self.indptr = arrays["indptr"]
+		self.indices = arrays["indices"]
+		self.data = arrays["data"]
+		self.idf = arrays["idf"]
+		self.codes = arrays["codes"]
+
+	def __len__(self) -> int:
+		return len(self.codes)
+
+	def search(self, query: str, limit: int = 20, min_score: float = 0.05) -> list[tuple[str, float]]:
+		"""Top-k по косинусной близости: [(код, 0..1), ...]"""
+		weights = _weights(ngram_features(query), self.idf)
+		if not weights or limit <= 0:
+			return []
+
+		doc_ids, contrib = [], []
+		for feature, weight in weights.items():
+			start, end = self.indptr[feature], self.indptr[feature + 1]
+			if start != end:
+				doc_ids.append(self.indices[start:end])
+				contrib.append(self.data[start:end] * weight)
+		if not doc_ids:
+			return []
+
+		scores = np.bincount(np.concatenate(doc_ids), weights=np.concatenate(contrib), minlength=len(self.codes))
+		candidates = np.flatnonzero(scores >= min_score)
+		if len(candidates) > limit:
+			candidates = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+		candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+		return [(str(self.codes[i]), float(scores[i])) for i in candidates]
+
+
+_index: SemanticIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_semantic_index() -> SemanticIndex | None:
+	"""Индекс из default_index_dir() (None - индекс еще не собран)"""
+	global _index
+	if _index is None:
+		with _index_lock:
+			if _index is None:
+				index_dir = default_index_dir()
+				if not (index_dir / "meta.json").exists():
+					return None
+				_index = SemanticIndex(index_dir)
+	return _index
+
+
+def reset_semantic_index() -> None:
+	"""Сбрасывает открытый индекс (после импорта справочника и обновления снимка)"""
+	global _index
+	_index = None
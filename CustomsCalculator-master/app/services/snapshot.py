@@ -0,0 +1,318 @@
+# app/services/snapshot.py
+"""
+Неизменяемый снимок тарифной базы в памяти процесса.
+
+Снимок загружается из БД один раз (при старте или после синхронизации)
+и целиком подменяется новым объектом. Расчет по снимку не делает ни одного
+запроса в БД.
+"""
+import itertools
+import logging
+from bisect import bisect_left
+import threading
+from dataclasses import dataclass, replace
+from datetime import date, datetime
+from types import MappingProxyType
+from typing import Any, Iterable, Mapping, Optional
+
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.models import TariffRate, TnVedCode
+from app.models.country import Country, TradeRegimeType
+from app.services.currency_cache import currency_cache
+from app.services.rate_plan import RatePlan, compile_rate_plan
+from app.services.semantic_index import reset_semantic_index
+from app.services.tariff_versions import active_version_filter
+from app.services.trigram_index import TrigramIndex
+
+logger = logging.getLogger(__name__)
+
+# Курс по умолчанию, если в БД еще нет ни одного курса USD
+DEFAULT_USD_RATE = 12850.0
+
+_versions = itertools.count(1)
+
+
+@dataclass(frozen=True, slots=True)
+class RateEntry:
+	"""Копия строки TariffRate, отвязанная от сессии"""
+	id: int
+	tn_ved_code_id: int
+	rate_type: str
+	ad_valorem_rate: float
+	specific_rate: Optional[float]
+	specific_currency: str
+	specific_unit: Optional[str]
+	excise_type: str
+	excise_ad_valorem_rate: float
+	excise_specific_rate: Optional[float]
+	excise_currency: str
+	excise_unit: Optional[str]
+	vat_rate: float
+	source_code: Optional[str] = None
+	# Скомпилированные планы расчета пошлины и акциза
+	duty_plan: Optional[RatePlan] = None
+	excise_plan: Optional[RatePlan] = None
+
+	@classmethod
+	def from_model(cls, rate: TariffRate) -> "RateEntry":
+		return cls(
+			id=rate.id,
+			tn_ved_code_id=rate.tn_ved_code_id,
+			rate_type=rate.rate_type,
+			ad_valorem_rate=rate.ad_valorem_rate,
+			specific_rate=rate.specific_rate,
+			specific_currency=rate.specific_currency,
+			specific_unit=rate.specific_unit,
+			excise_type=rate.excise_type,
+			excise_ad_valorem_rate=rate.excise_ad_valorem_rate,
+			excise_specific_rate=rate.excise_specific_rate,
+			excise_currency=rate.excise_currency,
+			excise_unit=rate.excise_unit,
+			vat_rate=rate.vat_rate,
+			source_code=rate.source_code,
+			duty_plan=compile_rate_plan(rate.rate_type, rate.ad_valorem_rate, rate.specific_rate,
+			                            rate.specific_currency, rate.specific_unit),
+			excise_plan=compile_rate_plan(rate.excise_type, rate.excise_ad_valorem_rate, rate.excise_specific_rate,
+			                              rate.excise_currency, rate.excise_unit),
+		)
+
+
+@dataclass(frozen=True, slots=True)
+class CodeEntry:
+	"""Копия строки TnVedCode вместе с её ставками"""
+	id: int
+	code: str
+	description: str
+	unit: Optional[str]
+	unit2: Optional[str]
+	parent_code: Optional[str]
+	is_util_applicable: bool
+	calc_metadata: Mapping[str, Any]
+	rates: tuple[RateEntry, ...] = ()
+	description_uz: Optional[str] = None
+
+	@classmethod
+	def from_model(cls, item: TnVedCode, rates: Iterable[RateEntry] = ()) -> "CodeEntry":
+		return cls(
+			id=item.id,
+			code=item.code,
+			description=item.description,
+			unit=item.unit,
+			unit2=item.unit2,
+			parent_code=item.parent_code,
+			is_util_applicable=item.is_util_applicable,
+			calc_metadata=MappingProxyType(dict(item.calc_metadata or {})),
+			rates=tuple(rates),
+			description_uz=item.description_uz,
+		)
+
+
+@dataclass(frozen=True, slots=True)
+class CountryEntry:
+	iso_code: str
+	name_ru: str
+	trade_regime: TradeRegimeType
+
+
+class LazySearchIndex:
+	"""
+	Триграммный индекс описаний, который собирается при первом обращении.
+	Общий для версий снимка с одним набором кодов (with_usd_rate), поэтому
+	собирается не чаще одного раза на загрузку.
+	"""
+	__slots__ = ("_codes", "_index", "_lock")
+
+	def __init__(self, codes: Mapping[str, "CodeEntry"]):
+		self._codes = codes
+		self._index: TrigramIndex | None = None
+		self._lock = threading.Lock()
+
+	@property
+	def built(self) -> bool:
+		return self._index is not None
+
+	def get(self) -> TrigramIndex:
+		if self._index is None:
+			with self._lock:
+				if self._index is None:
+					self._index = TrigramIndex((c.code, c.description) for c in self._codes.values())
+		return self._index
+
+
+@dataclass(frozen=True, slots=True)
+class TariffSnapshot:
+	"""
+	Версионированный снимок: коды ТН ВЭД со ставками, режимы стран и курс USD.
+	"""
+	version: int
+	loaded_at: datetime
+	usd_rate: float
+	codes: Mapping[str, CodeEntry]
+	countries: Mapping[str, CountryEntry]
+	# Дата курса USD (None - курса нет, используется DEFAULT_USD_RATE)
+	usd_rate_date: Optional[date] = None
+	# Триграммный индекс описаний: собирается при первом поиске (см. search_index)
+	lazy_search_index: Optional[LazySearchIndex] = None
+	# Отсортированные коды: поиск по префиксу - диапазон бинарным поиском
+	sorted_codes: tuple[str, ...] = ()
+
+	@classmethod
+	def build(cls, codes: Iterable[TnVedCode], rates: Iterable[TariffRate],
+	          countries: Iterable[Country], usd_rate: float | None,
+	          usd_rate_date: date | None = None, with_search_index: bool = False) -> "TariffSnapshot":
+		"""Собирает снимок из уже загруженных строк (без обращения к БД)"""
+		rates_by_code: dict[int, list[RateEntry]] = {}
+		for rate in rates:
+			rates_by_code.setdefault(rate.tn_ved_code_id, []).append(RateEntry.from_model(rate))
+
+		code_map = {
+			item.code: CodeEntry.from_model(item, rates_by_code.get(item.id, ()))
+			for item in codes
+		}
+
+		country_map: dict[str, CountryEntry] = {}
+		for country in countries:
+			iso = country.iso_code.upper()
+			# Как и .first() в запросе: берем первую найденную запись по ISO
+			if iso not in country_map:
+				country_map[iso] = CountryEntry(iso, country.name_ru, country.trade_regime)
+
+		search_index = LazySearchIndex(code_map)
+		if with_search_index:
+			search_index.get()
+
+		return cls(
+			version=next(_versions),
+			loaded_at=datetime.now(),
+			usd_rate=usd_rate if usd_rate else DEFAULT_USD_RATE,
+			codes=MappingProxyType(code_map),
+			countries=MappingProxyType(country_map),
+			usd_rate_date=usd_rate_date if usd_rate else None,
+			lazy_search_index=search_index,
+			sorted_codes=tuple(sorted(code_map)),
+		)
+
+	@classmethod
+	def load(cls, session: Session) -> "TariffSnapshot":
+		"""Читает все нужные таблицы (по одному запросу на таблицу)"""
+		codes = session.exec(select(TnVedCode)).all()
+		# Только ставки активной версии: собираемая версия в снимок не попадает
+		rates = session.exec(select(TariffRate).where(active_version_filter()).order_by(TariffRate.id)).all()
+		countries = session.exec(select(Country).order_by(Country.id)).all()
+		usd_rate, usd_rate_date = currency_cache.latest("USD", session) or (None, None)
+		if not usd_rate:
+			currency_cache.record_fallback()
+			logger.warning(f"⚠️ Курс USD не найден, в снимке используется курс по умолчанию {DEFAULT_USD_RATE}")
+
+		# Поиск в памяти идет на каждый запрос - индекс сразу; иначе он нужен только classify
+		snapshot = cls.build(codes, rates, countries, usd_rate, usd_rate_date,
+		                     with_search_index=settings.SEARCH_BACKEND == "memory")
+		logger.info(
+			f"📦 Снимок тарифов v{snapshot.version}: {len(snapshot.codes)} кодов, "
+			f"{len(snapshot.countries)} стран, USD={snapshot.usd_rate}"
+		)
+		return snapshot
+
+	@property
+	def search_index(self) -> TrigramIndex:
+		"""Триграммный индекс описаний (собирается при первом обращении)"""
+		if self.lazy_search_index is None:
+			return TrigramIndex((c.code, c.description) for c in self.codes.values())
+		return self.lazy_search_index.get()
+
+	def with_usd_rate(self, usd_rate: float | None, usd_rate_date: date | None) -> "TariffSnapshot":
+		"""Новая версия снимка с другим курсом (тарифы переиспользуются)"""
+		return replace(
+			self,
+			version=next(_versions),
+			loaded_at=datetime.now(),
+			usd_rate=usd_rate if usd_rate else DEFAULT_USD_RATE,
+			usd_rate_date=usd_rate_date if usd_rate else None,
+		)
+
+	def find_rate(self, tn_code: str) -> tuple[RateEntry, CodeEntry] | None:
+		"""
+		То же наследование ставок, что и в DutyCalculator.get_rate_and_code_recursive:
+		код обрезается по 2 цифры, пока не найдется код со ставкой.
+		"""
+		code_to_search = tn_code.strip()
+		while len(code_to_search) >= 4:
+			entry = self.codes.get(code_to_search)
+			if entry and entry.rates:
+				return entry.rates[0], entry
+			code_to_search = code_to_search[:-2]
+		return None
+
+	def prefix_range(self, prefix: str) -> tuple[int, int]:
+		"""Границы [lo, hi) кодов с заданным префиксом в sorted_codes"""
+		lo = bisect_left(self.sorted_codes, prefix)
+		hi = bisect_left(self.sorted_codes, prefix + "\uffff", lo)
+		return lo, hi
+	
+	def count_prefix(self, prefix: str) -> int:
+		lo, hi = self.prefix_range(prefix)
+		return hi - lo
+	
+	def codes_by_prefix(self, prefix: str, limit: int = 20) -> list[CodeEntry]:
+		"""Первые limit кодов с префиксом (по возрастанию кода)"""
+		lo, hi = self.prefix_range(prefix)
+		return [self.codes[code] for code in self.sorted_codes[lo:min(hi, lo + max(limit, 0))]]
+	
+	def trade_regime(self, country_code: str | None) -> TradeRegimeType:
+		if not country_code:
+			return TradeRegimeType.GENERAL
+		country = self.countries.get(country_code.upper())
+		return country.trade_regime if country else TradeRegimeType.GENERAL
+
+
+# --- Текущий снимок процесса ---
+# Ссылка подменяется целиком, поэтому читатели всегда видят согласованный снимок.
+_current: TariffSnapshot | None = None
+_load_lock = threading.Lock()
+
+
+def get_snapshot(session: Session) -> TariffSnapshot:
+	"""Возвращает текущий снимок, при первом обращении загружает его из БД"""
+	snapshot = _current
+	if snapshot is None:
+		with _load_lock:
+			if _current is None:
+				publish_snapshot(TariffSnapshot.load(session))
+			snapshot = _current
+	return snapshot
+
+
+def current_snapshot() -> TariffSnapshot | None:
+	"""Текущий снимок без загрузки (None - еще не загружен)"""
+	return _current
+
+
+def publish_snapshot(snapshot: TariffSnapshot) -> TariffSnapshot:
+	"""Атомарно делает снимок текущим"""
+	global _current
+	_current = snapshot
+	return snapshot
+
+
+def refresh_snapshot(session: Session) -> TariffSnapshot:
+	"""Перечитывает БД и подменяет снимок (вызывается после синхронизаций)"""
+	with _load_lock:
+		snapshot = publish_snapshot(TariffSnapshot.load(session))
+	# Справочник мог смениться вместе с файлами семантического индекса: следующий запрос откроет их заново
+	reset_semantic_index()
+	return snapshot
+
+
+def refresh_usd_rate(session: Session) -> TariffSnapshot | None:
+	"""
+	Сбрасывает кэш валют и подставляет в текущий снимок свежий курс (после обновления курсов).
+	Если снимок еще не загружен, он возьмет курс при первой загрузке.
+	"""
+	currency_cache.invalidate()
+	with _load_lock:
+		if _current is None:
+			return None
+		usd_rate, usd_rate_date = currency_cache.latest("USD", session) or (None, None)
+		return publish_snapshot(_current.with_usd_rate(usd_rate, usd_rate_date))
@@ -0,0 +1,256 @@
+# app/services/tariff_versions.py
+"""
+Версии ставок и публикация без простоя.
+
+Версия хранит только изменения: строка tariff_rates действует с версии
+version_id и до версии retired_version_id (не включая; NULL - до сих пор).
+Ставки версии V - строки с version_id <= V < retired_version_id
+(version_filter). Новая версия = новые строки для вставленных и измененных
+кодов + закрытие (retired_version_id = V) строк измененных и удаленных кодов,
+поэтому запись пропорциональна числу изменений, а не размеру тарифа.
+
+Читатели фильтруют ставки по активной версии (active_version_filter), поэтому
+не видят недостроенную версию и не ждут блокировок: до коммита им видна старая
+версия, после - новая целиком. Откат - активация предыдущей версии: закрытые
+в более поздних версиях строки для нее по-прежнему действуют.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from sqlalchemy import and_, delete, exists, func, or_, update
+from sqlmodel import Session, select
+
+from app.core.config import settings
+from app.models import TariffRate, TariffVersion, TariffVersionStatus, TnVedCode
+from app.services.importers.bulk_load import bulk_insert
+
+logger = logging.getLogger(__name__)
+
+# Колонки ставки, которые сравниваются между версиями
+RATE_COLUMNS = tuple(
+	c.name for c in TariffRate.__table__.columns
+	if c.name not in ("id", "version_id", "retired_version_id", "tn_ved_code_id")
+)
+# Кусок id в одном UPDATE/IN (лимит параметров запроса)
+_ID_BATCH = 5000
+
+
+def active_version_id():
+	"""Подзапрос: id активной версии (для условий в запросах читателей)"""
+	return (
+		select(TariffVersion.id)
+		.where(TariffVersion.status == TariffVersionStatus.ACTIVE)
+		.scalar_subquery()
+	)
+
+
+def version_filter(version_id):
+	"""Условие на строки TariffRate, действующие в версии (id или подзапрос)"""
+	return and_(
+		TariffRate.version_id <= version_id,
+		or_(TariffRate.retired_version_id.is_(None), TariffRate.retired_version_id > version_id),
+	)
+
+
+def active_version_filter():
+	"""Условие на строки TariffRate активной версии"""
+	return version_filter(active_version_id())
+
+
+def get_active_version(session: Session) -> Optional[TariffVersion]:
+	return session.exec(
+		select(TariffVersion).where(TariffVersion.status == TariffVersionStatus.ACTIVE)
+	).first()
+
+
+def get_head_version(session: Session) -> Optional[TariffVersion]:
+	"""
+	Последняя опубликованная версия (активная или retired после отката).
+	Изменения новой версии считаются от нее: цепочка строк линейна по id версий.
+	"""
+	return session.exec(
+		select(TariffVersion)
+		.where(TariffVersion.status != TariffVersionStatus.BUILDING)
+		.order_by(TariffVersion.id.desc())
+	).first()
+
+
+def version_rates(session: Session, version_id: int) -> dict[str, tuple[int, dict]]:
+	"""Ставки версии: код -> (id строки, tn_ved_code_id и значения RATE_COLUMNS)"""
+	columns = ("tn_ved_code_id", *RATE_COLUMNS)
+	rows = session.exec(
+		select(TnVedCode.code, TariffRate.id, *(getattr(TariffRate, c) for c in columns))
+		.join(TnVedCode, TnVedCode.id == TariffRate.tn_ved_code_id)
+		.where(version_filter(version_id))
+	)
+	return {code: (rate_id, dict(zip(columns, values))) for code, rate_id, *values in rows}
+
+
+def create_version(session: Session, source: Optional[str] = None) -> TariffVersion:
+	"""Новая версия в статусе building (читателям не видна)"""
+	version = TariffVersion(source=source)
+	session.add(version)
+	session.flush()
+	return version
+
+
+@dataclass
+class RateChanges:
+	"""Разница целевых ставок с последней версией (коды)"""
+	inserted: list[str] = field(default_factory=list)
+	updated: list[str] = field(default_factory=list)
+	deleted: list[str] = field(default_factory=list)
+	unchanged: int = 0
+
+	@property
+	def changed_codes(self) -> list[str]:
+		return sorted(self.inserted + self.updated + self.deleted)
+
+
+def publish_rates(session: Session, target: dict[str, dict],
+                  source: Optional[str] = None) -> tuple[Optional[TariffVersion], RateChanges]:
+	"""
+	Публикует целевое состояние ставок (код -> строка TariffRate словарем) новой версией,
+	если оно отличается от активной: пишутся только изменения, затем проверки,
+	активация и очистка старых версий. Коммит делает вызывающий.
+	Возвращает (версия или None, если изменений нет; разница с активной версией по кодам).
+	"""
+	active = get_active_version(session)
+	current = version_rates(session, active.id) if active else {}
+	changes = _diff(target, current)
+	if not (changes.inserted or changes.updated or changes.deleted):
+		return None, changes
+	
+	# Строки пишутся относительно последней версии (после отката она не активная)
+	head = get_head_version(session)
+	if head is None or (active is not None and head.id == active.id):
+		base = current
+	else:
+		base = version_rates(session, head.id)
+	stored = changes if base is current else _diff(target, base)
+	
+	version = create_version(session, source=source)
+	retired = [base[code][0] for code in stored.updated + stored.deleted]
+	for i in range(0, len(retired), _ID_BATCH):
+		session.exec(
+			update(TariffRate)
+			.where(TariffRate.id.in_(retired[i:i + _ID_BATCH]))
+			.values(retired_version_id=version.id)
+		)
+	bulk_insert(session, TariffRate, (
+		{**target[code], "version_id": version.id} for code in stored.inserted + stored.updated
+	))
+	session.flush()
+	
+	version.rate_count = validate_version(session, version.id, target, previous_count=len(current))
+	activate_version(session, version.id)
+	prune_versions(session)
+	logger.info(
+		f"📦 Версия тарифа {version.id}: +{len(changes.inserted)} ~{len(changes.updated)} "
+		f"-{len(changes.deleted)}, без изменений {changes.unchanged}; записано строк {len(stored.changed_codes)}"
+	)
+	return version, changes
+
+
+def _diff(target: dict[str, dict], rates: dict[str, tuple[int, dict]]) -> RateChanges:
+	changes = RateChanges()
+	for code, row in target.items():
+		existing = rates.get(code)
+		if existing is None:
+			changes.inserted.append(code)
+		elif any(row.get(c) != existing[1][c] for c in RATE_COLUMNS):
+			changes.updated.append(code)
+		else:
+			changes.unchanged += 1
+	changes.deleted = [code for code in rates if code not in target]
+	return changes
+
+
+def validate_version(session: Session, version_id: int, expected: dict[str, dict],
+                     previous_count: Optional[int] = None) -> int:
+	"""
+	Проверки перед публикацией (ValueError - версию публиковать нельзя):
+	- версия не пустая и не короче активной больше чем на TARIFF_MAX_SHRINK
+	- проценты пошлины и НДС в пределах 0..100
+	- выборочные коды (каждый k-й из expected) совпадают с целевыми строками
+	Возвращает число ставок в версии.
+	"""
+	count = session.exec(select(func.count()).where(version_filter(version_id))).one()
+	if count == 0:
+		raise ValueError("Новая версия тарифа пуста")
+	if count != len(expected):
+		raise ValueError(f"В версии {count} ставок, ожидалось {len(expected)}")
+	if previous_count and count < previous_count * (1 - settings.TARIFF_MAX_SHRINK):
+		raise ValueError(f"Ставок стало {count} вместо {previous_count}: больше допустимого сокращения")
+	
+	# Строки прежних версий уже проверены при их публикации - проверяем только новые
+	out_of_range = session.exec(
+		select(func.count()).where(
+			TariffRate.version_id == version_id,
+			or_(
+				TariffRate.ad_valorem_rate < 0, TariffRate.ad_valorem_rate > 100,
+				TariffRate.vat_rate < 0, TariffRate.vat_rate > 100
+			)
+		)
+	).one()
+	if out_of_range:
+		raise ValueError(f"Ставок с процентом вне 0..100: {out_of_range}")
+	
+	codes = sorted(expected)
+	step = max(1, len(codes) // max(settings.TARIFF_SPOT_CHECKS, 1))
+	sample = codes[::step][:settings.TARIFF_SPOT_CHECKS]
+	rows = session.exec(
+		select(TnVedCode.code, *(getattr(TariffRate, c) for c in RATE_COLUMNS))
+		.join(TnVedCode, TnVedCode.id == TariffRate.tn_ved_code_id)
+		.where(version_filter(version_id), TnVedCode.code.in_(sample))
+	).all()
+	found = {code: dict(zip(RATE_COLUMNS, values)) for code, *values in rows}
+	for code in sample:
+		row = found.get(code)
+		if row is None or any(row[c] != expected[code].get(c) for c in RATE_COLUMNS):
+			raise ValueError(f"Выборочная проверка не прошла: ставка кода {code} не совпадает с целевой")
+	return count
+
+
+def activate_version(session: Session, version_id: int) -> None:
+	"""
+	Делает версию активной, прежнюю активную - retired.
+	Оба UPDATE в одной транзакции: другие сессии видят смену только после коммита.
+	"""
+	session.exec(
+		update(TariffVersion)
+		.where(TariffVersion.status == TariffVersionStatus.ACTIVE, TariffVersion.id != version_id)
+		.values(status=TariffVersionStatus.RETIRED)
+	)
+	session.exec(
+		update(TariffVersion)
+		.where(TariffVersion.id == version_id)
+		.values(status=TariffVersionStatus.ACTIVE, published_at=func.now())
+	)
+	session.expire_all()
+	logger.info(f"📌 Активная версия тарифа: {version_id}")
+
+
+def prune_versions(session: Session, keep: Optional[int] = None) -> int:
+	"""
+	Удаляет старые retired-версии сверх TARIFF_VERSIONS_KEEP (считая активную) и строки,
+	которые не действуют ни в одной оставшейся версии. Открытые строки не трогаются,
+	поэтому удаление пропорционально истории изменений, а не размеру тарифа.
+	"""
+	keep = settings.TARIFF_VERSIONS_KEEP if keep is None else keep
+	retired = session.exec(
+		select(TariffVersion.id)
+		.where(TariffVersion.status == TariffVersionStatus.RETIRED)
+		.order_by(TariffVersion.id.desc())
+	).all()
+	stale = list(retired[max(keep - 1, 0):])
+	if stale:
+		session.exec(delete(TariffVersion).where(TariffVersion.id.in_(stale)))
+		kept = select(TariffVersion.id).where(
+			TariffVersion.id >= TariffRate.version_id, TariffVersion.id < TariffRate.retired_version_id
+		)
+		session.exec(
+			delete(TariffRate).where(TariffRate.retired_version_id.is_not(None), ~exists(kept))
+		)
+	return len(stale)
@@ -0,0 +1,127 @@
+# app/services/tnved_tree.py
+"""
+Дерево ТН ВЭД (группа -> позиция -> субпозиция -> код) на материализованных путях.
+
+Путь, глубина, число потомков и мин/макс ставка пошлины по поддереву считаются
+при импорте (rebuild_tnved_tree), поэтому раскрытие узла - один индексный запрос
+по path без рекурсивного обхода.
+"""
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from app.models import TariffRate, TnVedCode
+from app.services.tariff_versions import active_version_filter
+
+PATH_SEPARATOR = "."
+
+
+def _resolve_parents(codes: dict[str, Optional[str]]) -> dict[str, Optional[str]]:
+	"""
+	Родитель узла: parent_code из справочника, если такой код есть,
+	иначе самый длинный существующий префикс кода (None - корень).
+	"""
+	parents = {}
+	for code, parent_code in codes.items():
+		if parent_code and parent_code in codes and parent_code != code:
+			parents[code] = parent_code
+			continue
+		parent = None
+		for length in range(len(code) - 1, 1, -1):
+			if code[:length] in codes:
+				parent = code[:length]
+				break
+		parents[code] = parent
+	return parents
+
+
+def rebuild_tnved_tree(session: Session) -> int:
+	"""
+	Пересчитывает path, depth, descendant_count и min/max ставки пошлины для всех кодов.
+	Вызывается после импорта кодов и после импорта ставок. Коммит делает вызывающий.
+	"""
+	rows = session.exec(select(TnVedCode.id, TnVedCode.code, TnVedCode.parent_code)).all()
+	if not rows:
+		return 0
+	ids = {code: code_id for code_id, code, _ in rows}
+	parents = _resolve_parents({code: parent_code for _, code, parent_code in rows})
+
+	rates: dict[int, float] = {}
+	for code_id, ad_valorem in session.exec(
+			select(TariffRate.tn_ved_code_id, TariffRate.ad_valorem_rate).where(active_version_filter())
+	):
+		rates[code_id] = ad_valorem
+
+	# Пути: родитель раньше ребенка (у родителя путь уже посчитан)
+	paths: dict[str, str] = {}
+
+	def path_of(code: str) -> str:
+		chain = []
+		node = code
+		while node is not None and node not in paths:
+			chain.append(node)
+			node = parents[node]
+			# Защита от циклов в parent_code
+			if node in chain:
+				node = None
+		prefix = paths[node] if node is not None else None
+		for item in reversed(chain):
+			prefix = f"{prefix}{PATH_SEPARATOR}{item}" if prefix else item
+			paths[item] = prefix
+		return paths[code]
+
+	for code in ids:
+		path_of(code)
+
+	# Агрегаты по поддереву: от самых глубоких узлов к корням
+	stats = {code: [0, rates.get(ids[code]), rates.get(ids[code])] for code in ids}
+	for code in sorted(ids, key=lambda c: paths[c].count(PATH_SEPARATOR), reverse=True):
+		parent = parents[code]
+		if parent is None:
+			continue
+		count, low, high = stats[code]
+		parent_stats = stats[parent]
+		parent_stats[0] += count + 1
+		if low is not None:
+			parent_stats[1] = low if parent_stats[1] is None else min(parent_stats[1], low)
+			parent_stats[2] = high if parent_stats[2] is None else max(parent_stats[2], high)
+
+	session.bulk_update_mappings(TnVedCode, [
+		{
+			"id": ids[code],
+			"path": paths[code],
+			"depth": paths[code].count(PATH_SEPARATOR),
+			"descendant_count": count,
+			"min_duty_rate": low,
+			"max_duty_rate": high,
+		}
+		for code, (count, low, high) in stats.items()
+	])
+	session.flush()
+	return len(ids)
+
+
+def tree_children(session: Session, parent_code: Optional[str] = None,
+                  after: Optional[str] = None, limit: int = 50) -> Optional[list[TnVedCode]]:
+	"""
+	Дочерние узлы (корни, если parent_code не задан) с keyset-пагинацией по коду:
+	after - последний код предыдущей страницы. None - родитель не найден.
+	"""
+	stmt = select(TnVedCode)
+	if parent_code:
+		parent = session.exec(
+			select(TnVedCode.path, TnVedCode.depth).where(TnVedCode.code == parent_code)
+		).first()
+		if parent is None or parent.path is None:
+			return None
+		# LIKE 'path.%' идет по индексу ix_tn_ved_codes_path (varchar_pattern_ops)
+		stmt = stmt.where(
+			TnVedCode.path.startswith(parent.path + PATH_SEPARATOR, autoescape=True),
+			TnVedCode.depth == parent.depth + 1
+		)
+	else:
+		stmt = stmt.where(TnVedCode.depth == 0)
+
+	if after:
+		stmt = stmt.where(TnVedCode.code > after)
+	return session.exec(stmt.order_by(TnVedCode.code).limit(limit)).all()
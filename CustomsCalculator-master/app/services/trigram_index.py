@@ -0,0 +1,113 @@
+# app/services/trigram_index.py
+"""
+Инвертированный триграммный индекс описаний ТН ВЭД в памяти процесса.
+
+Триграммы и similarity считаются так же, как в pg_trgm:
+- текст в нижнем регистре разбивается на слова из букв/цифр
+- каждое слово дополняется пробелами ("  слово ") и режется на тройки
+- similarity = общие / (триграммы_A + триграммы_B - общие)
+
+Поэтому match_percentage совпадает с поиском через Postgres, а сам поиск
+не требует расширений БД.
+"""
+import heapq
+import re
+from array import array
+from typing import Iterable, Iterator
+
+import numpy as np
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> set[str]:
+	"""Множество триграмм строки по правилам pg_trgm (show_trgm)"""
+	result = set()
+	for word in _WORD_RE.findall(text.lower()):
+		padded = f"  {word} "
+		result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+	return result
+
+
+def similarity(a: str, b: str) -> float:
+	"""Аналог pg_trgm similarity(a, b)"""
+	ta, tb = trigrams(a), trigrams(b)
+	if not ta or not tb:
+		return 0.0
+	shared = len(ta & tb)
+	return shared / (len(ta) + len(tb) - shared)
+
+
+class TrigramIndex:
+	"""
+	Постинги хранятся в array('i') (4 байта на документ), документы - номера
+	в порядке добавления. Поиск считает общие триграммы только по документам из
+	постингов запроса (np.unique, без счетчика на весь корпус) и выбирает top-k
+	кучей среди этих кандидатов.
+	"""
+	__slots__ = ("keys", "sizes", "postings")
+
+	def __init__(self, docs: Iterable[tuple[str, str]]):
+		keys: list[str] = []
+		sizes = array("i")
+		postings: dict[str, array] = {}
+		for key, text in docs:
+			doc_id = len(keys)
+			keys.append(key)
+			grams = trigrams(text or "")
+			sizes.append(len(grams))
+			for gram in grams:
+				posting = postings.get(gram)
+				if posting is None:
+					posting = postings[gram] = array("i")
+				posting.append(doc_id)
+		self.keys = tuple(keys)
+		self.sizes = np.frombuffer(sizes, dtype=np.int32) if sizes else np.zeros(0, dtype=np.int32)
+		self.postings = postings
+
+	def __len__(self) -> int:
+		return len(self.keys)
+
+	def search(self, query: str, limit: int = 20, threshold: float = 0.05) -> list[tuple[str, float]]:
+		"""Top-k документов с similarity >= threshold: [(ключ, similarity 0..1), ...]"""
+		return self._top(trigrams(query), limit, threshold, self._posting)
+
+	def search_many(self, queries: Iterable[str], limit: int = 20,
+	                threshold: float = 0.05) -> Iterator[list[tuple[str, float]]]:
+		"""
+		То же для пачки запросов (по результату на запрос, в порядке запросов).
+		Постинги каждой триграммы разворачиваются один раз на всю пачку,
+		одинаковые запросы считаются один раз.
+		"""
+		postings: dict[str, np.ndarray] = {}
+
+		def posting(gram: str) -> np.ndarray:
+			found = postings.get(gram)
+			if found is None:
+				found = postings[gram] = self._posting(gram)
+			return found
+
+		done: dict[frozenset, list[tuple[str, float]]] = {}
+		for query in queries:
+			grams = frozenset(trigrams(query))
+			result = done.get(grams)
+			if result is None:
+				result = done[grams] = self._top(grams, limit, threshold, posting)
+			yield result
+
+	def _posting(self, gram: str) -> np.ndarray:
+		return np.frombuffer(self.postings[gram], dtype=np.int32)
+
+	def _top(self, grams, limit: int, threshold: float, posting) -> list[tuple[str, float]]:
+		lists = [posting(g) for g in grams if g in self.postings]
+		if not lists or limit <= 0:
+			return []
+
+		# Сколько триграмм запроса есть в каждом документе-кандидате
+		candidates, common = np.unique(np.concatenate(lists), return_counts=True)
+		scores = common / (self.sizes[candidates] + len(grams) - common)
+
+		keep = scores >= threshold
+		candidates, scores = candidates[keep], scores[keep]
+		top = heapq.nlargest(limit, range(len(candidates)), key=scores.__getitem__)
+		return [(self.keys[candidates[i]], float(scores[i])) for i in top]
@@ -0,0 +1,123 @@
+# app/services/units.py
+"""
+Единый справочник единиц измерения.
+
+- UNIT_LABELS: обозначения из справочника ТН ВЭД -> код единицы
+- UNIT_KEYWORDS: корни слов (рус/узб) из текста ставок Lex.uz -> код единицы
+- UNIT_QUANTITIES: код/обозначение единицы -> из какого поля ввода и с каким
+  коэффициентом берется количество для специфической ставки
+"""
+import math
+from typing import NamedTuple, Optional
+
+# Обозначения единиц в справочнике ТН ВЭД
+UNIT_LABELS = {
+	'кг': 'kg',
+	'г': 'g',
+	'т': 't',
+	'шт': 'pcs',
+	'100 шт': '100_pcs',
+	'1000 шт': '1000_pcs',
+	'пар': 'pair',
+	'л': 'l',
+	'мл': 'ml',
+	'1000 л.': '1000_l',
+	'л100% сп.': 'l_alc_100',
+	'м': 'm',
+	'м2': 'm2',
+	'1000 м2': '1000_m2',
+	'м3': 'm3',
+	'1000 кВтч': '1000_kwh',
+	'кюри': 'ci',
+	'кар': 'carat',
+	'кг 90% с/в': 'kg_90_dry',
+	'кг H2O2': 'kg_h2o2',
+	'кг K2O': 'kg_k2o',
+	'кг N': 'kg_n',
+	'кг NаОH': 'kg_naoh',
+	'кг P2O5': 'kg_p2o5',
+	'кг U': 'kg_u',
+	'кг КОH': 'kg_koh',
+	'г Д/И': 'g_di'
+}
+
+# Словарь соответствий для текста ставок: {Код: [список корней на рус и узб]}
+# 'кило' ловит 'килограмм', 'килограмми'
+# 'дон' ловит 'дона', 'донаси' (шт)
+# 'жуфт' ловит 'жуфти' (пара)
+UNIT_KEYWORDS = {
+	'kg': ['кило', 'кг'],
+	'l': ['литр'],
+	'pcs': ['штук', 'шт', 'дон'],
+	'pair': ['пар', 'жуфт'],
+	'cm3': ['куб', 'см'],
+	'm2': ['м2']
+}
+
+
+class UnitQuantity(NamedTuple):
+	"""Количество = inputs[field] * mult / div"""
+	field: str
+	mult: float = 1
+	div: float = 1
+
+
+# Поле 'volume_m3' - особый случай: объем вводится в см3,
+# но значения до 100 считаются уже кубометрами
+VOLUME_M3 = "volume_m3"
+
+UNIT_QUANTITIES: dict[str, UnitQuantity] = {
+	# --- ГРУППА 1: ВЕС ---
+	**{u: UnitQuantity('weight') for u in ['kg', 'кг', 'kg_90_dry', 'kg_h2o2', 'kg_k2o', 'kg_n', 'kg_naoh',
+	                                        'kg_p2o5', 'kg_u', 'kg_koh']},
+	'g_di': UnitQuantity('weight', mult=1000),
+	# --- ГРУППА 2: ШТУКИ ---
+	**{u: UnitQuantity('qty') for u in ['pcs', 'шт', 'pair', 'пар']},
+	**{u: UnitQuantity('qty', div=100) for u in ['100_pcs', '100 шт']},
+	**{u: UnitQuantity('qty', div=1000) for u in ['1000_pcs', '1000 шт']},
+	# --- ГРУППА 3: ЛИТРЫ ---
+	**{u: UnitQuantity('liters') for u in ['l', 'л', 'литр', 'l_alc_100', 'л100% сп.']},
+	'ml': UnitQuantity('liters', mult=1000),
+	**{u: UnitQuantity('liters', div=1000) for u in ['1000_l', '1000 л.']},
+	# --- ГРУППА 4: ОБЪЕМ (Двигатель/Кубы) ---
+	**{u: UnitQuantity('volume') for u in ['cm3', 'см3']},
+	**{u: UnitQuantity(VOLUME_M3) for u in ['m3', 'м3']},
+	# --- ГРУППА 5: ПРОЧЕЕ (фронт мапит в поле количества) ---
+	**{u: UnitQuantity('qty') for u in ['m2', 'м2', 'm', 'м', 'carat', 'кар', 'ci', 'кюри']},
+	**{u: UnitQuantity('qty', div=1000) for u in ['1000_m2', '1000 м2', '1000_kwh', '1000 кВтч']},
+}
+
+
+def unit_quantity(unit: Optional[str]) -> Optional[UnitQuantity]:
+	"""None - единица не поддерживается расчетом (количество считается нулевым)"""
+	try:
+		return UNIT_QUANTITIES.get(unit)
+	except TypeError:
+		return None
+
+
+def normalize_unit_label(value) -> Optional[str]:
+	"""Обозначение из справочника ТН ВЭД ('кг', '1000 шт') -> код единицы"""
+	if value is None or (isinstance(value, float) and math.isnan(value)):
+		return None
+	if value == "" or str(value).lower() == 'nan':
+		return None
+	val_str = str(value).strip()
+	return UNIT_LABELS.get(val_str, val_str)
+
+
+def normalize_unit_text(unit_str) -> Optional[str]:
+	"""Единица из текста ставки Lex.uz ('0.3 ақш доллари 1 килограмм учун') -> код единицы"""
+	if not unit_str:
+		return None
+	u = str(unit_str).lower()
+
+	# Сначала проверяем особый случай с 1000
+	if '1000' in u:
+		return '1000_pcs'
+
+	for code, keywords in UNIT_KEYWORDS.items():
+		if any(k in u for k in keywords):
+			return code
+
+	return u.strip()
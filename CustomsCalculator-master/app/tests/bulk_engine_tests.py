@@ -0,0 +1,113 @@
+import random
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.models import TariffRate, TnVedCode
+from app.services.bulk_engine import BulkDutyEngine
+from app.services.calculator import DutyCalculator
+
+
+@pytest.fixture
+def snapshot_codes():
+	return [
+		TnVedCode(id=1, code="8703231981", description="Легковой ДВС", is_util_applicable=True,
+		          calc_metadata={"type": "M1", "engine_type": "ice"}),
+		TnVedCode(id=2, code="8703800001", description="Электромобиль", is_util_applicable=True,
+		          calc_metadata={"type": "M1", "engine_type": "electric"}),
+		TnVedCode(id=3, code="8704211000", description="Грузовик", is_util_applicable=True,
+		          calc_metadata={"type": "N", "engine_type": "ice"}),
+		TnVedCode(id=4, code="8701201000", description="Тягач седельный", is_util_applicable=True,
+		          calc_metadata={"type": "tractor"}),
+		TnVedCode(id=5, code="4011100000", description="Шины", is_util_applicable=True, calc_metadata={"type": "tire"}),
+		TnVedCode(id=6, code="2203000100", description="Пиво", calc_metadata={}),
+		TnVedCode(id=7, code="4407", description="Лесоматериалы", calc_metadata={}),
+		TnVedCode(id=8, code="8705100000", description="Автокраны", is_util_applicable=True,
+		          calc_metadata={"type": "special"}),
+		TnVedCode(id=9, code="0402", description="Молоко", calc_metadata={}),
+	]
+
+
+@pytest.fixture
+def snapshot_rates():
+	return [
+		TariffRate(id=1, tn_ved_code_id=1, rate_type="combined", ad_valorem_rate=15.0, specific_rate=1.0,
+		           specific_unit="cm3"),
+		TariffRate(id=2, tn_ved_code_id=2, rate_type="ad_valorem", ad_valorem_rate=0.0),
+		TariffRate(id=3, tn_ved_code_id=3, rate_type="mixed", ad_valorem_rate=10.0, specific_rate=0.3,
+		           specific_unit="kg"),
+		TariffRate(id=4, tn_ved_code_id=4, rate_type="ad_valorem", ad_valorem_rate=5.0),
+		TariffRate(id=5, tn_ved_code_id=5, rate_type="specific", ad_valorem_rate=0.0, specific_rate=2.0,
+		           specific_unit="pcs"),
+		TariffRate(id=6, tn_ved_code_id=6, rate_type="ad_valorem", ad_valorem_rate=20.0,
+		           excise_type="mixed", excise_ad_valorem_rate=10.0, excise_specific_rate=5000.0,
+		           excise_currency="UZS", excise_unit="l"),
+		TariffRate(id=7, tn_ved_code_id=7, rate_type="specific", ad_valorem_rate=0.0, specific_rate=12.0,
+		           specific_unit="m3"),
+		TariffRate(id=8, tn_ved_code_id=8, rate_type="ad_valorem", ad_valorem_rate=7.0),
+		TariffRate(id=9, tn_ved_code_id=9, rate_type="combined", ad_valorem_rate=5.0, specific_rate=0.5,
+		           specific_unit="1000 шт", vat_rate=0.0),
+	]
+
+
+def test_bulk_engine_matches_scalar(snapshot):
+	rnd = random.Random(42)
+	lines = []
+	for _ in range(400):
+		lines.append({
+			"tn_code": rnd.choice(["8703231981", "8703800001", "8704211000", "8701201000", "8701901000",
+			                       "4011100000", "2203000100", "4407109100", "8705100000", "0402999999",
+			                       "9999999999"]),
+			"customs_value": rnd.choice([rnd.uniform(100, 1_500_000), 10_000.0, 20_000.0, 1_000_000.0]),
+			"weight_kg": rnd.choice([0.0, 2500.0, rnd.uniform(1, 60_000)]),
+			"quantity_pcs": rnd.uniform(0, 5000),
+			"volume_cm3": rnd.choice([0.0, 50.0, 1000.0, 3500.0, rnd.uniform(0, 6000)]),
+			"liter_qty": rnd.uniform(0, 1000),
+			"manufacturing_year": rnd.choice([None, 2010, 2024, datetime.now().year]),
+			"power_hp": rnd.choice([0.0, 25.0, 177.0, 200.0, 300.0]),
+			"origin_country_code": rnd.choice([None, "RU", "CN", "US"]),
+		})
+	
+	calc = DutyCalculator(snapshot=snapshot)
+	engine = BulkDutyEngine(snapshot, brv=calc.brv)
+	result = engine.calculate(
+		codes=[l["tn_code"] for l in lines],
+		customs_values=[l["customs_value"] for l in lines],
+		weights=[l["weight_kg"] for l in lines],
+		quantities=[l["quantity_pcs"] for l in lines],
+		volumes=[l["volume_cm3"] for l in lines],
+		liters=[l["liter_qty"] for l in lines],
+		years=[l["manufacturing_year"] or 0 for l in lines],
+		power_hp=[l["power_hp"] for l in lines],
+		origins=[l["origin_country_code"] for l in lines],
+	)
+	
+	for i, line in enumerate(lines):
+		scalar = calc.calculate(**line)
+		assert bool(result["found"][i]) == (scalar["error"] is None)
+		assert round(float(result["total_usd"][i]), 2) == pytest.approx(scalar["total_payments_usd"], abs=0.01)
+
+
+def test_customs_fee_brackets_vectorized(snapshot):
+	engine = BulkDutyEngine(snapshot)
+	fee = engine.customs_fee_uzs(np.array([9999.99, 10_000, 25_000, 1_500_000]))
+	assert fee.tolist() == [412000.0, 412000.0 * 1.5, 412000.0 * 2.5, 412000.0 * 25]
+
+
+
+def test_sweep_matches_scalar_on_grid(snapshot):
+	calc = DutyCalculator(snapshot=snapshot)
+	engine = BulkDutyEngine(snapshot, brv=calc.brv)
+	base = {"tn_code": "8703231981", "customs_value": 0.0, "weight_kg": 1500.0, "volume_cm3": 0.0,
+	        "manufacturing_year": 2015, "origin_country_code": "CN"}
+	x_values = np.linspace(5_000, 500_000, 7)
+	y_values = np.array([900.0, 2500.0, 4000.0])
+	
+	grid = engine.sweep(base, "customs_value", x_values, "volume_cm3", y_values)
+	assert grid["total_usd"].shape == (3, 7)
+	
+	for iy, volume in enumerate(y_values):
+		for ix, value in enumerate(x_values):
+			scalar = calc.calculate(**{**base, "customs_value": value, "volume_cm3": volume})
+			assert round(float(grid["total_usd"][iy, ix]), 2) == pytest.approx(scalar["total_payments_usd"], abs=0.01)
@@ -5,7 +5,7 @@ from sqlmodel import Session
 
 # Предположим, твой класс лежит в app/services/calculator.py
 from app.services.calculator import DutyCalculator
-from app.models import TariffRate, TnVedCode
+from app.models import TariffRate, TariffVersion, TariffVersionStatus, TnVedCode
 from app.models.country import TradeRegimeType
 
 
@@ -150,4 +150,423 @@ def test_utilization_tractor_power(calculator):
 	# Трактор старый (>3 лет), 150 л.с. -> попадает в категорию 102-177 л.с. (480 БРВ)
 	inputs_old = {"power_hp": 150, "manufacturing_year": 2015}
 	_, uzs_old, _ = calculator._calc_utilization_fee(metadata, inputs_old)
-	assert uzs_old == 480 * 412000.0
\ No newline at end of file
+	assert uzs_old == 480 * 412000.0
+
+# --- Снимок тарифов в памяти ---
+
+@pytest.fixture
+def snapshot_codes():
+	return [
+		TnVedCode(id=1, code="8703231981", description="Легковой автомобиль", is_util_applicable=True,
+		          calc_metadata={"type": "M1", "engine_type": "ice"}),
+		TnVedCode(id=2, code="84151090", description="Кондиционеры", calc_metadata={}),
+		TnVedCode(id=3, code="8415109000", description="Кондиционеры прочие", calc_metadata={}),
+	]
+
+
+@pytest.fixture
+def snapshot_rates():
+	return [
+		TariffRate(id=10, tn_ved_code_id=1, rate_type="combined", ad_valorem_rate=15.0, specific_rate=1.0,
+		           specific_unit="cm3", vat_rate=12.0),
+		TariffRate(id=20, tn_ved_code_id=2, rate_type="ad_valorem", ad_valorem_rate=10.0, vat_rate=12.0),
+	]
+
+
+def test_snapshot_inherits_rate_from_parent(snapshot):
+	"""У 8415109000 нет своей ставки - берется ставка 84151090"""
+	rate, code_obj = snapshot.find_rate("8415109000")
+	assert rate.ad_valorem_rate == 10.0
+	assert code_obj.code == "84151090"
+	assert snapshot.find_rate("9999999999") is None
+	
+	# Расчет сообщает, чья ставка применена (по нему же считается популярность)
+	result = DutyCalculator(snapshot=snapshot).calculate(tn_code=" 8415109000", customs_value=100.0, weight_kg=1)
+	assert (result["tn_code"], result["resolved_code"]) == ("8415109000", "84151090")
+
+
+def test_calculate_from_snapshot_without_db(snapshot):
+	"""С переданным снимком калькулятор не трогает сессию"""
+	session = MagicMock(spec=Session)
+	calc = DutyCalculator(session, snapshot=snapshot)
+	result = calc.calculate(
+		tn_code="8703231981",
+		customs_value=25000.0,
+		weight_kg=1800,
+		quantity_pcs=1,
+		volume_cm3=2500,
+		manufacturing_year=datetime.now().year,
+		origin_country_code="cn"
+	)
+	
+	session.exec.assert_not_called()
+	assert result["currency_rate"] == 12800.0
+	duty = next(d for d in result["details"] if d["name"] == "Импортная пошлина")
+	# 15% от 25000 + 1$ * 2500 см3
+	assert duty["amount_usd"] == 6250.0
+	util = next(d for d in result["details"] if d["name"] == "Утилизационный сбор")
+	assert util["amount_uzs"] == 180 * 412000.0
+
+
+def test_snapshot_is_immutable(snapshot):
+	with pytest.raises(Exception):
+		snapshot.usd_rate = 1.0
+	with pytest.raises(TypeError):
+		snapshot.codes["0000"] = None
+
+
+def test_declaration_customs_fee_charged_once(snapshot):
+	"""Сбор ПКМ 55 считается от суммы декларации, а не по каждой позиции"""
+	calc = DutyCalculator(snapshot=snapshot)
+	line = {"tn_code": "8415109000", "customs_value": 6000.0, "weight_kg": 50, "origin_country_code": "CN"}
+	result = calc.calculate_declaration([line, dict(line), {**line, "tn_code": "0000000000"}])
+	
+	assert [l["error"] for l in result["lines"]] == [None, None, "Код ТН ВЭД не найден"]
+	assert result["lines"][0]["resolved_code"] == "84151090"
+	assert all(d["name"] != "Таможенный сбор" for l in result["lines"] for d in l["details"])
+	
+	# 12 000$ -> 1.5 БРВ один раз (по отдельности было бы 2 x 1 БРВ)
+	fee = next(d for d in result["totals"] if d["name"] == "Таможенный сбор")
+	assert fee["amount_uzs"] == 412000.0 * 1.5
+	assert result["total_customs_value_usd"] == 12000.0
+	
+	single = calc.calculate(**line)
+	single_fee = next(d["amount_usd"] for d in single["details"] if d["name"] == "Таможенный сбор")
+	expected = 2 * (single["total_payments_usd"] - single_fee) + fee["amount_usd"]
+	assert result["total_payments_usd"] == pytest.approx(expected, abs=0.02)
+
+
+# --- Путь через БД (SQLite в памяти) ---
+
+@pytest.fixture
+def db_seed():
+	return [
+		TnVedCode(id=2, code="84151090", description="Кондиционеры", calc_metadata={}),
+		TariffVersion(id=1, status=TariffVersionStatus.ACTIVE),
+		TariffRate(version_id=1, tn_ved_code_id=2, source_code="841510", rate_type="ad_valorem",
+		           ad_valorem_rate=10.0, vat_rate=12.0),
+	]
+
+
+def test_effective_rate_lookup_is_single_query(db_session):
+	from sqlalchemy import event
+	
+	statements = []
+	event.listen(db_session.get_bind(), "before_cursor_execute", lambda *args: statements.append(args[2]))
+	
+	with patch.object(DutyCalculator, '_get_usd_rate', return_value=12800.0):
+		calc = DutyCalculator(db_session)
+	rate, code_obj = calc.get_rate_and_code_recursive("8415109000")
+	
+	assert code_obj.code == "84151090"
+	assert rate.source_code == "841510"
+	assert len(statements) == 1
+
+
+# --- Скомпилированные планы ставок ---
+
+def test_rate_plan_compiled_once_per_rate(snapshot):
+	from app.services.rate_plan import compile_rate_plan
+	
+	rate, _ = snapshot.find_rate("8703231981")
+	assert rate.duty_plan is compile_rate_plan("combined", 15.0, 1.0, "USD", "cm3")
+	assert rate.duty_plan.field == "volume"
+	amount, desc = rate.duty_plan.evaluate(25000.0, {"volume": 2500}, 12800.0)
+	assert amount == 6250.0
+	assert desc == "15.0% + 1.0 $/cm3"
+
+
+def test_rate_plan_units(calculator):
+	# 1000 шт -> количество / 1000, ставка в сумах пересчитывается по курсу
+	val, _ = calculator._calc_complex_rate("specific", 0.0, 12800.0, "UZS", "1000 шт", 0.0, {"qty": 5000})
+	assert val == 5.0
+	# м3: маленькие значения уже в кубометрах, большие - в см3
+	val, _ = calculator._calc_complex_rate("specific", 0.0, 10.0, "USD", "m3", 0.0, {"volume": 3})
+	assert val == 30.0
+	val, _ = calculator._calc_complex_rate("specific", 0.0, 10.0, "USD", "m3", 0.0, {"volume": 2_000_000})
+	assert val == 20.0
+	# Неизвестная единица - специфическая часть 0
+	val, _ = calculator._calc_complex_rate("mixed", 10.0, 5.0, "USD", "t", 100.0, {"weight": 1000})
+	assert val == 10.0
+
+
+def test_unit_registry_normalizers():
+	from app.services.units import normalize_unit_label, normalize_unit_text
+	
+	assert normalize_unit_label("кг 90% с/в") == "kg_90_dry"
+	assert normalize_unit_label(float("nan")) is None
+	assert normalize_unit_text("0.3 ақш доллари 1 килограмм учун") == "kg"
+	assert normalize_unit_text("1000 дона") == "1000_pcs"
+
+
+# --- Кэш курсов ---
+
+def test_currency_cache_latest_and_invalidate(db_session):
+	from datetime import date
+	from app.models.currency import Currency, CurrencyRate
+	from app.services.currency_cache import CurrencyCache
+	
+	usd = Currency(code="840", char_code="USD", name="Доллар США")
+	db_session.add(usd)
+	db_session.commit()
+	db_session.add(CurrencyRate(currency_id=usd.id, rate=12000.0, date=date(2026, 10, 1)))
+	db_session.add(CurrencyRate(currency_id=usd.id, rate=12100.0, date=date(2026, 10, 2)))
+	db_session.commit()
+	
+	cache = CurrencyCache()
+	assert cache.latest("USD") is None  # без сессии кэш сам не грузится
+	assert cache.latest("USD", db_session) == (12100.0, date(2026, 10, 2))
+	assert cache.latest("EUR") is None
+	
+	stats = cache.stats()
+	assert (stats["hits"], stats["misses"]) == (1, 2)
+	assert stats["usd_rate_date"] == date(2026, 10, 2)
+	
+	cache.record_fallback()
+	assert cache.stats()["fallbacks"] == 1
+	
+	# Курс на дату декларации: последний не позже даты, прошлые даты читаются из БД и запоминаются
+	assert cache.rate_on("USD", date(2026, 10, 5)) == (12100.0, date(2026, 10, 2))
+	assert cache.rate_on("USD", date(2026, 10, 1), db_session) == (12000.0, date(2026, 10, 1))
+	assert cache.rate_on("USD", date(2026, 10, 1)) == (12000.0, date(2026, 10, 1))
+	assert cache.rate_on("USD", date(2026, 9, 30), db_session) is None
+	
+	# Новый курс виден после сброса: кэш перечитывается при следующем обращении с сессией
+	db_session.add(CurrencyRate(currency_id=usd.id, rate=12200.0, date=date(2026, 10, 3)))
+	db_session.commit()
+	cache.invalidate()
+	assert cache.stats()["loaded"] is False
+	assert cache.latest("USD", db_session) == (12200.0, date(2026, 10, 3))
+
+
+def test_currency_cache_loads_latest_row_per_currency():
+	"""В Postgres кэш читает по одной строке на валюту через DISTINCT ON"""
+	from sqlalchemy.dialects import postgresql
+	from app.services.currency_cache import _latest_rates_statement
+	
+	sql = str(_latest_rates_statement("postgresql").compile(dialect=postgresql.dialect()))
+	assert "DISTINCT ON (currency_rates.currency_id)" in sql
+	assert "ORDER BY currency_rates.currency_id, currency_rates.date DESC" in sql
+
+
+def test_calculate_origins_ranked_by_regime(snapshot):
+	calc = DutyCalculator(snapshot=snapshot)
+	result = calc.calculate_origins(tn_code="8415109000", customs_value=1000.0, weight_kg=10)
+	
+	assert [o["iso_code"] for o in result["origins"]] == ["RU", "CN"]
+	by_regime = {r["trade_regime"]: r for r in result["regimes"]}
+	assert by_regime[TradeRegimeType.FREE_TRADE]["duty_usd"] == 0.0
+	assert by_regime[TradeRegimeType.GENERAL]["duty_usd"] == 2 * by_regime[TradeRegimeType.MOST_FAVORED]["duty_usd"]
+	
+	single = calc.calculate(tn_code="8415109000", customs_value=1000.0, weight_kg=10, origin_country_code="CN")
+	assert result["origins"][1]["total_payments_usd"] == single["total_payments_usd"]
+
+
+def test_inverse_max_value_fits_budget(snapshot, build_snapshot):
+	"""Найденная стоимость укладывается в бюджет, а чуть большая - уже нет (или растет сбор)"""
+	# Смешанная ставка: 20%, но не менее 3$/кг -> излом на 1500$ при 100 кг
+	mixed = build_snapshot(
+		[TnVedCode(id=1, code="6403990000", description="Обувь", calc_metadata={})],
+		[TariffRate(id=1, tn_ved_code_id=1, rate_type="mixed", ad_valorem_rate=20.0, specific_rate=3.0,
+		            specific_unit="kg", vat_rate=12.0)],
+	)
+	cases = [(snapshot, "8415109000", "CN"), (snapshot, "8703231981", None), (mixed, "6403990000", None)]
+	for snap, tn_code, origin in cases:
+		calc = DutyCalculator(snapshot=snap)
+		line = dict(tn_code=tn_code, weight_kg=100, volume_cm3=1500, origin_country_code=origin)
+		for budget in (200.0, 450.0, 1234.56, 5000.0, 37000.0):
+			result = calc.calculate_max_value(budget_usd=budget, **line)
+			if result["limited_by"] == "infeasible":
+				assert result["min_payments_usd"] > budget
+				continue
+			value = result["max_customs_value"]
+			assert calc.calculate(customs_value=value, **line)["total_payments_usd"] <= budget
+			assert calc.calculate(customs_value=value + 1.0, **line)["total_payments_usd"] > budget
+	
+	calc = DutyCalculator(snapshot=snapshot)
+	# 10% + НДС 12% от (стоимость + пошлина) = 23.2% стоимости: 2360$ хватает на 9999.99$ и сбор 1 БРВ,
+	# но не на 10 000$ со сбором 1.5 БРВ
+	result = calc.calculate_max_value(tn_code="8415109000", budget_usd=2360.0, weight_kg=1, origin_country_code="CN")
+	assert result["limited_by"] == "customs_fee"
+	assert result["max_customs_value"] == 9999.99
+	assert calc.calculate_max_value(tn_code="0000", budget_usd=1.0, weight_kg=1)["error"] == "Код ТН ВЭД не найден"
+
+
+def test_inverse_max_value_flat_tail(build_snapshot):
+	"""Платежи без сбора не растут (свободная торговля, без НДС): стоимость ограничивает ступень сбора"""
+	flat = build_snapshot(
+		[TnVedCode(id=1, code="4901990000", description="Книги", calc_metadata={})],
+		[TariffRate(id=1, tn_ved_code_id=1, rate_type="ad_valorem", ad_valorem_rate=10.0, vat_rate=0.0)],
+	)
+	calc = DutyCalculator(snapshot=flat)
+	
+	# 100$ хватает на сбор ступени [20 000; 40 000) (2.5 БРВ), но не на 4 БРВ следующей
+	result = calc.calculate_max_value(tn_code="4901990000", budget_usd=100.0, weight_kg=1, origin_country_code="RU")
+	assert result["limited_by"] == "customs_fee"
+	assert result["max_customs_value"] == 39999.99
+	assert result["total_payments_usd"] <= 100.0 < calc._calc_customs_fee(40_000.0)[0]
+	
+	# Сбор последней ступени укладывается в бюджет - стоимость не ограничена
+	result = calc.calculate_max_value(tn_code="4901990000", budget_usd=1000.0, weight_kg=1, origin_country_code="RU")
+	assert result["limited_by"] == "unbounded"
+	assert result["max_customs_value"] is None
+
+
+def test_stage_timings_and_sql_count(db_session):
+	"""Стадии расчета и число SQL-запросов пишутся в тайминги запроса"""
+	from app.services.metrics import StageHistograms, install_sql_counter, track
+	
+	install_sql_counter(db_session.get_bind())
+	with track() as timings:
+		calc = DutyCalculator(db_session)
+		result = calc.calculate(tn_code="8415109000", customs_value=1000.0, weight_kg=10, origin_country_code="CN")
+	
+	assert result["error"] is None
+	assert {"currency", "lookup", "regime", "duty", "excise", "vat", "fee"} <= set(timings.stages)
+	# Курсы (кэш пуст), ставка и страна - по одному запросу
+	assert timings.sql_count == 3
+	header = timings.server_timing()
+	assert "lookup;dur=" in header and 'sql;desc="3 statements"' in header
+	
+	hist = StageHistograms()
+	hist.observe_request(timings)
+	stats = hist.stats()
+	assert stats["stages_ms"]["duty"]["count"] == 1
+	assert stats["sql_statements_per_request"]["buckets"]["le_3"] == 1
+
+
+def test_server_timing_skipped_for_streaming_response():
+	"""Потоковый ответ идет без заголовка Server-Timing, его стадии попадают в гистограммы после потока"""
+	from fastapi import FastAPI
+	from fastapi.responses import StreamingResponse
+	from fastapi.testclient import TestClient
+	from app.services.metrics import histograms, mark_streaming, server_timing_middleware, stage
+	
+	app = FastAPI()
+	app.middleware("http")(server_timing_middleware)
+	
+	@app.get("/plain")
+	def plain():
+		with stage("plain_stage"):
+			return {"ok": True}
+	
+	@app.get("/stream")
+	def stream():
+		mark_streaming()
+		
+		def lines():
+			with stage("stream_stage"):
+				yield "a\n"
+				yield "b\n"
+		
+		return StreamingResponse(lines(), media_type="application/x-ndjson")
+	
+	histograms.reset()
+	client = TestClient(app)
+	assert "plain_stage;dur=" in client.get("/plain").headers["Server-Timing"]
+	
+	response = client.get("/stream")
+	assert response.text == "a\nb\n"
+	assert "Server-Timing" not in response.headers
+	assert histograms.stats()["stages_ms"]["stream_stage"]["count"] == 1
+
+
+def test_stage_iter_times_generator_reads():
+	"""stage_iter замеряет чтение генератора, а не его создание"""
+	import time
+	from app.services.metrics import stage_iter, track
+	
+	def slow_lines():
+		for line in ("a", "b"):
+			time.sleep(0.02)
+			yield line
+	
+	with track() as timings:
+		lines = stage_iter("classify", slow_lines())
+	assert "classify" not in timings.stages
+	# Читается уже после выхода из запроса (как потоковый ответ), тайминги те же
+	assert list(lines) == ["a", "b"]
+	assert timings.stages["classify"] >= 40
+	assert list(stage_iter("classify", iter("ab"))) == ["a", "b"]  # вне track() - без замера
+
+
+# --- Кэш результатов ---
+
+def test_result_cache_single_flight_lru_ttl():
+	import threading
+	import time
+	from app.services.result_cache import ResultCache
+	
+	now = [0.0]
+	cache = ResultCache("test", maxsize=2, ttl=10.0, clock=lambda: now[0])
+	calls = []
+	
+	def slow():
+		calls.append(1)
+		time.sleep(0.05)
+		return "value"
+	
+	threads = [threading.Thread(target=cache.get_or_compute, args=("k", slow)) for _ in range(8)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	# 8 одновременных запросов - одно вычисление
+	assert len(calls) == 1
+	assert cache.get_or_compute("k", slow) == "value"
+	stats = cache.stats()
+	assert stats["misses"] == 1 and stats["hits"] + stats["coalesced"] == 8
+	
+	# LRU: "k" использован последним, вытесняется "a"
+	cache.get_or_compute("a", lambda: 1)
+	cache.get_or_compute("k", slow)
+	cache.get_or_compute("b", lambda: 2)
+	assert cache.get_or_compute("a", lambda: "new") == "new"
+	
+	# TTL
+	now[0] = 100.0
+	assert cache.get_or_compute("b", lambda: "fresh") == "fresh"
+	
+	# Исключения не кэшируются
+	with pytest.raises(ValueError):
+		cache.get_or_compute("err", lambda: (_ for _ in ()).throw(ValueError()))
+	assert cache.get_or_compute("err", lambda: "ok") == "ok"
+
+
+def test_calculate_cached_per_snapshot_version(snapshot):
+	calc = DutyCalculator(snapshot=snapshot)
+	line = dict(tn_code="8415109000", customs_value=1000.0, weight_kg=10, origin_country_code="CN")
+	first = calc.calculate(**line)
+	
+	with patch.object(DutyCalculator, "_calculate_line", side_effect=AssertionError("не из кэша")):
+		# Тот же расчет: пробелы в коде, регистр страны и int вместо float ключ не меняют
+		again = calc.calculate(**{**line, "tn_code": " 8415109000 ", "customs_value": 1000, "origin_country_code": "cn"})
+		assert again == first and again is not first
+		# Копия: правка результата не портит кэш
+		again["details"].clear()
+		assert calc.calculate(**line) == first
+	
+	# Новая версия снимка (курс) - новый расчет
+	fresh = DutyCalculator(snapshot=snapshot.with_usd_rate(13000.0, None)).calculate(**line)
+	assert fresh["currency_rate"] == 13000.0
+
+
+def test_calculation_cache_carried_over_for_unchanged_codes(snapshot, build_snapshot, snapshot_codes, snapshot_rates):
+	from app.services.calculator import carry_over_calculations
+	
+	lines = [dict(tn_code=code, customs_value=1000.0, weight_kg=10) for code in ("8703231981", "8415109000")]
+	for line in lines:
+		DutyCalculator(snapshot=snapshot).calculate(**line)
+	
+	# Синхронизация изменила ставку 84151090: расчет 8415109000 (наследует ее) сбрасывается
+	fresh = build_snapshot(snapshot_codes, snapshot_rates)
+	assert carry_over_calculations(snapshot, fresh, ["84151090"]) == 1
+	
+	calc = DutyCalculator(snapshot=fresh)
+	with patch.object(DutyCalculator, "_calculate_line", side_effect=AssertionError("не из кэша")):
+		assert calc.calculate(**lines[0])["error"] is None
+		with pytest.raises(AssertionError):
+			calc.calculate(**lines[1])
+	
+	# Другой курс - переносить нечего
+	assert carry_over_calculations(snapshot, snapshot.with_usd_rate(13000.0, None), []) == 0
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+# Настройки БД обязательны в Settings, но юнит-тесты в БД не ходят
+for key, value in {
+	"POSTGRES_USER": "postgres",
+	"POSTGRES_PASS": "postgres",
+	"POSTGRES_NAME": "customs_db",
+	"POSTGRES_PORT": "5432",
+	"POSTGRES_HOST": "localhost",
+}.items():
+	os.environ.setdefault(key, value)
+
+
+@pytest.fixture
+def db_seed():
+	"""Строки, которыми заполняется db_session; модули тестов переопределяют фикстуру"""
+	return []
+
+
+@pytest.fixture
+def db_session(db_seed):
+	"""SQLite в памяти со схемой всех моделей и данными из db_seed"""
+	from sqlalchemy import create_engine
+	from sqlmodel import Session, SQLModel
+	
+	engine = create_engine("sqlite://")
+	SQLModel.metadata.create_all(engine)
+	with Session(engine) as session:
+		session.add_all(db_seed)
+		session.commit()
+		yield session
+
+
+@pytest.fixture
+def build_snapshot():
+	"""
+	Сборка TariffSnapshot из моделей: build_snapshot(codes, rates, countries=None, **options).
+	Без countries - две страны с разными режимами (RU - свободная торговля, CN - РНБ), курс 12800.
+	"""
+	from app.models.country import Country, TradeRegimeType
+	from app.services.snapshot import TariffSnapshot
+	
+	def build(codes, rates, countries=None, **options):
+		if countries is None:
+			countries = [
+				Country(id=1, name_ru="Российская Федерация", iso_code="RU", trade_regime=TradeRegimeType.FREE_TRADE),
+				Country(id=2, name_ru="Китайская Народная Республика", iso_code="CN",
+				        trade_regime=TradeRegimeType.MOST_FAVORED),
+			]
+		options.setdefault("usd_rate", 12800.0)
+		return TariffSnapshot.build(codes, rates, countries, **options)
+	
+	return build
+
+
+@pytest.fixture
+def snapshot_options():
+	"""Дополнительные аргументы TariffSnapshot.build для фикстуры snapshot"""
+	return {}
+
+
+@pytest.fixture
+def snapshot(build_snapshot, snapshot_codes, snapshot_rates, snapshot_options):
+	"""Снимок тарифов из snapshot_codes/snapshot_rates; модули тестов переопределяют эти фикстуры"""
+	return build_snapshot(snapshot_codes, snapshot_rates, **snapshot_options)
@@ -0,0 +1,204 @@
+import pytest
+from sqlmodel import select
+
+from app.models import ExciseType, TariffRate, TariffVersion, TnVedCode
+from app.services.importers.import_duties import import_csv_to_db, parse_rate_string
+
+CODES = ["0402", "0402100000", "0402910000", "8703231981", "8703231989", "8703800001", "8704211000"]
+
+DUTIES_CSV = """tn_code;name;rate
+87;Транспорт;30
+8703;Енгил автомобиллар;20
+870323;;15 + 0.3 долл. за 1 см3
+8703231989;Бошқа;10, но не менее 1 долл. за 1 кг
+0402, 8704211000;Сут;5*
+0402;Сут ва қаймоқ;7
+9999;Йўқ;1
+"""
+
+
+@pytest.fixture
+def db_seed():
+	return [TnVedCode(id=i, code=code, description=f"Товар {code}", calc_metadata={}) for i, code in enumerate(CODES, start=1)]
+
+
+def _bruteforce(rows):
+	"""Прежний алгоритм: перебор всех кодов на каждую строку, самый длинный префикс побеждает"""
+	result = {}
+	for source_code, rate in rows:
+		for code in CODES:
+			if code.startswith(source_code) and (code not in result or len(source_code) >= len(result[code][0])):
+				result[code] = (source_code, parse_rate_string(rate))
+	return result
+
+
+def test_import_longest_prefix_wins(db_session, tmp_path):
+	csv_path = tmp_path / "duties.csv"
+	csv_path.write_text(DUTIES_CSV, encoding="utf-8")
+	
+	assert import_csv_to_db(db_session, str(csv_path)) == len(CODES)
+	
+	rates = {
+		code: (rate.source_code, rate.rate_type.value, rate.ad_valorem_rate, rate.specific_rate)
+		for rate, code in db_session.exec(
+			select(TariffRate, TnVedCode.code).join(TnVedCode, TnVedCode.id == TariffRate.tn_ved_code_id)
+		)
+	}
+	rows = [("87", "30"), ("8703", "20"), ("870323", "15 + 0.3 долл. за 1 см3"),
+	        ("8703231989", "10, но не менее 1 долл. за 1 кг"), ("0402", "5*"), ("8704211000", "5*"), ("0402", "7"),
+	        ("9999", "1")]
+	expected = {
+		code: (source, parsed["rate_type"], parsed["ad_valorem_rate"], parsed.get("specific_rate"))
+		for code, (source, parsed) in _bruteforce(rows).items()
+	}
+	assert rates == expected
+	# При равной длине префикса побеждает более поздняя строка файла
+	assert rates["0402910000"][2] == 7.0
+	assert rates["8703800001"][0] == "8703"
+	
+	names = dict(db_session.exec(select(TnVedCode.code, TnVedCode.description_uz)).all())
+	assert names["0402"] == "Сут ва қаймоқ"
+	assert names["8703231989"] == "Бошқа"
+	assert names["8703231981"] is None
+
+
+def test_copy_text_format():
+	from app.services.importers.bulk_load import _CopyStream, _copy_converter
+	
+	columns = TariffRate.__table__.c
+	assert _copy_converter(columns.rate_type)("mixed") == "MIXED"
+	assert _copy_converter(columns.excise_type)(ExciseType.SPECIFIC) == "SPECIFIC"
+	assert _copy_converter(TnVedCode.__table__.c.calc_metadata)({"type": "M1\t"}) == '{"type": "M1\\\\t"}'
+	assert _copy_converter(TnVedCode.__table__.c.is_util_applicable)(True) == "t"
+	assert _copy_converter(TnVedCode.__table__.c.description)("a\\b\nc") == "a\\\\b\\nc"
+	
+	stream = _CopyStream(iter(["1\tx\n", "2\ty\n", "3\tz\n"]))
+	assert stream.read(5) == "1\tx\n2"
+	assert stream.read() == "\ty\n3\tz\n"
+	assert stream.read(10) == ""
+
+
+def test_sync_duties_applies_only_diff(db_session, tmp_path, monkeypatch):
+	from app.core.config import settings
+	from app.services.importers.sync_duties import sync_duties
+	from app.services.tariff_versions import activate_version, active_version_filter, get_active_version
+	
+	csv_path = tmp_path / "duties.csv"
+	csv_path.write_text(DUTIES_CSV, encoding="utf-8")
+	excise = [{"approx_codes": ["8703"], "excise_type": "specific", "excise_specific_amount": 500.0}]
+	
+	first = sync_duties(db_session, str(csv_path), excise_items=excise)
+	assert (first.inserted, first.updated, first.deleted, first.unchanged) == (len(CODES), 0, 0, 0)
+	db_session.commit()
+	first_version = get_active_version(db_session)
+	assert first_version.id == first.version_id and first_version.rate_count == len(CODES)
+	
+	# Повторный прогон того же файла ничего не меняет (акцизы тоже сравниваются), версия не создается
+	again = sync_duties(db_session, str(csv_path), excise_items=excise)
+	assert (again.inserted, again.updated, again.deleted, again.unchanged) == (0, 0, 0, len(CODES))
+	assert again.changed_codes == [] and again.names_updated == 0 and again.version_id is None
+	
+	# Одна ставка изменилась, префикс 0402 пропал из файла
+	changed = DUTIES_CSV.replace("8703231989;Бошқа;10, но", "8703231989;Бошқа;12, но")
+	changed = changed.replace("0402, 8704211000", "8704211000").replace("0402;Сут ва қаймоқ;7\n", "")
+	csv_path.write_text(changed, encoding="utf-8")
+	
+	# Пропало 3 ставки из 7 - больше допустимого, публикация отменяется, активная версия прежняя
+	with pytest.raises(ValueError):
+		sync_duties(db_session, str(csv_path), excise_items=excise)
+	db_session.rollback()
+	assert get_active_version(db_session).id == first_version.id
+	
+	monkeypatch.setattr(settings, "TARIFF_MAX_SHRINK", 0.5)
+	log = sync_duties(db_session, str(csv_path), excise_items=excise)
+	db_session.commit()
+	
+	assert (log.inserted, log.updated, log.deleted) == (0, 1, 3)
+	assert log.changed_codes == ["0402", "0402100000", "0402910000", "8703231989"]
+	
+	def active_rates():
+		return {
+			code: rate for rate, code in db_session.exec(
+				select(TariffRate, TnVedCode.code)
+				.join(TnVedCode, TnVedCode.id == TariffRate.tn_ved_code_id)
+				.where(active_version_filter())
+			)
+		}
+	
+	# Версия хранит только изменения: новая строка одна, у 0402* и старой 8703231989 закрыт диапазон
+	rates = active_rates()
+	assert {code for code, rate in rates.items() if rate.version_id == log.version_id} == {"8703231989"}
+	all_rates = db_session.exec(select(TariffRate)).all()
+	assert len(all_rates) == len(CODES) + 1
+	assert sum(rate.retired_version_id == log.version_id for rate in all_rates) == 4
+	assert rates["8703231989"].ad_valorem_rate == 12.0
+	assert rates["8703231989"].excise_specific_rate == 500.0
+	assert "0402" not in rates
+	assert rates["8704211000"].excise_specific_rate is None
+	
+	# Откат - активация предыдущей версии, ее ставки на месте
+	activate_version(db_session, first_version.id)
+	db_session.commit()
+	rates = active_rates()
+	assert rates["8703231989"].ad_valorem_rate == 10.0
+	assert "0402" in rates
+	
+	# Синхронизация после отката: разница - с активной версией, строки - от последней (новых не нужно)
+	monkeypatch.setattr(settings, "TARIFF_VERSIONS_KEEP", 1)
+	after = sync_duties(db_session, str(csv_path), excise_items=excise)
+	db_session.commit()
+	assert (after.updated, after.deleted) == (1, 3)
+	assert active_rates()["8703231989"].ad_valorem_rate == 12.0 and "0402" not in active_rates()
+	
+	# Очистка оставила одну версию: строки, закрытые до нее, удалены, открытые на месте
+	assert [v.id for v in db_session.exec(select(TariffVersion)).all()] == [after.version_id]
+	assert len(db_session.exec(select(TariffRate)).all()) == len(CODES) - 3
+
+
+def test_excise_prefix_precedence_and_distinct_count(db_session, tmp_path, monkeypatch):
+	import json
+	from app.core.config import settings
+	from app.services.importers.import_excise import excise_overlay, import_excise_data
+	from app.services.tariff_versions import active_version_filter, get_active_version
+	
+	csv_path = tmp_path / "duties.csv"
+	csv_path.write_text(DUTIES_CSV, encoding="utf-8")
+	import_csv_to_db(db_session, str(csv_path))
+	db_session.commit()
+	
+	items = [
+		# Более точный префикс раньше в файле, но он важнее общего правила ниже
+		{"approx_codes": ["870323"], "excise_type": "specific", "excise_specific_amount": 900.0},
+		{"approx_codes": ["8703", "870380"], "excise_type": "ad_valorem", "excise_percent": 5.0},
+		# Тот же префикс позже в файле перекрывает предыдущий
+		{"approx_codes": ["870380"], "excise_type": "ad_valorem", "excise_percent": 7.0},
+	]
+	overlay = excise_overlay(CODES, items)
+	assert overlay["8703231981"]["excise_specific_rate"] == 900.0
+	assert overlay["8703800001"]["excise_ad_valorem_rate"] == 7.0
+	assert "0402" not in overlay
+	
+	(tmp_path / "excise_tnved_data.json").write_text(json.dumps(items), encoding="utf-8")
+	monkeypatch.setattr(settings, "EXCISE_DIR", tmp_path)
+	
+	# Пересекающиеся правила не считают код дважды
+	before = get_active_version(db_session).id
+	assert import_excise_data(db_session) == ["8703231981", "8703231989", "8703800001"]
+	db_session.commit()
+	
+	# Акцизы - новой проверенной версией из трех строк, прежняя версия остается для отката
+	version = get_active_version(db_session)
+	assert version.id != before and version.rate_count == len(CODES)
+	assert len(db_session.exec(select(TariffRate).where(TariffRate.version_id == version.id)).all()) == 3
+	rates = {
+		code: rate for rate, code in db_session.exec(
+			select(TariffRate, TnVedCode.code)
+			.join(TnVedCode, TnVedCode.id == TariffRate.tn_ved_code_id)
+			.where(active_version_filter())
+		)
+	}
+	assert rates["8703231989"].excise_type == ExciseType.SPECIFIC
+	assert rates["8703231989"].excise_specific_rate == 900.0
+	assert rates["8703800001"].excise_ad_valorem_rate == 7.0
+	# Повторное наложение ничего не меняет
+	assert import_excise_data(db_session) == []
@@ -0,0 +1,215 @@
+import numpy as np
+import pytest
+
+from app.models import TariffRate, TnVedCode
+from app.services.search import search_tnved_memory
+from app.services.trigram_index import TrigramIndex, similarity, trigrams
+
+
+@pytest.fixture
+def snapshot_codes():
+	return [
+		TnVedCode(id=1, code="8703231981", description="Автомобили легковые с двигателем внутреннего сгорания",
+		          calc_metadata={}),
+		TnVedCode(id=2, code="8703800001", description="Автомобили легковые с электродвигателем", calc_metadata={}),
+		TnVedCode(id=3, code="8704211000", description="Автомобили грузовые", calc_metadata={}),
+		TnVedCode(id=4, code="0402", description="Молоко и сливки сгущенные", calc_metadata={}),
+		TnVedCode(id=5, code="8415109000", description="Кондиционеры прочие", calc_metadata={}),
+	]
+
+
+@pytest.fixture
+def snapshot_rates():
+	return [TariffRate(id=1, tn_ved_code_id=1, rate_type="ad_valorem", ad_valorem_rate=15.0, vat_rate=12.0)]
+
+
+@pytest.fixture
+def snapshot_options():
+	return {"with_search_index": True}
+
+
+def test_trigrams_match_pg_trgm():
+	"""Эталонные значения из Postgres: show_trgm('word'), similarity('word', 'two words')"""
+	assert trigrams("word") == {"  w", " wo", "wor", "ord", "rd "}
+	assert similarity("word", "two words") == pytest.approx(0.36363637)
+	assert trigrams("Cat, cat!") == trigrams("cat")
+	assert similarity("", "cat") == 0.0
+
+
+def test_memory_search_matches_bruteforce(snapshot):
+	index = snapshot.search_index
+	for query in ("автомобили легковые", "молоко", "кондиционер", "грузовой автомобиль", "xyz"):
+		expected = sorted(
+			((c.code, similarity(c.description, query)) for c in snapshot.codes.values()),
+			key=lambda item: -item[1]
+		)
+		expected = [(code, round(score * 100, 1)) for code, score in expected if score >= 0.05][:3]
+		found = [(item.code, score) for item, score in search_tnved_memory(snapshot, query, limit=3)]
+		assert found == expected
+		assert [code for code, _ in index.search(query, limit=3)] == [code for code, _ in expected]
+
+
+def test_memory_search_by_code_prefix(snapshot):
+	found = search_tnved_memory(snapshot, "8703", limit=10)
+	assert [(item.code, score) for item, score in found] == [("8703231981", 100.0), ("8703800001", 100.0)]
+	assert found[0][0].rates[0].ad_valorem_rate == 15.0
+
+
+def test_index_without_snapshot():
+	index = TrigramIndex([("a", "Молоко"), ("b", None)])
+	assert len(index) == 2
+	assert index.search("молоко") == [("a", 1.0)]
+
+
+def test_search_index_built_lazily(build_snapshot, snapshot_codes, snapshot_rates):
+	snapshot = build_snapshot(snapshot_codes, snapshot_rates)
+	assert not snapshot.lazy_search_index.built
+	
+	assert search_tnved_memory(snapshot, "молоко", limit=1)[0][0].code == "0402"
+	assert snapshot.lazy_search_index.built
+	# Новый курс - тот же набор кодов, индекс не пересобирается
+	assert snapshot.with_usd_rate(13000.0, None).search_index is snapshot.search_index
+
+
+def test_code_prefix_range_and_count(snapshot):
+	assert snapshot.count_prefix("87") == 3
+	assert snapshot.count_prefix("8703") == 2
+	assert snapshot.count_prefix("9") == 0
+	assert [c.code for c in snapshot.codes_by_prefix("87", limit=2)] == ["8703231981", "8703800001"]
+	assert snapshot.codes_by_prefix("87", limit=0) == []
+	# Все коды - пустой префикс
+	assert snapshot.count_prefix("") == len(snapshot.codes)
+
+
+def test_classify_lines_matches_single_search(snapshot):
+	from app.services.search import classify_lines
+	
+	lines = ["автомобили легковые", "8703", "молоко сгущенное", "автомобили легковые", "xyz"]
+	results = list(classify_lines(snapshot, lines, limit=2))
+	
+	assert len(results) == len(lines)
+	for query, found in zip(lines, results):
+		expected = search_tnved_memory(snapshot, query, limit=2)
+		assert [(i.code, s) for i, s in found] == [(i.code, s) for i, s in expected]
+
+
+def test_semantic_index_roundtrip(snapshot, tmp_path):
+	from app.services.semantic_index import SemanticIndex, build_semantic_index
+	
+	build_semantic_index(((c.code, c.description) for c in snapshot.codes.values()), tmp_path)
+	index = SemanticIndex(tmp_path)
+	assert len(index) == len(snapshot.codes)
+	# Массивы открыты через mmap, а не прочитаны в память
+	assert isinstance(index.data, np.memmap)
+	
+	# Другой порядок и другие формы слов
+	found = index.search("легковой автомобиль электрический", limit=2)
+	assert found[0][0] == "8703800001"
+	assert found[0][1] > found[1][1] > 0
+	assert index.search("молоко", limit=5)[0][0] == "0402"
+	assert index.search("", limit=5) == []
+	
+	# Косинус документа с самим собой = 1
+	code, score = index.search(snapshot.codes["8415109000"].description, limit=1)[0]
+	assert code == "8415109000" and score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_semantic_index_reopened_after_snapshot_refresh(snapshot, db_session, tmp_path, monkeypatch):
+	"""Пересобранный офлайн индекс подхватывается при обновлении снимка, без перезапуска"""
+	from app.services import semantic_index
+	from app.services.snapshot import refresh_snapshot
+	
+	monkeypatch.setattr(semantic_index, "default_index_dir", lambda: tmp_path)
+	monkeypatch.setattr(semantic_index, "_index", None)
+	monkeypatch.setattr("app.services.snapshot._current", None)
+	docs = [(c.code, c.description) for c in snapshot.codes.values()]
+	
+	semantic_index.build_semantic_index(docs[:1], tmp_path)
+	assert len(semantic_index.get_semantic_index()) == 1
+	semantic_index.build_semantic_index(docs, tmp_path)
+	assert len(semantic_index.get_semantic_index()) == 1  # открытый индекс не перечитывается сам
+	
+	refresh_snapshot(db_session)
+	assert len(semantic_index.get_semantic_index()) == len(docs)
+
+
+def test_compact_view_from_snapshot(snapshot, monkeypatch):
+	from app.services.search import search_tnved_compact
+	
+	monkeypatch.setattr("app.services.snapshot._current", snapshot)
+	found = search_tnved_compact(session=None, query="8703", limit=5)
+	assert found[0] == {
+		"code": "8703231981",
+		"description": "Автомобили легковые с двигателем внутреннего сгорания",
+		"unit": None,
+		"match_percentage": 100.0,
+		"duty_rate": "15.0%",
+	}
+	assert found[1]["duty_rate"] is None
+
+
+def test_popularity_counter_flush_upsert(db_session):
+	from sqlmodel import select
+	from app.models import CodePopularity
+	from app.services.popularity import CALCULATED, PopularityCounter
+	
+	counter = PopularityCounter()
+	for code, kind in [("8703231981", "selected"), ("8703231981", CALCULATED), ("0402", "selected")]:
+		counter.record(code, kind)
+	assert counter.flush(db_session) == 2
+	assert counter.flush(db_session) == 0
+	counter.record("8703231981", CALCULATED)
+	assert counter.flush(db_session) == 1
+	
+	rows = {r.code: (r.selected_count, r.calculated_count) for r in db_session.exec(select(CodePopularity))}
+	assert rows == {"8703231981": (1, 2), "0402": (1, 0)}
+	
+	# Новый процесс читает итоги из БД
+	restarted = PopularityCounter()
+	restarted.load(db_session)
+	assert restarted.hot == ("8703231981", "0402")
+	assert restarted.boost("8703231981", 10.0) == pytest.approx(10.0)
+	assert 0 < restarted.boost("0402", 10.0) < 10.0
+	assert restarted.boost("8415109000", 10.0) == 0.0
+
+
+def test_popularity_boost_in_ranking(snapshot, monkeypatch):
+	from app.services.popularity import PopularityCounter
+	from app.services.search import rank_by_popularity
+	
+	counter = PopularityCounter()
+	monkeypatch.setattr("app.services.search.popularity", counter)
+	found = [("8703231981", 40.0), ("8703800001", 35.0)]
+	assert rank_by_popularity(snapshot, "легковые", found, 2) == found
+	
+	for _ in range(5):
+		counter.record("8703800001")
+	counter._refresh_hot()
+	# Текст: надбавка до 10 пунктов перекрывает разницу в 5, процент остается исходным
+	assert rank_by_popularity(snapshot, "легковые", found, 2) == [("8703800001", 35.0), ("8703231981", 40.0)]
+	# Цифры: популярный код под префиксом первым, даже если его не было на странице
+	assert rank_by_popularity(snapshot, "8703", [("8703231981", 100.0)], 2) == [
+		("8703800001", 100.0), ("8703231981", 100.0)
+	]
+	assert rank_by_popularity(snapshot, "0402", [("0402", 100.0)], 2) == [("0402", 100.0)]
+	# Postgres: сортировка по смешанной оценке (третий элемент), процент совпадения не меняется
+	found = [("8703231981", 10.0, 60.0), ("8703800001", 40.0, 30.0)]
+	assert rank_by_popularity(snapshot, "легковые", found, 2) == found
+
+
+def test_text_search_statement_bounded_by_index_order():
+	"""Оценка считается только по кандидатам: KNN по GiST (<->) и top по GIN (@@), каждый с LIMIT"""
+	from unittest.mock import MagicMock
+	from sqlalchemy.dialects import postgresql
+	from app.services.search import _text_search_statement
+	
+	stmt = _text_search_statement(MagicMock(), "молоко", 5, TnVedCode.code)
+	compiled = stmt.compile(dialect=postgresql.dialect())
+	sql = str(compiled)
+	
+	assert "ORDER BY tn_ved_codes.description <-> %(description_2)s" in sql
+	assert "UNION" in sql and sql.count("LIMIT") == 3
+	# match_percentage - чистая similarity (как в памяти), смешанная оценка только для сортировки
+	assert "similarity(tn_ved_codes.description, %(similarity_1)s) AS score" in sql
+	assert sql.endswith("ORDER BY rank DESC \n LIMIT %(param_3)s")
+	assert [compiled.params[f"param_{i}"] for i in (1, 2, 3)] == [100, 100, 5]
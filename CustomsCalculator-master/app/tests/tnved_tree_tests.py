@@ -0,0 +1,52 @@
+import pytest
+from sqlmodel import select
+
+from app.models import TariffRate, TariffVersion, TariffVersionStatus, TnVedCode
+from app.services.tnved_tree import rebuild_tnved_tree, tree_children
+
+
+@pytest.fixture
+def db_seed():
+	codes = [
+		("8703", None), ("870323", "8703"), ("8703231981", "870323"), ("8703231989", "870323"),
+		# parent_code не заполнен - родитель по самому длинному префиксу
+		("8703800001", None),
+		("0402", None), ("0402100000", "0402"),
+	]
+	seed = [
+		TnVedCode(id=i, code=code, parent_code=parent, description=f"Товар {code}", calc_metadata={})
+		for i, (code, parent) in enumerate(codes, start=1)
+	]
+	seed.append(TariffVersion(id=1, status=TariffVersionStatus.ACTIVE))
+	for code_id, rate in [(3, 15.0), (4, 30.0), (5, 0.0), (7, 10.0)]:
+		seed.append(TariffRate(version_id=1, tn_ved_code_id=code_id, rate_type="ad_valorem", ad_valorem_rate=rate, vat_rate=12.0))
+	return seed
+
+
+def test_rebuild_tree_paths_and_aggregates(db_session):
+	assert rebuild_tnved_tree(db_session) == 7
+	nodes = {c.code: c for c in db_session.exec(select(TnVedCode)).all()}
+	
+	assert nodes["8703231981"].path == "8703.870323.8703231981"
+	assert nodes["8703231981"].depth == 2
+	assert nodes["8703800001"].path == "8703.8703800001"
+	
+	assert nodes["8703"].descendant_count == 4
+	assert (nodes["8703"].min_duty_rate, nodes["8703"].max_duty_rate) == (0.0, 30.0)
+	assert (nodes["870323"].min_duty_rate, nodes["870323"].max_duty_rate) == (15.0, 30.0)
+	assert nodes["8703231981"].descendant_count == 0
+
+
+def test_tree_children_keyset_pagination(db_session):
+	rebuild_tnved_tree(db_session)
+	
+	assert [c.code for c in tree_children(db_session)] == ["0402", "8703"]
+	
+	first = tree_children(db_session, "8703", limit=1)
+	assert [c.code for c in first] == ["870323"]
+	rest = tree_children(db_session, "8703", after=first[-1].code, limit=1)
+	assert [c.code for c in rest] == ["8703800001"]
+	assert tree_children(db_session, "8703", after="8703800001") == []
+	
+	assert [c.code for c in tree_children(db_session, "870323")] == ["8703231981", "8703231989"]
+	assert tree_children(db_session, "9999") is None
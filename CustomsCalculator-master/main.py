@@ -2,15 +2,19 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from app.api.v1 import api
+from app.services.metrics import server_timing_middleware
 
 app = FastAPI(
 	title="Customs Calculator API",
 	description="API для расчета таможенных платежей Узбекистана",
 	version="1.0.0",
 	debug=True,
+	lifespan=api.lifespan,
 )
 
 app.include_router(api.router)
+# Время по стадиям расчета и число SQL-запросов -> заголовок Server-Timing
+app.middleware("http")(server_timing_middleware)
 
 # 1. Монтируем статику (чтобы работали картинки, если будут, или css файлы)
 app.mount("/static", StaticFiles(directory="static"), name="static")
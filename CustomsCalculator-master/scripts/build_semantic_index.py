@@ -0,0 +1,33 @@
+import argparse
+import logging
+from pathlib import Path
+
+from sqlmodel import Session, select
+
+from app.core.database import engine
+from app.models import TnVedCode
+from app.services.semantic_index import build_semantic_index, default_index_dir
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+	"""
+	Офлайн-сборка TF-IDF индекса описаний для /tnved/search?mode=semantic.
+	Запускать после импорта справочника ТН ВЭД; сервер подхватит индекс при следующем
+	обновлении снимка (синхронизация ставок, активация версии) или при старте.
+	"""
+	parser = argparse.ArgumentParser(description="Сборка семантического индекса ТН ВЭД")
+	parser.add_argument("--out", type=Path, default=default_index_dir())
+	args = parser.parse_args()
+	
+	with Session(engine) as session:
+		docs = session.exec(select(TnVedCode.code, TnVedCode.description).order_by(TnVedCode.code)).all()
+	logger.info(f"📂 Описаний: {len(docs)}")
+	
+	build_semantic_index(docs, args.out)
+
+
+if __name__ == "__main__":
+	main()
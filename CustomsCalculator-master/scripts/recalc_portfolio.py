@@ -0,0 +1,54 @@
+import argparse
+import logging
+
+import pandas as pd
+from sqlmodel import Session
+
+from app.core.database import engine
+from app.services.bulk_engine import BulkDutyEngine
+from app.services.snapshot import TariffSnapshot
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+	"""
+	Пересчет исторических позиций по текущему тарифу.
+	Колонки входного CSV совпадают с полями CalculationRequest.
+	"""
+	parser = argparse.ArgumentParser(description="Массовый пересчет платежей (NumPy)")
+	parser.add_argument("input_csv")
+	parser.add_argument("output_csv")
+	args = parser.parse_args()
+	
+	df = pd.read_csv(args.input_csv, dtype={"tn_code": str, "origin_country_code": str})
+	logger.info(f"📂 Прочитано позиций: {len(df)}")
+	
+	with Session(engine) as session:
+		snapshot = TariffSnapshot.load(session)
+	
+	def column(name):
+		return df[name].fillna(0).to_numpy() if name in df else None
+	
+	result = BulkDutyEngine(snapshot).calculate(
+		codes=df["tn_code"].fillna("").to_numpy(),
+		customs_values=column("customs_value"),
+		weights=column("weight_kg"),
+		quantities=column("quantity_pcs"),
+		volumes=column("volume_cm3"),
+		liters=column("liter_qty"),
+		years=column("manufacturing_year"),
+		power_hp=column("power_hp"),
+		origins=df["origin_country_code"].where(df["origin_country_code"].notna(), None).tolist()
+		if "origin_country_code" in df else None,
+	)
+	
+	for key, values in result.items():
+		df[key] = values
+	df.to_csv(args.output_csv, index=False)
+	logger.info(f"✅ Результат сохранен: {args.output_csv} (не найдено кодов: {int((~result['found']).sum())})")
+
+
+if __name__ == "__main__":
+	main()